@@ -0,0 +1,233 @@
+"""
+Shared, pooled HTTP transport for plugins which talk to web APIs
+"""
+# pylint: disable=global-statement
+
+import logging
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from AppConfig import AppConfig
+from RateLimiter import RateLimiter
+
+DEFAULT_CONNECT_TIMEOUT = 10.0  # Seconds to wait for a connection
+DEFAULT_READ_TIMEOUT = 30.0  # Seconds to wait for the server to send anything
+DEFAULT_RETRIES = 3  # Times a retryable request is retried, after a connection error or one of _RETRY_STATUSES
+DEFAULT_BACKOFF_FACTOR = 0.5  # Retries wait 0.5s, 1s, 2s...
+DEFAULT_MAX_RETRY_AFTER = 30.0  # The most seconds to wait when a server asks us to retry after a while
+DEFAULT_POOL_SIZE = 4  # Connections kept alive to each host
+
+_RETRY_STATUSES = (429, 500, 502, 503, 504)
+_IDEMPOTENT_METHODS = Retry.DEFAULT_ALLOWED_METHODS  # Retried by default, as repeating them does no harm
+
+
+class HostStats:
+    """
+    Requests made to a host
+    """
+
+    __slots__ = ('requests', 'errors', 'retries', 'total_seconds', 'max_seconds')
+
+    def __init__(self) -> None:
+        self.requests = 0
+        self.errors = 0  # Requests which failed to get a response, or got an error status
+        self.retries = 0
+        self.total_seconds = 0.0  # Including the retries
+        self.max_seconds = 0.0
+
+    @property
+    def average_seconds(self) -> float:
+        """
+        The average duration of a request, including its retries
+        """
+        return self.total_seconds / self.requests if self.requests else 0.0
+
+    def __repr__(self) -> str:
+        return (f'{self.requests} requests, {self.errors} errors, {self.retries} retries, '
+                f'{self.average_seconds * 1000:.0f}ms average, {self.max_seconds * 1000:.0f}ms max')
+
+
+class HttpTransport:
+    """
+    Makes HTTP requests with a requests.Session per host, so connections are pooled and kept alive between polls rather
+    than a new connection (and TLS handshake) being made for each request.
+    Every request has connect and read timeouts, unless it's given its own.  Idempotent requests are retried with
+    exponential backoff after a connection error or a 429/5xx response - honouring Retry-After.  Others, e.g. a POST
+    spending a refresh token, aren't unless they ask to be.  Once out of retries the last response is returned, so
+    callers can still raise_for_status().
+    Requests, and each of their retries, wait for the host's rate limit if it has one, and their responses are recorded
+    with the rate_limiter so polling backs off when it's struggling.
+    The number and duration of the requests to each host are recorded in stats().
+    """
+
+    # pylint: disable=too-many-arguments,too-many-positional-arguments,too-many-instance-attributes
+    def __init__(self, connect_timeout: float = DEFAULT_CONNECT_TIMEOUT, read_timeout: float = DEFAULT_READ_TIMEOUT,
+                 retries: int = DEFAULT_RETRIES, backoff_factor: float = DEFAULT_BACKOFF_FACTOR,
+                 max_retry_after: float = DEFAULT_MAX_RETRY_AFTER, pool_size: int = DEFAULT_POOL_SIZE,
+                 rate_limiter: RateLimiter = None) -> None:
+        self._logger = logging.getLogger('http')
+        self._timeout = (connect_timeout, read_timeout)
+        self._retries = retries
+        self._backoff_factor = backoff_factor
+        self._max_retry_after = max_retry_after
+        self._pool_size = pool_size
+        self.rate_limiter = rate_limiter if rate_limiter is not None else RateLimiter()
+        self._sessions = {}  # scheme://host => Session
+        self._stats = {}  # host => HostStats
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config: AppConfig):
+        """
+        Creates a transport with the settings in the [DEFAULT] section of the config
+        """
+        return cls(connect_timeout=config.get_float_or_default('DEFAULT', 'httpConnectTimeout', DEFAULT_CONNECT_TIMEOUT),
+                   read_timeout=config.get_float_or_default('DEFAULT', 'httpReadTimeout', DEFAULT_READ_TIMEOUT),
+                   retries=config.get_int_or_default('DEFAULT', 'httpRetries', DEFAULT_RETRIES),
+                   backoff_factor=config.get_float_or_default('DEFAULT', 'httpBackoffFactor', DEFAULT_BACKOFF_FACTOR),
+                   max_retry_after=config.get_float_or_default('DEFAULT', 'httpMaxRetryAfter',
+                                                               DEFAULT_MAX_RETRY_AFTER),
+                   pool_size=config.get_int_or_default('DEFAULT', 'httpPoolSize', DEFAULT_POOL_SIZE),
+                   rate_limiter=RateLimiter.from_config(config))
+
+    def session(self, url: str) -> requests.Session:
+        """
+        Returns the session for the url's host, creating it the first time the host is used
+        """
+        parts = urlsplit(url)
+        key = f'{parts.scheme}://{parts.netloc}'
+        session = self._sessions.get(key)
+        if session is None:
+            with self._lock:
+                session = self._sessions.get(key)
+                if session is None:
+                    self._logger.debug(f'Creating a session for {key}')
+                    session = requests.Session()
+                    # Requests are retried by request(), so each retry waits for the rate limit
+                    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self._pool_size, max_retries=0)
+                    session.mount(f'{parts.scheme}://', adapter)
+                    self._sessions[key] = session
+        return session
+
+    def request(self, method: str, url: str, retry: bool = None, **kwargs) -> requests.Response:
+        """
+        Makes a request, with the same arguments as requests.request.
+        retry - whether it's retried, by default only if its method is idempotent.  True for a request which only reads
+        (even if it's a POST), False for one which mustn't be repeated
+        """
+        kwargs.setdefault('timeout', self._timeout)
+        if retry is None:
+            retry = method.upper() in _IDEMPOTENT_METHODS
+        host = urlsplit(url).netloc
+        session = self.session(url)
+        self.rate_limiter.acquire(host)
+        started = time.perf_counter()
+        response = None
+        retries = 0
+        try:
+            while True:
+                try:
+                    response = session.request(method, url, **kwargs)
+                except (requests.ConnectionError, requests.Timeout):
+                    response = None
+                    if not retry or retries >= self._retries:
+                        raise
+                else:
+                    if not retry or retries >= self._retries or response.status_code not in _RETRY_STATUSES:
+                        return response
+                    response.close()
+                self.rate_limiter.record(host, None if response is None else response.status_code)
+                time.sleep(self._retry_delay(retries, response))
+                retries += 1
+                self.rate_limiter.acquire(host)
+        finally:
+            self._record(host, time.perf_counter() - started, response, retries)
+
+    def _retry_delay(self, retries: int, response: requests.Response) -> float:
+        """
+        Returns how long to wait before the next retry: as long as the server says, but no longer than max_retry_after,
+        or else the exponential backoff
+        """
+        if response is not None and response.status_code in Retry.RETRY_AFTER_STATUS_CODES:
+            retry_after = response.headers.get('Retry-After')
+            if retry_after:
+                try:
+                    return min(Retry().parse_retry_after(retry_after), self._max_retry_after)
+                except ValueError:
+                    pass  # Not a number of seconds or a date, so use the backoff
+        return self._backoff_factor * 2 ** retries
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        """
+        Makes a GET request, with the same arguments as requests.get and request()'s retry
+        """
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url: str, **kwargs) -> requests.Response:
+        """
+        Makes a POST request, with the same arguments as requests.post and request()'s retry.  It's not retried unless
+        retry=True
+        """
+        return self.request('POST', url, **kwargs)
+
+    def _record(self, host: str, seconds: float, response: requests.Response, retries: int):
+        self.rate_limiter.record(host, None if response is None else response.status_code)
+        with self._lock:
+            stats = self._stats.get(host)
+            if stats is None:
+                stats = self._stats[host] = HostStats()
+            stats.requests += 1
+            if response is None or response.status_code >= 400:
+                stats.errors += 1
+            stats.retries += retries
+            stats.total_seconds += seconds
+            stats.max_seconds = max(stats.max_seconds, seconds)
+
+    def stats(self) -> dict:
+        """
+        Returns the HostStats of each host requests have been made to
+        """
+        with self._lock:
+            return dict(self._stats)
+
+    def close(self):
+        """
+        Closes the sessions, and their connections
+        """
+        with self._lock:
+            for session in self._sessions.values():
+                session.close()
+            self._sessions = {}
+
+
+_transport = None
+_transport_lock = threading.Lock()
+
+
+def configure_transport(config: AppConfig) -> HttpTransport:
+    """
+    Replaces the shared transport with one using the settings in the config
+    """
+    global _transport
+    with _transport_lock:
+        if _transport is not None:
+            _transport.close()
+        _transport = HttpTransport.from_config(config)
+        return _transport
+
+
+def get_transport() -> HttpTransport:
+    """
+    Returns the transport shared by all the plugins, with the default settings if it hasn't been configured
+    """
+    global _transport
+    if _transport is None:
+        with _transport_lock:
+            if _transport is None:
+                _transport = HttpTransport()
+    return _transport
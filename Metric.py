@@ -1,6 +1,15 @@
 """Metric module"""
 
-from datetime import datetime
+import math
+from array import array
+from datetime import datetime, timedelta, timezone
+
+from SeriesRegistry import REGISTRY
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+_NAIVE_EPOCH = datetime(1970, 1, 1)
+
+MISSING_TIMESTAMP = -2 ** 63  # Stands in for a metric without a timestamp of its own in MetricBatch.timestamps
 
 
 class Metric:
@@ -8,20 +17,115 @@ class Metric:
     Represents metric values.
     """
 
+    __slots__ = ('series_id', 'plugin', 'descriptor', 'actual', 'target', 'text', 'timestamp')
+
     def __init__(self,
                  plugin: str,
                  descriptor: str,
                  actual: float = None,
                  target: float = None,
                  text: str = None,
-                 timestamp: datetime = None):
-        self.plugin = self._sanitise_input(plugin)
-        self.descriptor = self._sanitise_input(descriptor)
+                 timestamp: datetime = None,
+                 tags: dict = None):
+        # The registry keeps the sanitised names, so they're only worked out the first time the series is seen
+        self.series_id = REGISTRY.get_id(plugin, descriptor, tags)
+        self.plugin, self.descriptor = REGISTRY.name(self.series_id)
         self.actual = actual
         self.target = target
         self.text = text
         self.timestamp = timestamp
 
-    @staticmethod
-    def _sanitise_input(val: str):
-        return val.replace(' ', '').lower()
+    @property
+    def tags(self) -> dict:
+        """
+        Tags describing the metric's series, e.g. the location a zone is in, or None
+        """
+        return REGISTRY.tags(self.series_id)
+
+
+def _to_float(value) -> float:
+    return math.nan if value is None or value == '' else float(value)
+
+
+def _from_float(value: float):
+    # NaN is the only value not equal to itself
+    return None if value != value else value  # pylint: disable=comparison-with-itself
+
+
+def _to_epoch_microseconds(timestamp: datetime) -> int:
+    if timestamp is None:
+        return MISSING_TIMESTAMP
+    delta = timestamp - (_NAIVE_EPOCH if timestamp.tzinfo is None else _EPOCH)
+    return (delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds
+
+
+class MetricBatch:
+    """
+    A batch of metrics stored column-wise, as parallel arrays, rather than as an object per metric:
+        series_ids - the id of each metric's series in the SeriesRegistry
+        actual, target - floats, NaN where there's no value
+        text - strings, None where there's no value
+        timestamps - microseconds since the epoch (UTC), MISSING_TIMESTAMP where the metric has no timestamp of its own
+    Iterating the batch yields Metric objects, so it can be used wherever a list of metrics is expected, but outputs
+    which deal in lots of metrics can read the columns directly instead.
+    """
+
+    __slots__ = ('series_ids', 'actual', 'target', 'text', 'timestamps')
+
+    def __init__(self) -> None:
+        self.series_ids = array('l')
+        self.actual = array('d')
+        self.target = array('d')
+        self.text = []
+        self.timestamps = array('q')
+
+    @classmethod
+    def from_metrics(cls, metrics):
+        """
+        Creates a batch holding the supplied metrics
+        """
+        batch = cls()
+        for metric in metrics:
+            batch._append(metric.series_id, metric.actual, metric.target, metric.text, metric.timestamp)
+        return batch
+
+    def append(self, plugin: str, descriptor: str, actual: float = None, target: float = None, text: str = None,
+               timestamp: datetime = None, tags: dict = None):
+        """
+        Adds a metric to the batch, with the same arguments as Metric
+        """
+        # pylint: disable=too-many-arguments,too-many-positional-arguments
+        self._append(REGISTRY.get_id(plugin, descriptor, tags), actual, target, text, timestamp)
+
+    def _append(self, series_id, actual, target, text, timestamp):
+        # pylint: disable=too-many-arguments
+        self.series_ids.append(series_id)
+        self.actual.append(_to_float(actual))
+        self.target.append(_to_float(target))
+        self.text.append(None if text is None or text == '' else text)
+        self.timestamps.append(_to_epoch_microseconds(timestamp))
+
+    def extend(self, metrics):
+        """
+        Adds each of the metrics to the batch
+        """
+        for metric in metrics:
+            self._append(metric.series_id, metric.actual, metric.target, metric.text, metric.timestamp)
+
+    def __len__(self) -> int:
+        return len(self.series_ids)
+
+    def __getitem__(self, index: int) -> Metric:
+        metric = Metric.__new__(Metric)
+        metric.series_id = self.series_ids[index]
+        metric.plugin, metric.descriptor = REGISTRY.name(metric.series_id)
+        metric.actual = _from_float(self.actual[index])
+        metric.target = _from_float(self.target[index])
+        metric.text = self.text[index]
+        timestamp = self.timestamps[index]
+        metric.timestamp = None if timestamp == MISSING_TIMESTAMP else _NAIVE_EPOCH + timedelta(microseconds=timestamp)
+        return metric
+
+    def __iter__(self):
+        for index in range(len(self.series_ids)):
+            yield self[index]
@@ -0,0 +1,242 @@
+"""
+Per-host rate limiting, which backs off when a web API is struggling
+"""
+
+import logging
+import threading
+import time
+
+import requests
+
+from AppConfig import AppConfig
+
+RATE_LIMITS_SECTION = 'RateLimits'  # host = requests per minute[, burst]
+
+DEFAULT_BACKOFF_FACTOR = 2.0  # The polling interval is multiplied by this each time a host asks us to slow down
+DEFAULT_MAX_BACKOFF = 16.0  # The most the polling interval is stretched by
+DEFAULT_RECOVERY_FACTOR = 0.75  # The stretch is multiplied by this after each healthy response, until it's back to 1
+DEFAULT_FAILURES_BEFORE_BACKOFF = 3  # Consecutive connection errors/5xx responses which count as being asked to slow down
+DEFAULT_MAX_WAIT = 30.0  # The most seconds a request waits for the rate limit, before it's abandoned
+
+
+class RateLimitExceeded(requests.RequestException):
+    """
+    Raised when a request would have to wait too long for the host's rate limit
+    """
+
+
+class TokenBucket:
+    """
+    Allows up to capacity requests at once, refilling at rate requests per second
+    """
+
+    def __init__(self, rate: float, capacity: float, clock=time.monotonic) -> None:
+        self.rate = rate
+        self.capacity = capacity
+        self._clock = clock
+        self._tokens = capacity
+        self._updated = clock()
+
+    def _refill(self, rate: float):
+        now = self._clock()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * rate)
+        self._updated = now
+
+    def take(self, rate: float) -> float:
+        """
+        Takes a token, refilling at the supplied rate, returning 0 if one was available or else the seconds until one
+        will be - in which case nothing is taken
+        """
+        self._refill(rate)
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return 0.0
+        return (1 - self._tokens) / rate
+
+
+class HostLimiter:
+    """
+    The rate limit of a single host, and how far its polling interval is stretched.
+    The stretch goes up by backoff_factor when the host responds with a 429, or after failures_before_backoff
+    consecutive connection errors/5xx responses, and then comes back down gradually with each healthy response.
+    Any rate limit is slowed by the same amount, so the host gets fewer requests while it's struggling
+    """
+
+    # pylint: disable=too-many-arguments,too-many-positional-arguments,too-many-instance-attributes
+    def __init__(self, host: str, rate_per_minute: float = None, burst: float = None,
+                 backoff_factor: float = DEFAULT_BACKOFF_FACTOR, max_backoff: float = DEFAULT_MAX_BACKOFF,
+                 recovery_factor: float = DEFAULT_RECOVERY_FACTOR,
+                 failures_before_backoff: int = DEFAULT_FAILURES_BEFORE_BACKOFF, clock=time.monotonic) -> None:
+        self._logger = logging.getLogger('ratelimiter')
+        self.host = host
+        self.rate_per_minute = rate_per_minute
+        self._bucket = None if not rate_per_minute else \
+            TokenBucket(rate_per_minute / 60, burst if burst else max(rate_per_minute / 60, 1.0), clock)
+        self._backoff_factor = backoff_factor
+        self._max_backoff = max_backoff
+        self._recovery_factor = recovery_factor
+        self._failures_before_backoff = failures_before_backoff
+        self._failures = 0
+        self._lock = threading.Lock()
+        self.stretch = 1.0  # What the polling interval of plugins using the host is multiplied by
+        self.throttled = 0  # Requests which have waited for the rate limit
+        self.rejected = 0  # Requests which were abandoned rather than wait too long
+
+    @property
+    def effective_rate_per_minute(self) -> float:
+        """
+        The rate limit after it's been slowed by the stretch, or None if the host hasn't got one
+        """
+        return None if self._bucket is None else self.rate_per_minute / self.stretch
+
+    def wait_time(self) -> float:
+        """
+        Takes a token, returning 0 if there was one or else how long to wait before trying again
+        """
+        if self._bucket is None:
+            return 0.0
+        with self._lock:
+            return self._bucket.take(self._bucket.rate / self.stretch)
+
+    def acquire(self, max_wait: float = DEFAULT_MAX_WAIT, sleep=time.sleep):
+        """
+        Waits until the request is allowed by the rate limit, raising RateLimitExceeded if that's more than max_wait
+        """
+        waited = 0.0
+        wait = self.wait_time()
+        if wait > 0:
+            self.throttled += 1
+        while wait > 0:
+            if waited + wait > max_wait:
+                self.rejected += 1
+                raise RateLimitExceeded(f'{self.host} is limited to {self.effective_rate_per_minute:.3g} requests per '
+                                        f'minute, the next is allowed in {wait:.1f}s')
+            sleep(wait)
+            waited += wait
+            wait = self.wait_time()
+
+    def record(self, status: int = None):
+        """
+        Records a response's status code, or None for a connection error, backing off or recovering accordingly
+        """
+        with self._lock:
+            stretch = self.stretch
+            if status == 429:
+                self._failures = 0
+                self._back_off(f'{status} Too Many Requests')
+            elif status is None or status >= 500:
+                self._failures += 1
+                if self._failures >= self._failures_before_backoff:
+                    self._failures = 0
+                    self._back_off(f'{self._failures_before_backoff} failures in a row')
+            else:
+                self._failures = 0
+                self.stretch = max(1.0, self.stretch * self._recovery_factor)
+                if self.stretch < stretch:
+                    self._logger.info(f'{self.host} is healthy again, recovering - {self._describe()}')
+
+    def _back_off(self, reason: str):
+        self.stretch = min(self._max_backoff, self.stretch * self._backoff_factor)
+        self._logger.warning(f'{self.host} is struggling ({reason}), backing off - {self._describe()}')
+
+    def _describe(self) -> str:
+        description = f'polling interval x{self.stretch:.2g}'
+        if self._bucket is not None:
+            description += f', {self.effective_rate_per_minute:.3g} of {self.rate_per_minute:g} requests per minute'
+        return description
+
+    def __repr__(self) -> str:
+        return f'{self._describe()}, {self.throttled} throttled, {self.rejected} rejected'
+
+
+class RateLimiter:
+    """
+    Keeps a HostLimiter for each host requests are made to, with the rate limits configured in the [RateLimits] section:
+        api.netatmo.com = 50, 10    ; requests per minute[, burst]
+    Hosts without a rate limit are never throttled, but their stretch still goes up and down
+    """
+
+    # pylint: disable=too-many-arguments,too-many-positional-arguments,too-many-instance-attributes
+    def __init__(self, rate_limits: dict = None, backoff_factor: float = DEFAULT_BACKOFF_FACTOR,
+                 max_backoff: float = DEFAULT_MAX_BACKOFF, recovery_factor: float = DEFAULT_RECOVERY_FACTOR,
+                 failures_before_backoff: int = DEFAULT_FAILURES_BEFORE_BACKOFF, max_wait: float = DEFAULT_MAX_WAIT,
+                 clock=time.monotonic) -> None:
+        self._rate_limits = {host.lower(): limit for host, limit in (rate_limits or {}).items()}
+        self._backoff_factor = backoff_factor
+        self._max_backoff = max_backoff
+        self._recovery_factor = recovery_factor
+        self._failures_before_backoff = failures_before_backoff
+        self.max_wait = max_wait
+        self._clock = clock
+        self._hosts = {}  # host => HostLimiter
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config: AppConfig):
+        """
+        Creates a rate limiter with the rate limits in the [RateLimits] section and the settings in [DEFAULT]
+        """
+        logger = logging.getLogger('ratelimiter')
+        rate_limits = {}
+        if config.has_section(RATE_LIMITS_SECTION):
+            for host in config.options(RATE_LIMITS_SECTION):
+                if host in config.defaults():
+                    continue
+                try:
+                    values = [float(v) for v in config.get(RATE_LIMITS_SECTION, host).split(',')]
+                    rate_limits[host] = (values[0], values[1] if len(values) > 1 else None)
+                    logger.info(f'{host} is limited to {values[0]:g} requests per minute')
+                except (ValueError, AttributeError):
+                    logger.error(f'Rate limit of {host} must be requests per minute[, burst], not '
+                                 f'\'{config.get(RATE_LIMITS_SECTION, host)}\' - ignoring it')
+
+        return cls(rate_limits,
+                   backoff_factor=config.get_float_or_default('DEFAULT', 'rateLimitBackoffFactor',
+                                                              DEFAULT_BACKOFF_FACTOR),
+                   max_backoff=config.get_float_or_default('DEFAULT', 'rateLimitMaxBackoff', DEFAULT_MAX_BACKOFF),
+                   recovery_factor=config.get_float_or_default('DEFAULT', 'rateLimitRecoveryFactor',
+                                                               DEFAULT_RECOVERY_FACTOR),
+                   failures_before_backoff=config.get_int_or_default('DEFAULT', 'rateLimitFailures',
+                                                                     DEFAULT_FAILURES_BEFORE_BACKOFF),
+                   max_wait=config.get_float_or_default('DEFAULT', 'rateLimitMaxWait', DEFAULT_MAX_WAIT))
+
+    def host(self, host: str) -> HostLimiter:
+        """
+        Returns the limiter of the host, creating it the first time the host is used
+        """
+        host = host.lower()
+        limiter = self._hosts.get(host)
+        if limiter is None:
+            with self._lock:
+                limiter = self._hosts.get(host)
+                if limiter is None:
+                    rate, burst = self._rate_limits.get(host, (None, None))
+                    limiter = HostLimiter(host, rate, burst, self._backoff_factor, self._max_backoff,
+                                          self._recovery_factor, self._failures_before_backoff, self._clock)
+                    self._hosts[host] = limiter
+        return limiter
+
+    def acquire(self, host: str):
+        """
+        Waits until a request to the host is allowed, raising RateLimitExceeded if it would have to wait too long
+        """
+        self.host(host).acquire(self.max_wait)
+
+    def record(self, host: str, status: int = None):
+        """
+        Records the status code of a response from the host, or None for a connection error
+        """
+        self.host(host).record(status)
+
+    def stretch(self, hosts) -> float:
+        """
+        Returns how far the polling interval of a plugin using the hosts is stretched - that of its most struggling host
+        """
+        return max((self.host(host).stretch for host in hosts), default=1.0)
+
+    def limiters(self) -> dict:
+        """
+        Returns the HostLimiter of each host requests have been made to
+        """
+        with self._lock:
+            return dict(self._hosts)
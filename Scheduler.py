@@ -2,11 +2,16 @@
 Helpers for scheduling tasks.
 """
 
+import heapq
 import logging
-from datetime import datetime
+import random
+import time
+from datetime import datetime, timedelta
 
 from croniter import croniter
 
+MISSED_TICK_POLICIES = ('skip', 'catchup')
+
 
 class Scheduler:
 
@@ -14,6 +19,7 @@ class Scheduler:
         self.__logger = logging.getLogger('scheduler')
         self.plugin_name = plugin_name
         self.polling_interval = self._validate_interval(polling_interval)
+        self._dispatched = None  # The tick the plugin is being run for, which it hasn't yet checked
 
     def _validate_interval(self, interval: str) -> str:
         """
@@ -41,7 +47,16 @@ class Scheduler:
 
         return ret_val
 
+    def dispatch(self, tick: datetime):
+        """
+        Records that the plugin is being run for the supplied tick, so its can_run_now() agrees however late it's called
+        """
+        self._dispatched = tick
+
     def can_run_now(self) -> bool:
+        tick, self._dispatched = self._dispatched, None
+        if tick is not None:
+            return True
         return croniter.match(self.polling_interval, datetime.utcnow())
 
     def time_until_next_run(self) -> float:
@@ -49,3 +64,183 @@ class Scheduler:
         cron = croniter(self.polling_interval, cur_run_time)
         next_run = cron.get_next(datetime)
         return float((next_run - cur_run_time).total_seconds())
+
+
+class _Schedule:
+    """The schedule of a single plugin"""
+
+    # pylint: disable=too-many-arguments,too-many-instance-attributes
+    def __init__(self, name: str, polling_interval: str, offset: float, jitter: float, now: datetime) -> None:
+        self.name = name
+        self.polling_interval = polling_interval
+        self.offset = offset  # Seconds after each tick the plugin is run
+        self.jitter = jitter  # Up to this many seconds are added at random to the offset, for each tick
+        self.cron = None  # Parsed once, then iterated
+        self.tick = None  # The next time (UTC) the plugin is due according to its pollingInterval
+        self.fire_at = None  # When the plugin will actually be run for that tick - the tick plus offset and jitter
+        self.last_run = None  # The tick the plugin was last run for
+        self.last_period = None  # Seconds from the tick the plugin was last run for to the tick after it
+        self.restart(now)
+
+    def restart(self, now: datetime):
+        """
+        Starts the schedule afresh from now, with the first tick whose offset time hasn't yet passed
+        """
+        self.cron = croniter(self.polling_interval, now - timedelta(seconds=self.offset))
+        self.tick = self.cron.get_next(datetime)
+
+    def period(self) -> float:
+        """
+        Returns the seconds between the next tick and the one after
+        """
+        cron = croniter(self.polling_interval, self.tick)
+        first = cron.get_next(datetime)
+        return (cron.get_next(datetime) - first).total_seconds()
+
+
+class PollingScheduler:
+    """
+    Schedules each plugin according to its own cron-style pollingInterval.
+    The plugins are kept in a min-heap ordered by when they are next due, so the caller can sleep until exactly then
+    and run just the plugins which are due.  The wait is measured on the monotonic clock, so isn't thrown by the
+    system clock being changed, although a plugin is also due once its time has passed on the system clock (e.g.
+    after the machine has been suspended).
+
+    Rather than running right on each tick a plugin can be run a fixed offset after it, plus a random amount of jitter,
+    and stagger() spreads the plugins evenly across their intervals, so they don't all hit the network at once.
+
+    The polling interval of a plugin can be stretched, e.g. while the web API it reads from is asking us to slow down,
+    with stretch(name) returning what its interval is multiplied by.  Ticks are skipped until that long has passed since
+    the plugin last ran.
+
+    A tick is missed when the plugin is still waiting to run for it (e.g. because an earlier poll over-ran) by the time
+    it's due to run for its next tick too.  What happens then depends on missed_ticks:
+        skip - the missed ticks are dropped and the plugin next runs at its next tick in the future
+        catchup - the plugin runs once, straight away, to make up for the missed ticks and then carries on as scheduled
+    """
+
+    # pylint: disable=too-many-arguments,too-many-instance-attributes
+    def __init__(self, missed_ticks: str = 'skip', clock=time.monotonic, wall_clock=datetime.utcnow,
+                 jitter_source: random.Random = None, stretch=None) -> None:
+        self.__logger = logging.getLogger('scheduler')
+        if missed_ticks not in MISSED_TICK_POLICIES:
+            self.__logger.error(f'missedTicks must be one of {", ".join(MISSED_TICK_POLICIES)}, not \'{missed_ticks}\'.'
+                                f'  Defaulting to \'skip\'.')
+            missed_ticks = 'skip'
+        self._missed_ticks = missed_ticks
+        self._clock = clock
+        self._wall_clock = wall_clock
+        self._random = jitter_source if jitter_source is not None else random.Random()
+        self._stretch = stretch if stretch is not None else lambda name: 1.0
+        self._heap = []  # (monotonic time due, sequence, _Schedule)
+        self._sequence = 0  # Breaks ties in the heap, as schedules can't be compared
+        self._schedules = []
+
+    def add(self, name: str, polling_interval: str, offset: float = 0.0, jitter: float = 0.0):
+        """
+        Schedules a plugin to run offset seconds, plus up to jitter seconds at random, after each of its ticks
+        """
+        polling_interval = Scheduler(plugin_name=name, polling_interval=polling_interval).polling_interval
+        schedule = _Schedule(name, polling_interval, max(offset, 0.0), max(jitter, 0.0), self._wall_clock())
+        self._schedules.append(schedule)
+        self._push(schedule, self._clock(), self._wall_clock())
+        self.__logger.info(f'[{name}-plugin] Polling according to \'{polling_interval}\', offset {schedule.offset:g}s, '
+                           f'jitter {schedule.jitter:g}s, next at {schedule.fire_at}')
+
+    def stagger(self):
+        """
+        Spreads the plugins evenly across their polling intervals, on top of any offset they have of their own.
+        With N plugins the i'th is run a further i/N of its interval after each tick
+        """
+        count = len(self._schedules)
+        now = self._clock()
+        wall_now = self._wall_clock()
+        self._heap = []
+        for i, schedule in enumerate(self._schedules):
+            schedule.offset += i * schedule.period() / count
+            schedule.restart(wall_now)
+            self._push(schedule, now, wall_now)
+            self.__logger.info(f'[{schedule.name}-plugin] Staggered to an offset of {schedule.offset:g}s, '
+                               f'next at {schedule.fire_at}')
+
+    def _push(self, schedule: _Schedule, now: float, wall_now: datetime):
+        """
+        Works out when the plugin is run for its next tick and adds it to the heap
+        """
+        delay = schedule.offset
+        if schedule.jitter > 0:
+            delay += self._random.uniform(0, schedule.jitter)
+        schedule.fire_at = schedule.tick + timedelta(seconds=delay)
+        self.__logger.debug(f'[{schedule.name}-plugin] Next tick {schedule.tick} will run at {schedule.fire_at} '
+                            f'(+{delay:.1f}s)')
+        self._sequence += 1
+        heapq.heappush(self._heap, (now + (schedule.fire_at - wall_now).total_seconds(), self._sequence, schedule))
+
+    def _is_backing_off(self, schedule: _Schedule, tick: datetime) -> bool:
+        """
+        Determines if the plugin's tick should be skipped as its polling interval is stretched
+        """
+        stretch = self._stretch(schedule.name)
+        if stretch <= 1.0 or schedule.last_run is None:
+            return False
+        effective_interval = schedule.last_period * stretch
+        if (tick - schedule.last_run).total_seconds() >= effective_interval:
+            return False
+        self.__logger.info(f'[{schedule.name}-plugin] Backing off - skipping {tick}, polling every '
+                           f'{effective_interval:g}s rather than {schedule.last_period:g}s')
+        return True
+
+    def _run(self, schedule: _Schedule, tick: datetime, due: list):
+        schedule.last_run = tick
+        schedule.last_period = (croniter(schedule.polling_interval, tick).get_next(datetime) - tick).total_seconds()
+        due.append((schedule.name, tick))
+
+    def _is_due(self, entry, now: float, wall_now: datetime) -> bool:
+        return entry[0] <= now or entry[2].fire_at <= wall_now
+
+    def time_until_next_run(self) -> float:
+        """
+        Returns the seconds until the next plugin is due, or None if there's nothing scheduled
+        """
+        if not self._heap:
+            return None
+        due, _, schedule = self._heap[0]
+        remaining = min(due - self._clock(), (schedule.fire_at - self._wall_clock()).total_seconds())
+        return max(remaining, 0.0)
+
+    def pop_due(self):
+        """
+        Returns the names of the plugins which are due now, along with the tick each is due for, and schedules their
+        next tick
+        """
+        now = self._clock()
+        wall_now = self._wall_clock()
+        due = []
+        while self._heap and self._is_due(self._heap[0], now, wall_now):
+            _, _, schedule = heapq.heappop(self._heap)
+            tick = schedule.tick
+            fired_at = schedule.fire_at
+            schedule.tick = schedule.cron.get_next(datetime)
+            if schedule.tick + timedelta(seconds=schedule.offset) > wall_now:
+                if not self._is_backing_off(schedule, tick):
+                    self.__logger.info(f'[{schedule.name}-plugin] Running for {tick} at {wall_now} (due {fired_at})')
+                    self._run(schedule, tick, due)
+            else:
+                # Start again from now, rather than iterating through every tick which has been missed
+                schedule.restart(wall_now)
+                if self._missed_ticks == 'catchup':
+                    if not self._is_backing_off(schedule, tick):
+                        self.__logger.warning(f'[{schedule.name}-plugin] Missed the ticks since {tick} - running it now')
+                        self._run(schedule, tick, due)
+                else:
+                    self.__logger.warning(f'[{schedule.name}-plugin] Missed the ticks since {tick} - skipping them')
+            self._push(schedule, now, wall_now)
+
+        return due
+
+    def dispatch_all(self):
+        """
+        Returns every plugin as due now, e.g. for a one-off run, without changing their schedules
+        """
+        tick = self._wall_clock().replace(microsecond=0)
+        return [(schedule.name, tick) for schedule in self._schedules]
@@ -0,0 +1,118 @@
+"""
+Process-wide registry of the metric series
+"""
+
+import sys
+import threading
+
+
+def _sanitise(val: str) -> str:
+    return sys.intern(val.replace(' ', '').lower())
+
+
+def _tags_key(tags: dict):
+    return tuple(sorted((tag, str(value)) for tag, value in tags.items())) if tags else None
+
+
+class SeriesCache:
+    """
+    Something an output has derived from each series, e.g. its line protocol prefix or its column, indexed by series id
+    """
+
+    __slots__ = ('_values',)
+
+    def __init__(self) -> None:
+        self._values = []
+
+    def get(self, series_id: int):
+        """
+        Returns the cached value for the series, or None if there isn't one
+        """
+        values = self._values
+        return values[series_id] if series_id < len(values) else None
+
+    def set(self, series_id: int, value):
+        """
+        Caches a value for the series
+        """
+        values = self._values
+        if series_id >= len(values):
+            values.extend([None] * (series_id + 1 - len(values)))
+        values[series_id] = value
+
+    def clear(self):
+        """
+        Forgets everything cached, e.g. when what was derived from the series is no longer valid
+        """
+        self._values = []
+
+
+class SeriesRegistry:
+    """
+    Gives each (plugin, descriptor) series an integer id the first time it's seen, and keeps its sanitised name.
+    The set of series rarely changes, so after the first cycle each metric costs a single dictionary lookup rather than
+    having its names sanitised again.  Ids are never reused, so outputs can cache whatever they derive from a series
+    against its id in a SeriesCache.
+    A series can also have tags, e.g. the location a zone is in, which describe the series rather than any one metric.
+    They're part of what identifies the series, so the same zone with different tags is a different series, and a
+    series' tags never change once it's registered - they can be cached along with its name.
+    """
+
+    def __init__(self) -> None:
+        self._ids = {}  # (plugin, descriptor, tags), with the names as supplied or sanitised, => id
+        self._names = []  # Sanitised (plugin, descriptor) of each series, indexed by id
+        self._tags = []  # Tags of each series, or None, indexed by id
+        self._lock = threading.Lock()
+        self.hits = 0  # Lookups of a series already seen.  Only approximate as it's not counted under the lock
+        self.misses = 0
+
+    def get_id(self, plugin: str, descriptor: str, tags: dict = None) -> int:
+        """
+        Returns the id of the series with the supplied tags, registering it if it's new
+        """
+        key = (plugin, descriptor, _tags_key(tags))
+        series_id = self._ids.get(key)
+        if series_id is not None:
+            self.hits += 1
+            return series_id
+
+        with self._lock:
+            self.misses += 1
+            series_id = self._ids.get(key)
+            if series_id is None:
+                name = (_sanitise(plugin), _sanitise(descriptor))
+                sanitised_key = name + key[2:]
+                series_id = self._ids.get(sanitised_key)
+                if series_id is None:
+                    series_id = len(self._names)
+                    self._names.append(name)
+                    self._tags.append(dict(tags) if tags else None)
+                    self._ids[sanitised_key] = series_id
+                self._ids[key] = series_id
+            return series_id
+
+    def name(self, series_id: int):
+        """
+        Returns the sanitised (plugin, descriptor) of the series
+        """
+        return self._names[series_id]
+
+    def tags(self, series_id: int) -> dict:
+        """
+        Returns the tags of the series, or None if it hasn't any
+        """
+        return self._tags[series_id]
+
+    def __len__(self) -> int:
+        return len(self._names)
+
+    @property
+    def hit_rate(self) -> float:
+        """
+        The proportion of lookups which found the series already registered
+        """
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+
+REGISTRY = SeriesRegistry()
@@ -0,0 +1,191 @@
+"""
+Durable store-and-forward spool for output plugins
+"""
+
+import json
+import logging
+import os
+import time
+from datetime import datetime
+
+from Metric import Metric
+
+_SEGMENT_PREFIX = 'segment-'
+_SEGMENT_SUFFIX = '.jsonl'
+_TIME_FORMAT = '%Y-%m-%d %H:%M:%S.%f'
+
+
+def _to_record(timestamp: datetime, metrics) -> str:
+    """
+    Serialises a batch of metrics to a single line of JSON
+    """
+    return json.dumps({
+        'time': timestamp.strftime(_TIME_FORMAT),
+        'metrics': [[m.plugin, m.descriptor, m.actual, m.target, m.text,
+                     None if m.timestamp is None else m.timestamp.strftime(_TIME_FORMAT)] for m in metrics]
+    })
+
+
+def _from_record(line: str):
+    """
+    Deserialises a line of JSON back to a timestamp and a list of metrics
+    """
+    record = json.loads(line)
+    metrics = [Metric(plugin=m[0], descriptor=m[1], actual=m[2], target=m[3], text=m[4],
+                      timestamp=None if m[5] is None else datetime.strptime(m[5], _TIME_FORMAT))
+               for m in record['metrics']]
+    return datetime.strptime(record['time'], _TIME_FORMAT), metrics
+
+
+class Spool:
+    """
+    Append-only, on-disk spool of the metric batches an output plugin failed to write.
+    Batches are appended, one JSON line each, to segment files which are replayed oldest first once the output recovers.
+    The spool is capped by total size and age - the oldest segments are dropped when either is exceeded.
+    """
+
+    # pylint: disable=too-many-instance-attributes,too-many-arguments,too-many-positional-arguments
+    def __init__(self, directory: str, plugin_name: str, max_bytes: int, max_age_seconds: float,
+                 segment_bytes: int, logger: logging.Logger = None) -> None:
+        self._directory = directory
+        self._plugin_name = plugin_name
+        self._max_bytes = max_bytes
+        self._max_age_seconds = max_age_seconds
+        self._segment_bytes = segment_bytes
+        self._logger = logger if logger is not None else logging.getLogger('spool')
+        self.spooled = 0  # Number of metrics written to the spool
+        self.replayed = 0  # Number of metrics successfully replayed from the spool
+        self.dropped = 0  # Number of metrics discarded because the spool was too big or too old
+        os.makedirs(directory, exist_ok=True)
+
+    def _segments(self):
+        """
+        Returns the paths of the segment files, oldest first
+        """
+        names = sorted(n for n in os.listdir(self._directory)
+                       if n.startswith(_SEGMENT_PREFIX) and n.endswith(_SEGMENT_SUFFIX))
+        return [os.path.join(self._directory, n) for n in names]
+
+    def _new_segment(self) -> str:
+        return os.path.join(self._directory, f'{_SEGMENT_PREFIX}{time.time_ns():020d}{_SEGMENT_SUFFIX}')
+
+    def is_empty(self) -> bool:
+        """
+        Determines if there is anything waiting to be replayed
+        """
+        return not self._segments()
+
+    def append(self, timestamp: datetime, metrics):
+        """
+        Adds a batch which failed to be written to the end of the spool
+        """
+        segments = self._segments()
+        if segments and os.path.getsize(segments[-1]) < self._segment_bytes:
+            segment = segments[-1]
+        else:
+            segment = self._new_segment()
+
+        with open(segment, 'a', encoding='UTF-8') as f:
+            f.write(_to_record(timestamp, metrics) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+
+        self.spooled += len(metrics)
+        self._logger.warning(f'Spooled {len(metrics)} metrics for {self._plugin_name} to {segment}')
+        self._enforce_limits()
+
+    def _enforce_limits(self):
+        """
+        Drops the oldest segments whilst the spool is too big, along with any segment which is too old
+        """
+        segments = self._segments()
+        total_bytes = sum(os.path.getsize(s) for s in segments)
+        oldest_allowed = time.time() - self._max_age_seconds
+
+        # Never drop the segment being appended to, as that would lose the batch just spooled
+        for segment in segments[:-1]:
+            too_big = total_bytes > self._max_bytes
+            too_old = os.path.getmtime(segment) < oldest_allowed
+            if not too_big and not too_old:
+                continue
+            size = os.path.getsize(segment)
+            dropped = self._count_metrics(segment)
+            os.remove(segment)
+            total_bytes -= size
+            self.dropped += dropped
+            self._logger.error(f'Dropped {dropped} spooled metrics for {self._plugin_name} from {segment} - '
+                               f'spool {"exceeded " + str(self._max_bytes) + " bytes" if too_big else "too old"}')
+
+    @staticmethod
+    def _count_metrics(segment: str) -> int:
+        count = 0
+        with open(segment, encoding='UTF-8') as f:
+            for line in f:
+                if line.strip():
+                    count += len(json.loads(line)['metrics'])
+        return count
+
+    def replay(self, write, batch_size: int, merge: bool) -> bool:
+        """
+        Replays the spooled batches, oldest first, through the supplied write(timestamp, metrics) function.
+        If merge is True then consecutive batches in a segment are combined into batches of at least batch_size
+        metrics, each metric carrying its own timestamp.  Replay stops at the first failure, leaving what's left for
+        next time.
+
+        Returns:
+            bool: True if the spool was completely replayed
+        """
+        for segment in self._segments():
+            with open(segment, encoding='UTF-8') as f:
+                lines = [line for line in f if line.strip()]
+
+            start = 0
+            while start < len(lines):
+                timestamp, batch, end = self._next_batch(lines, start, batch_size, merge)
+                try:
+                    write(timestamp, batch)
+                except Exception as e:
+                    self._logger.error(f'Replaying spooled metrics for {self._plugin_name} failed - will retry\n{e}')
+                    if start > 0:
+                        # Keep only what hasn't been replayed so it isn't written twice
+                        self._rewrite(segment, lines[start:])
+                    return False
+
+                self.replayed += len(batch)
+                start = end
+
+            os.remove(segment)
+
+        return True
+
+    @staticmethod
+    def _next_batch(lines, start: int, batch_size: int, merge: bool):
+        """
+        Reads the next batch to replay from a segment's lines, starting at start - merging consecutive lines into a batch
+        of at least batch_size metrics if merge is True.
+        Returns the batch's timestamp, its metrics and the line after it
+        """
+        end = start
+        timestamp = None
+        batch = []
+        while end < len(lines) and (not batch or (merge and len(batch) < batch_size)):
+            timestamp, metrics = _from_record(lines[end])
+            if merge:
+                for metric in metrics:
+                    if metric.timestamp is None:
+                        metric.timestamp = timestamp
+            batch.extend(metrics)
+            end += 1
+        return timestamp, batch, end
+
+    @staticmethod
+    def _rewrite(segment: str, lines):
+        """
+        Atomically replaces the contents of a segment with the lines not yet replayed
+        """
+        temp_file = f'{segment}.tmp'
+        with open(temp_file, 'w', encoding='UTF-8') as f:
+            f.writelines(lines)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_file, segment)
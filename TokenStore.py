@@ -0,0 +1,147 @@
+"""
+Shared store for the authentication tokens of plugins
+"""
+
+import json
+import logging
+import os
+import threading
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows - tokens are then only locked against other threads in this process
+    fcntl = None
+
+_stores = {}  # Absolute filename => TokenStore
+_stores_lock = threading.Lock()
+
+
+def get_token_store(filename: str, logger: logging.Logger = None):
+    """
+    Returns the store for the token file, so everything in the process using the same file shares the one store
+    """
+    filename = os.path.abspath(filename)
+    with _stores_lock:
+        store = _stores.get(filename)
+        if store is None:
+            store = TokenStore(filename, logger)
+            _stores[filename] = store
+        return store
+
+
+class TokenStore:
+    """
+    Keeps a plugin's tokens, which can be anything JSON can hold, in memory and in a file so they survive restarts and
+    can be shared between processes.
+    The file is only read again when it's changed (by its modification time and size) and is written to a temporary file
+    which then replaces it, under an advisory lock, so it's never seen half written.
+    Getting new tokens is often rate-limited, so refresh() makes sure only one caller - in this or any other process
+    sharing the file - gets them, with everyone else using the tokens it got.
+    """
+
+    def __init__(self, filename: str, logger: logging.Logger = None) -> None:
+        self.filename = filename
+        self._logger = logger if logger is not None else logging.getLogger('tokens')
+        self._lock = threading.RLock()
+        self._tokens = None
+        self._signature = None  # (modification time, size) of the file when the tokens were read from/written to it
+
+    def _file_signature(self):
+        try:
+            stat = os.stat(self.filename)
+            return stat.st_mtime_ns, stat.st_size
+        except OSError:
+            return None
+
+    def read(self):
+        """
+        Returns the tokens, or None if there aren't any, only reading the file if it's changed since it was last read
+        """
+        signature = self._file_signature()
+        if signature == self._signature:
+            return self._tokens
+
+        with self._lock:
+            tokens = None
+            if signature is not None:
+                try:
+                    with open(self.filename, 'r', encoding='UTF-8') as f:
+                        tokens = json.load(f)
+                    self._logger.debug(f'Read tokens from {self.filename}')
+                except (IOError, ValueError) as ex:
+                    self._logger.debug(f'Unable to read tokens from {self.filename}: {ex}')
+            self._tokens = tokens
+            self._signature = signature
+            return tokens
+
+    def write(self, tokens):
+        """
+        Saves the tokens, if they've changed
+        """
+        with self._lock:
+            if tokens == self.read():
+                return
+            with self._file_lock():
+                self._write(tokens)
+
+    def replace(self, expected, tokens) -> bool:
+        """
+        Saves the tokens in place of the expected ones, which the caller read, unless someone else - in this or another
+        process - has saved others since, in which case theirs are newer and are kept.
+        Returns True if the tokens are the ones saved
+        """
+        with self._lock, self._file_lock():
+            current = self.read()
+            if current == tokens:
+                return True
+            if current != expected:
+                self._logger.debug('Tokens have been changed by someone else, keeping theirs')
+                return False
+            self._write(tokens)
+            return True
+
+    def refresh(self, stale, fetch):
+        """
+        Gets new tokens by calling fetch(), passing it the latest tokens, unless they've already been refreshed since the
+        caller read the stale ones - in which case the new ones are returned without calling fetch().
+        Tokens returned by fetch() are saved and returned.  If it returns None the tokens are left as they were.
+        """
+        with self._lock, self._file_lock():
+            current = self.read()
+            if current is not None and current != stale:
+                self._logger.debug('Tokens have already been refreshed')
+                return current
+
+            tokens = fetch(current)
+            if tokens is not None and tokens != current:
+                self._write(tokens)
+            return tokens
+
+    def _write(self, tokens):
+        """
+        Writes the tokens to a temporary file, readable only by this user, which then replaces the token file
+        """
+        temp_file = f'{self.filename}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with os.fdopen(os.open(temp_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 'w', encoding='UTF-8') as f:
+            json.dump(tokens, f)
+        os.replace(temp_file, self.filename)
+        self._tokens = tokens
+        self._signature = self._file_signature()
+        self._logger.debug(f'Saved tokens to {self.filename}')
+
+    @contextmanager
+    def _file_lock(self):
+        """
+        Holds an exclusive lock on the token file's lock file, so other processes can't write or refresh the tokens
+        """
+        if fcntl is None:
+            yield
+            return
+
+        with open(f'{self.filename}.lock', 'a', encoding='UTF-8') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
@@ -0,0 +1,91 @@
+"""
+Benchmarks the InfluxDB v1.x output plugin against a local stand-in for the InfluxDB HTTP write endpoint.
+
+Compares the original behaviour (a new client per write, nanosecond timestamps, uncompressed) with a persistent client
+writing second precision timestamps with gzip compression.
+
+usage: python benchmarks/influxdb_write.py [metrics per cycle] [cycles]
+"""
+
+import gzip
+import os
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from AppConfig import AppConfig  # pylint: disable=wrong-import-position
+from Metric import Metric  # pylint: disable=wrong-import-position
+from plugins.influxdb import Plugin  # pylint: disable=wrong-import-position
+
+
+class _WriteHandler(BaseHTTPRequestHandler):
+    """Accepts /write requests, counting the bytes sent over the wire and the points they contain"""
+    protocol_version = 'HTTP/1.1'
+    stats = {'requests': 0, 'bytes': 0, 'lines': 0}
+
+    def do_POST(self):  # pylint: disable=invalid-name
+        """
+        Counts the request and the points in its body, then responds as InfluxDB does to a successful write
+        """
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        _WriteHandler.stats['requests'] += 1
+        _WriteHandler.stats['bytes'] += len(body)
+        if self.headers.get('Content-Encoding') == 'gzip':
+            body = gzip.decompress(body)
+        _WriteHandler.stats['lines'] += len(body.strip().split(b'\n'))
+        self.send_response(204)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, *args):  # pylint: disable=arguments-differ
+        pass
+
+
+def _plugin(port: int, settings: str) -> Plugin:
+    with tempfile.NamedTemporaryFile('w', suffix='.ini', delete=False, encoding='UTF-8') as ini_file:
+        ini_file.write(f'[InfluxDB]\nhostname=127.0.0.1\nport={port}\ndatabase=bench\nusername=u\npassword=p\n'
+                       f'{settings}\n')
+    return Plugin(AppConfig(ini_file.name))
+
+
+def _run(name: str, plugin: Plugin, metrics, cycles: int, persistent: bool):
+    for key in _WriteHandler.stats:
+        _WriteHandler.stats[key] = 0
+    started = time.perf_counter()
+    for _ in range(cycles):
+        if not persistent:
+            plugin.close()
+        plugin.write(datetime.utcnow().replace(microsecond=0), metrics)
+    duration = time.perf_counter() - started
+    stats = _WriteHandler.stats
+    print(f'{name:<55} {duration / cycles * 1000:8.2f}ms/cycle {stats["requests"] / cycles:5.1f} requests/cycle '
+          f'{stats["bytes"] / cycles / 1024:9.1f}KB/cycle {stats["lines"] // cycles:7} points/cycle')
+
+
+def main(metrics_per_cycle: int = 1000, cycles: int = 50):
+    """
+    Writes the cycles of metrics with the original and the persistent, compressed behaviour, and prints how each did
+    """
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _WriteHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    port = server.server_address[1]
+
+    metrics = [Metric('evohome', f'zone {i}', 20.0 + i % 5, 21.0) for i in range(metrics_per_cycle)]
+    print(f'{metrics_per_cycle} metrics per cycle, {cycles} cycles')
+    _run('new client per cycle, ns precision', _plugin(port, 'timePrecision=n\nbatchSize=0'), metrics, cycles,
+         persistent=False)
+    _run('persistent client, s precision', _plugin(port, 'timePrecision=s'), metrics, cycles, persistent=True)
+    _run('persistent client, s precision, gzip', _plugin(port, 'timePrecision=s\ngzip=true'), metrics, cycles,
+         persistent=True)
+    _run('persistent client, s precision, gzip, 1000 batches',
+         _plugin(port, 'timePrecision=s\ngzip=true\nbatchSize=1000'), metrics, cycles, persistent=True)
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:3]])
@@ -0,0 +1,71 @@
+"""
+Benchmarks encoding a batch of metrics as line protocol with the shared encoder against the previous approach of
+building a dict (InfluxDB v1.x) or Point (InfluxDB v2.x) per value and serialising it in the client library.
+
+usage: python benchmarks/line_protocol.py [metrics per batch] [repeats]
+"""
+
+import os
+import sys
+import time
+from datetime import datetime
+
+from influxdb.line_protocol import make_lines  # pylint: disable=import-error,no-name-in-module
+from influxdb_client import Point
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from Metric import Metric  # pylint: disable=wrong-import-position
+from plugins.LineProtocol import LineProtocolEncoder  # pylint: disable=wrong-import-position
+
+
+def _values(metric):
+    if metric.actual is not None:
+        yield 'actual', float(metric.actual)
+    if metric.target is not None:
+        yield 'target', float(metric.target)
+    if metric.actual is not None and metric.target is not None:
+        yield 'delta', float(metric.actual) - float(metric.target)
+    if metric.text is not None:
+        yield 'text', str(metric.text)
+
+
+def _dicts(timestamp, metrics) -> bytes:
+    points = [{'measurement': name, 'tags': {'plugin': m.plugin, 'descriptor': m.descriptor},
+               'time': timestamp if m.timestamp is None else m.timestamp, 'fields': {'value': value}}
+              for m in metrics for name, value in _values(m)]
+    return make_lines({'points': points}, 's').encode('utf-8')
+
+
+def _points(timestamp, metrics) -> bytes:
+    points = [Point(name).time(timestamp if m.timestamp is None else m.timestamp, 's').tag('descriptor', m.descriptor)
+              .field('value', value) for m in metrics for name, value in _values(m)]
+    return '\n'.join(p.to_line_protocol() for p in points).encode('utf-8')
+
+
+def _run(name: str, encode, metrics, repeats: int):
+    timestamp = datetime.utcnow().replace(microsecond=0)
+    encoded = b''
+    started = time.perf_counter()
+    for _ in range(repeats):
+        encoded = encode(timestamp, metrics)
+    duration = (time.perf_counter() - started) / repeats
+    print(f'{name:<40} {duration * 1000:8.2f}ms/batch {len(metrics) / duration:12,.0f} metrics/s '
+          f'{len(encoded) / 1024:9.1f}KB')
+
+
+def main(metrics_per_batch: int = 10000, repeats: int = 20):
+    """
+    Encodes a batch of metrics with each of the line protocol encoders, and prints how each did
+    """
+    metrics = [Metric('evohome', f'zone {i % 500}', 20.0 + i % 5, 21.0, 'Auto' if i % 10 == 0 else None)
+               for i in range(metrics_per_batch)]
+    print(f'{metrics_per_batch} metrics per batch, {repeats} repeats')
+    _run('v1.x dicts + make_lines', _dicts, metrics, repeats)
+    _run('LineProtocolEncoder (plugin, descriptor)', LineProtocolEncoder('s').encode, metrics, repeats)
+    _run('v2.x Points + to_line_protocol', _points, metrics, repeats)
+    _run('LineProtocolEncoder (descriptor)', LineProtocolEncoder('s', tags=('descriptor',)).encode, metrics, repeats)
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:3]])
@@ -0,0 +1,82 @@
+"""
+Benchmarks the memory and time taken by 100k metrics held as objects with a __dict__ (as Metric used to be), as
+Metric objects with __slots__ and as a columnar MetricBatch.
+
+usage: python benchmarks/metric_batch.py [metrics]
+"""
+
+import gc
+import os
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from Metric import Metric, MetricBatch  # pylint: disable=wrong-import-position
+from SeriesRegistry import REGISTRY  # pylint: disable=wrong-import-position
+from plugins.LineProtocol import LineProtocolEncoder  # pylint: disable=wrong-import-position
+
+
+class _DictMetric:
+    """Metric as it was, before __slots__"""
+
+    def __init__(self, plugin, descriptor, actual=None, target=None, text=None, timestamp=None):
+        # pylint: disable=too-many-arguments,too-many-positional-arguments
+        self.plugin = plugin.replace(' ', '').lower()
+        self.descriptor = descriptor.replace(' ', '').lower()
+        self.series_id = REGISTRY.get_id(plugin, descriptor)  # The encoders look series up by their id
+        self.actual = actual
+        self.target = target
+        self.text = text
+        self.timestamp = timestamp
+
+
+def _values(count: int):
+    start = datetime(2022, 1, 1).timestamp()
+    return [('dccapi', f'meter {i % 4}', float(i % 100), 21.0 if i % 3 else None, None,
+             datetime.utcfromtimestamp(start + i * 1800)) for i in range(count)]
+
+
+def _measure(name: str, create, values):
+    gc.collect()
+    tracemalloc.start()
+    started = time.perf_counter()
+    metrics = create(values)
+    created = time.perf_counter() - started
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    started = time.perf_counter()
+    total = sum(m.actual for m in metrics)
+    iterated = time.perf_counter() - started
+
+    started = time.perf_counter()
+    LineProtocolEncoder('s').encode_lines(datetime.utcnow(), metrics)
+    encoded = time.perf_counter() - started
+
+    print(f'{name:<22} {memory / 1048576:8.1f}MB {created * 1000:9.1f}ms create {iterated * 1000:9.1f}ms iterate '
+          f'{encoded * 1000:9.1f}ms encode  (sum {total:.0f})')
+    return metrics
+
+
+def main(count: int = 100000):
+    """
+    Creates, iterates and encodes the metrics as objects and as a MetricBatch, and prints how each did
+    """
+    values = _values(count)
+    print(f'{count} metrics')
+    _measure('__dict__ objects', lambda v: [_DictMetric(*args) for args in v], values)
+    metrics = _measure('__slots__ Metric', lambda v: [Metric(*args) for args in v], values)
+    _measure('MetricBatch', MetricBatch.from_metrics, metrics)
+
+    batch = MetricBatch.from_metrics(metrics)
+    started = time.perf_counter()
+    total = sum(batch.actual)
+    print(f'{"MetricBatch columns":<22} {"":10} {"":16} {(time.perf_counter() - started) * 1000:9.1f}ms iterate '
+          f'{"":20}  (sum {total:.0f})')
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:2]])
@@ -6,22 +6,37 @@ Reads temperatures from configured input plugins and writes them to configured o
 """
 # pylint: disable=global-statement
 
+import asyncio
 import getopt
 import http
 import logging.config
 import signal
 import sys
 import time
+from concurrent import futures
 from datetime import datetime
 
 import structlog
 
 from AppConfig import AppConfig
-from Scheduler import Scheduler
+from HttpTransport import configure_transport, get_transport
+from Metric import Metric
+from Scheduler import PollingScheduler
+from SeriesRegistry import REGISTRY
 from pluginloader import PluginLoader
 
+DEFAULT_READ_TIMEOUT = 30.0  # Seconds an input plugin has to return its metrics before it is skipped
+DEFAULT_WRITE_TIMEOUT = 30.0  # Seconds an output plugin has to write the metrics before it is abandoned
+DEFAULT_MAX_OUTPUT_WORKERS = 4  # Maximum number of output plugins written to at the same time
+RATE_LIMITER_PLUGIN = 'RateLimiter'  # The plugin name the rate limit metrics are published under
+
 logger = None
 plugins = None
+in_flight = {}  # plugin name => future of its last read/write, so a still-running plugin isn't called again
+input_executor = None  # Threads the sync input plugins are read on
+output_executor = None  # Threads the sync output plugins are written on
+event_loop = None  # The loop everything is polled and published on
+publish_lock = None  # Publishes one batch of metrics at a time, so a plugin's history doesn't collide with a cycle
 logging.raiseExceptions = True
 continue_polling = True
 config = AppConfig('config.ini')
@@ -134,27 +149,83 @@ def configure_logging(log_level):
         http.client.print = print_http_debug_to_log
 
 
-def read_metrics():
+def is_still_running(plugin) -> bool:
+    """
+    Determines if the plugin is still busy from a previous cycle (i.e. it missed its deadline and hasn't finished yet)
+    """
+    future = in_flight.get(plugin.plugin_name)
+    return future is not None and not future.done()
+
+
+def load_plugin(plugin):
     """
-    Reads the metrics from the input plugins
+    Returns the live instance of a plugin, or None if it can't be loaded (e.g. its constructor or open() raised) - which
+    is logged, so the other plugins carry on.  It's tried again the next time it's used
+    """
+    try:
+        return plugins.load(plugin)
+    except Exception as ex:
+        logger.error("Error loading %s: %s", plugin['name'], str(ex), exc_info=ex)
+        return None
+
+
+def call_plugin(plugin, executor: futures.Executor, method, *args):
+    """
+    Calls a plugin's read/write method, returning something which can be awaited on the event loop.
+    Async plugins run on the event loop, sync plugins are run on the supplied executor.
+    """
+    if asyncio.iscoroutinefunction(method):
+        future = asyncio.ensure_future(method(*args))
+        in_flight[plugin.plugin_name] = future
+        return future
+
+    future = executor.submit(method, *args)
+    in_flight[plugin.plugin_name] = future
+    return asyncio.wrap_future(future)
+
+
+async def read_metrics(due=None, read=None):
+    """
+    Reads the metrics from the input plugins which are due (section name => the tick it's due for), or all of them if
+    due is None.  Each plugin which is read is handed its tick, so its own scheduler agrees it can run however late the
+    read starts.  The plugins which returned metrics are appended to read, if it's supplied.
+    The plugins are polled at the same time, each with its own deadline (readTimeout) - a plugin which misses its
+    deadline is skipped for this cycle without affecting the metrics read from the others.
     """
     metrics = []
-    for i in plugins.inputs:
-        plugin = plugins.load(i)
+    pending = []
+    inputs = plugins.inputs if due is None else [i for i in plugins.inputs if i['section'] in due]
+
+    for i in inputs:
+        plugin = load_plugin(i)
         if plugin is None:
-            logger.error("plugin is none!: %s", i)
+            continue  # load_plugin has logged why
+        if is_still_running(plugin):
+            logger.warning("%s is still busy with a previous read - skipping", plugin.plugin_name)
         else:
-            try:
-                temps = plugin.read()
-                if not temps:
-                    continue
-
-            except Exception as e:
-                logger.exception("Error reading temps from %s: %s", plugin.plugin_name, str(e))
-                return []
-
+            plugin.publisher = publish_from_plugin
+            if due is not None and getattr(plugin, 'scheduler', None) is not None:
+                plugin.scheduler.dispatch(due[i['section']])
+            timeout = config.get_float_or_default(plugin.plugin_name, 'readTimeout', DEFAULT_READ_TIMEOUT)
+            pending.append((plugin, timeout,
+                            asyncio.wait_for(call_plugin(plugin, input_executor, plugin.read), timeout)))
+
+    results = await asyncio.gather(*[read for _, _, read in pending], return_exceptions=True)
+
+    for (plugin, timeout, _), temps in zip(pending, results):
+        if isinstance(temps, asyncio.TimeoutError):
+            # A sync plugin which misses its deadline will finish (or not) in the background
+            logger.error("%s did not return any metrics within %ss - skipping", plugin.plugin_name, timeout)
+        elif isinstance(temps, Exception):
+            logger.error("Error reading temps from %s: %s", plugin.plugin_name, str(temps), exc_info=temps)
+        elif temps:
             for t in temps:
                 metrics.append(t)
+            if read is not None:
+                read.append(plugin)
+
+    if config.get_boolean_or_default('DEFAULT', 'rateLimitMetrics', False):
+        metrics += rate_limit_metrics(inputs)
 
     # Sort by zone name, with hot water on the end and finally 'Outside'
     metrics = sorted(metrics,
@@ -162,39 +233,236 @@ def read_metrics():
     return metrics
 
 
-def publish_metrics(metrics):
+def rate_limit_metrics(inputs):
     """
-    Publishes the metrics to the output plugins
+    Returns metrics of how far the polling of each web API host used by the inputs is stretched, and of its effective
+    rate limit if it has one
     """
+    rate_limiter = get_transport().rate_limiter
+    metrics = []
+    for host in sorted({host for i in inputs for host in i.get('hosts', ())}):
+        limiter = rate_limiter.host(host)
+        tags = {'host': host}
+        metrics.append(Metric(RATE_LIMITER_PLUGIN, f'{host}-stretch', limiter.stretch, tags=tags))
+        if limiter.rate_per_minute:
+            metrics.append(Metric(RATE_LIMITER_PLUGIN, f'{host}-rate', limiter.effective_rate_per_minute,
+                                  limiter.rate_per_minute, tags=tags))
+    return metrics
 
+
+def publish_from_plugin(metrics):
+    """
+    Publishes metrics an input plugin has read outside of the polling cycle, e.g. the history it's backfilling, from the
+    plugin's own thread.  Returns once they've been written, so the plugin reads no more than the outputs can take -
+    True if they were written to every output.
+    It gives up, returning False, if they haven't been within twice the longest writeTimeout - time for a cycle being
+    published to finish and then for these to be - so the plugin isn't left waiting on a loop which has stopped
+    """
+    timeout = 2 * max((config.get_float_or_default(o['section'], 'writeTimeout', DEFAULT_WRITE_TIMEOUT)
+                       for o in plugins.outputs), default=DEFAULT_WRITE_TIMEOUT)
+    future = asyncio.run_coroutine_threadsafe(publish_metrics(metrics, history=True), event_loop)
+    try:
+        return future.result(timeout)
+    except futures.TimeoutError:
+        future.cancel()
+        logger.warning("%s metrics were not published within %ss - abandoning them", len(metrics), timeout)
+        return False
+
+
+async def publish_metrics(metrics, history: bool = False) -> bool:
+    """
+    Publishes the metrics to the output plugins, returning True if every output wrote them.
+    History, i.e. metrics with timestamps in the past, is only written to the outputs which honour each metric's own
+    timestamp
+    """
+    global publish_lock
+    if publish_lock is None:
+        publish_lock = asyncio.Lock()
+
+    async with publish_lock:
+        return await _publish_metrics(metrics, history)
+
+
+async def poll_plugins(due=None):
+    """
+    Reads the input plugins which are due (see read_metrics) and publishes what they read.  Once it's been written to
+    every output each plugin which was read is told, so it can record how far it's got
+    """
+    read = []
+    if not await publish_metrics(await read_metrics(due, read)):
+        return
+
+    loop = asyncio.get_running_loop()
+    for plugin in read:
+        try:
+            if asyncio.iscoroutinefunction(plugin.published):
+                await plugin.published()
+            else:
+                await loop.run_in_executor(input_executor, plugin.published)
+        except Exception as ex:
+            logger.error("Error telling %s its metrics were published: %s", plugin.plugin_name, str(ex), exc_info=ex)
+
+
+async def _publish_metrics(metrics, history: bool) -> bool:
+    written = True
     if metrics:
         timestamp = datetime.utcnow()
         timestamp = timestamp.replace(microsecond=0)
 
-        text_metrics = f'{datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")}: '
+        if not history:
+            logger.debug(_describe_metrics(metrics))
+
+        # Bounds how many outputs, sync or async, are written to at the same time
+        semaphore = asyncio.Semaphore(
+            config.get_int_or_default('DEFAULT', 'maxOutputWorkers', DEFAULT_MAX_OUTPUT_WORKERS))
+
+        async def timed_write(plugin):
+            async with semaphore:
+                write_started = time.monotonic()
+                points = await call_plugin(plugin, output_executor, plugin.write, timestamp, metrics)
+                if history and points is not None and plugin.has_buffered_metrics:
+                    # The plugin reading the history moves on once it's written, so it mustn't be left in a buffer
+                    flushed = await call_plugin(plugin, output_executor, plugin.flush)
+                    points = None if flushed is None else points + flushed
+                return points, time.monotonic() - write_started
+
+        summary = []
+        pending = []
+        for i in plugins.outputs:
+            plugin = load_plugin(i)
+            if plugin is None:
+                summary.append(f'{i["name"]} FAILED (not loaded)')
+                written = False
+                continue
+            if history and not plugin.honours_metric_timestamps:
+                continue
+            if is_still_running(plugin):
+                logger.warning("%s is still busy with a previous write - skipping", plugin.plugin_name)
+                summary.append(f'{plugin.plugin_name} SKIPPED (busy)')
+                written = False
+                continue
+            timeout = config.get_float_or_default(plugin.plugin_name, 'writeTimeout', DEFAULT_WRITE_TIMEOUT)
+            pending.append((plugin, timeout, asyncio.wait_for(timed_write(plugin), timeout)))
+
+        results = await asyncio.gather(*[write for _, _, write in pending], return_exceptions=True)
+
+        for (plugin, timeout, _), result in zip(pending, results):
+            outcome, plugin_written = _write_outcome(plugin, timeout, result)
+            summary.append(outcome)
+            written = written and plugin_written
+
+        logger.info(f'Published {len(metrics)} {"historic " if history else ""}metrics: {", ".join(summary)}')
+        _log_stats()
+    return written
+
+
+def _describe_metrics(metrics) -> str:
+    """
+    Returns the metrics as text, for the log
+    """
+    text_metrics = f'{datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")}: '
 
-        for metric in metrics:
-            text_metrics += f'{metric.plugin}.{metric.descriptor} ('
+    for metric in metrics:
+        text_metrics += f'{metric.plugin}.{metric.descriptor} ('
 
-            if metric.actual is not None:
-                text_metrics += f' {metric.actual} A'
+        if metric.actual is not None:
+            text_metrics += f' {metric.actual} A'
 
-            if metric.target is not None:
-                text_metrics += f' {metric.target} T'
+        if metric.target is not None:
+            text_metrics += f' {metric.target} T'
 
-            if metric.text is not None:
-                text_metrics += f' {metric.text} S'
+        if metric.text is not None:
+            text_metrics += f' {metric.text} S'
 
-            text_metrics += ' ) '
+        text_metrics += ' ) '
+    return text_metrics
 
-        logger.debug(text_metrics)
 
-        for i in plugins.outputs:
-            plugin = plugins.load(i)
-            try:
-                plugin.write(timestamp, metrics)
-            except Exception as e:
-                logger.exception("Error trying to write to %s: %s", plugin.plugin_name, str(e))
+def _write_outcome(plugin, timeout: float, result):
+    """
+    Returns how a write to an output went, for the summary, and whether the metrics were written
+    """
+    if isinstance(result, asyncio.TimeoutError):
+        logger.error("%s did not finish writing within %ss - abandoning write", plugin.plugin_name, timeout)
+        return f'{plugin.plugin_name} TIMED OUT (>{timeout:g}s)', False
+    if isinstance(result, Exception):
+        logger.error("Error trying to write to %s: %s", plugin.plugin_name, str(result), exc_info=result)
+        return f'{plugin.plugin_name} FAILED', False
+
+    points, duration = result
+    if points is None:
+        return f'{plugin.plugin_name} FAILED ({duration:.2f}s)', False
+    if plugin.has_buffered_metrics:
+        # Not written until the buffer is, so plugins don't record it as if it had been
+        return f'{plugin.plugin_name} BUFFERED ({duration:.2f}s)', False
+    return f'{plugin.plugin_name} OK ({duration:.2f}s, {points} points)', True
+
+
+def _log_stats():
+    """
+    Logs the size of the series registry, and the requests made to and the rate limit of each web API host, at debug
+    """
+    logger.debug(f'Series registry: {len(REGISTRY)} series, {REGISTRY.hit_rate:.1%} hit rate')
+    for host, stats in get_transport().stats().items():
+        logger.debug(f'HTTP {host}: {stats}')
+    for host, limiter in get_transport().rate_limiter.limiters().items():
+        logger.debug(f'Rate limit {host}: {limiter}')
+
+
+async def poll(scheduler: PollingScheduler, single_run: bool):
+    """
+    The main polling loop - polls every input plugin straight away (unless pollOnStart is false), then sleeps until the
+    next input plugin is due, reads from just the plugins which are due and publishes what they read to the outputs, all
+    on the one event loop
+    """
+    global continue_polling, event_loop
+    event_loop = asyncio.get_running_loop()
+    if single_run or config.get_boolean_or_default('DEFAULT', 'pollOnStart', True):
+        logger.info('Polling all plugins.')
+        await poll_plugins(dict(scheduler.dispatch_all()))
+    if single_run:
+        continue_polling = False
+
+    while continue_polling:
+        sleep_duration = scheduler.time_until_next_run()
+        if sleep_duration is None:
+            logger.warning('No input plugins to poll')
+            break
+        if sleep_duration > 60:
+            logger.info(f'Going to sleep for {(sleep_duration / 60):.2g} minutes')
+        else:
+            logger.info(f'Going to sleep for {sleep_duration:.2g} seconds')
+        await asyncio.sleep(sleep_duration)
+
+        due = scheduler.pop_due()
+        if due:
+            logger.info(f'Polling {", ".join(name for name, _ in due)}')
+            await poll_plugins(dict(due))
+
+
+def get_polling_interval(section: str, default_interval: str) -> str:
+    """
+    Gets the plugin's own pollingInterval, or the default one if it hasn't got one of its own
+    """
+    interval = config.get_string_or_default(section, 'pollingInterval', default_interval)
+    if config.has_option('DEFAULT', 'pollingInterval') and interval == config.get('DEFAULT', 'pollingInterval'):
+        # Inherited from [DEFAULT], which may have been overridden on the command line
+        return default_interval
+    return interval
+
+
+def log_startup_profile(discovery_duration: float):
+    """
+    Loads every plugin now, rather than when first used, and logs how long each took to import and construct
+    """
+    logger.info(f'Startup profile: plugin discovery took {discovery_duration * 1000:.1f}ms')
+    for i in plugins.inputs + plugins.outputs:
+        load_plugin(i)
+
+    # Libraries shared between plugins are only imported once, so are counted against the first plugin which uses them
+    for name, timings in sorted(plugins.profile.items(), key=lambda p: p[1]['import'], reverse=True):
+        logger.info(f'Startup profile: {name} import {timings["import"] * 1000:.1f}ms, '
+                    f'construct {timings["construct"] * 1000:.1f}ms')
 
 
 def main(argv):
@@ -205,9 +473,10 @@ def main(argv):
     polling_interval = config.get("DEFAULT", "pollingInterval", fallback="* * * * *")
     single_run = False
     debug_logging = False
+    startup_profile = False
 
     try:
-        opts, _ = getopt.getopt(argv, "hdi:", ["help", "interval", "debug="])
+        opts, _ = getopt.getopt(argv, "hdi:p", ["help", "interval", "debug=", "startup-profile"])
     except getopt.GetoptError:
         print('evologger.py -h for help')
         sys.exit(2)
@@ -223,6 +492,7 @@ def main(argv):
             print(' i|interval <interval>  : This must be specified as a cron-style string such as \'* * * * *\'.')
             print('                          Option will override the config.ini value.')
             print(' s|single               : If set, will cause EvoLogger to run once and then exit.')
+            print(' p|startup-profile      : Load every plugin at startup and report how long each took to import.')
             print('')
             sys.exit()
         elif opt in ('-i', '--interval'):
@@ -231,42 +501,57 @@ def main(argv):
             single_run = True
         elif opt in ('-d', '--debug'):
             debug_logging = True
+        elif opt in ('-p', '--startup-profile'):
+            startup_profile = True
 
     configure_logging(logging.DEBUG if debug_logging or config.is_debugging_enabled('DEFAULT') else logging.INFO)
 
     logger.info("==Started==")
 
+    configure_transport(config)
+
     global plugins
     sections = filter(lambda a: a.lower() != 'DEFAULT', config.sections())
+    discovery_started = time.perf_counter()
     plugins = PluginLoader(config, sections, './plugins')
-    scheduler = Scheduler(plugin_name='evologger', polling_interval=polling_interval)
+    if startup_profile:
+        log_startup_profile(time.perf_counter() - discovery_started)
+    # Each input is polled less often while a web API it uses is backing off
+    hosts = {i['section']: i['hosts'] for i in plugins.inputs}
+    scheduler = PollingScheduler(config.get_string_or_default('DEFAULT', 'missedTicks', 'skip').lower(),
+                                 stretch=lambda section: get_transport().rate_limiter.stretch(hosts[section]))
+    for i in plugins.inputs:
+        scheduler.add(i['section'], get_polling_interval(i['section'], polling_interval),
+                      offset=config.get_float_or_default(i['section'], 'pollingOffset', 0.0),
+                      jitter=config.get_float_or_default(i['section'], 'pollingJitter', 0.0))
+    if config.get_boolean_or_default('DEFAULT', 'stagger', False):
+        scheduler.stagger()
 
     if single_run:
         logger.info('One-off run, existing after a single publish')
     else:
-        logger.info(f'Polling according to cron-style value of {polling_interval}')
+        logger.info(f'Polling according to cron-style value of {polling_interval}, unless a plugin has its own')
 
-    try:
-        global continue_polling
-        while continue_polling:
-            logger.info(f'Polling all plugins.')
-            publish_metrics(read_metrics())
+    global input_executor, output_executor
+    input_executor = futures.ThreadPoolExecutor(max_workers=max(len(plugins.inputs), 1), thread_name_prefix='input')
+    output_executor = futures.ThreadPoolExecutor(
+        max_workers=config.get_int_or_default('DEFAULT', 'maxOutputWorkers', DEFAULT_MAX_OUTPUT_WORKERS),
+        thread_name_prefix='output')
 
-            if single_run:
-                continue_polling = False
-            else:
-                sleep_duration = scheduler.time_until_next_run()
-                if sleep_duration > 60:
-                    logger.info(f'Going to sleep for {(sleep_duration / 60):.2g} minutes')
-                else:
-                    logger.info(f'Going to sleep for {sleep_duration:.2g} seconds')
-                time.sleep(sleep_duration)
+    try:
+        asyncio.run(poll(scheduler, single_run))
 
     except SystemExit:
         pass
     except Exception as e:
         logger.exception("An error occurred, trying again in 15 seconds: %s", str(e))
         time.sleep(15)
+    finally:
+        # Don't wait for any sync plugin which missed its deadline, it will finish (or not) in the background
+        input_executor.shutdown(wait=False, cancel_futures=True)
+        output_executor.shutdown(wait=False, cancel_futures=True)
+        plugins.close()
+        get_transport().close()
 
     logger.info("==Finished==")
 
@@ -2,16 +2,22 @@
 Plugin module loader
 """
 
-import imp  # pylint: disable=deprecated-module
+import ast
+import importlib.util
 import logging
 import os
+import sys
+import time
 
 from AppConfig import AppConfig
 
 
 class PluginLoader:
     """
-    Plugin Loader to load configured plugins from the plugins folder
+    Plugin Loader to load configured plugins from the plugins folder.
+    Plugins are discovered from their module-level PLUGIN_TYPE constant without being imported, and are only imported
+    and constructed when first used.  Each plugin module is imported once and each Plugin constructed once - load()
+    always returns the same live instance
     """
 
     __MAIN_MODULE = '__init__'  # The main module name to look for in the plugin folder
@@ -20,6 +26,9 @@ class PluginLoader:
         self.__logger = logging.getLogger('pluginloader')
         self.__logger.debug("Loading Plugins from %s....", plugins_folder)
         self.__config = config
+        self.__instances = {}  # plugin name => Plugin instance
+        self.__opened = set()  # names of the plugins which have been opened
+        self.profile = {}  # plugin name => {'import': seconds, 'construct': seconds}
         self.inputs = []
         self.outputs = []
         possibleplugins = os.listdir(plugins_folder)
@@ -39,19 +48,99 @@ class PluginLoader:
                 if disabled:
                     self.__logger.debug("%s specifically disabled in config", section_name)
                     continue
-                info = imp.find_module(PluginLoader.__MAIN_MODULE, [location])
-                plugin_module = imp.load_module(PluginLoader.__MAIN_MODULE, *info)
-                self.__logger.info("Plugin: %s loaded", section_name)
-                if plugin_module.Plugin(self.__config).plugin_type == "output":
-                    self.outputs.append({"name": plugin, "info": info})
+                constants = self.__read_constants(os.path.join(location, PluginLoader.__MAIN_MODULE + '.py'))
+                plugin_type = constants.get('PLUGIN_TYPE')
+                if plugin_type is None:
+                    # No PLUGIN_TYPE constant so we have no option but to import and construct the plugin to find out
+                    self.__logger.debug("%s has no PLUGIN_TYPE, constructing it to get its type", plugin)
+                    plugin_type = self.__create(plugin, location).plugin_type
+                self.__logger.info("Plugin: %s found (%s)", section_name, plugin_type)
+                # The web API hosts the plugin talks to, so it can be backed off when they're struggling
+                hosts = tuple(constants.get('API_HOSTS', ()))
+                if plugin_type == "output":
+                    self.outputs.append({"name": plugin, "section": section_name, "location": location,
+                                         "hosts": hosts})
                 else:
-                    self.inputs.append({"name": plugin, "info": info})
+                    self.inputs.append({"name": plugin, "section": section_name, "location": location,
+                                        "hosts": hosts})
             else:
                 self.__logger.debug("%s disabled - not in allowed list", plugin)
 
+    @staticmethod
+    def __read_constants(module_file: str) -> dict:
+        """
+        Reads the module-level PLUGIN_TYPE and API_HOSTS constants from the plugin's source without importing
+        (executing) it
+        """
+        with open(module_file, encoding='UTF-8') as f:
+            tree = ast.parse(f.read(), module_file)
+
+        constants = {}
+        for node in tree.body:
+            if not isinstance(node, ast.Assign):
+                continue
+            for target in node.targets:
+                if isinstance(target, ast.Name) and target.id in ('PLUGIN_TYPE', 'API_HOSTS'):
+                    try:
+                        constants[target.id] = ast.literal_eval(node.value)
+                    except ValueError:
+                        pass  # Not a literal, so can't be read without importing the plugin
+        return constants
+
+    def __create(self, plugin: str, location: str):
+        """
+        Imports and constructs a plugin, recording how long each took
+        """
+        started = time.perf_counter()
+        plugin_module = self.__import(plugin, location)
+        imported = time.perf_counter()
+        instance = plugin_module.Plugin(self.__config)
+        self.profile[plugin] = {'import': imported - started, 'construct': time.perf_counter() - imported}
+        self.__instances[plugin] = instance
+        self.__logger.info("Plugin: %s loaded", instance.plugin_name)
+        return instance
+
+    @staticmethod
+    def __import(plugin: str, location: str):
+        """
+        Imports the plugin's main module, once, under its own name so plugins don't overwrite each other's globals
+        """
+        module_name = f'plugins.{plugin}'
+        if module_name in sys.modules:
+            return sys.modules[module_name]
+
+        spec = importlib.util.spec_from_file_location(module_name,
+                                                      os.path.join(location, PluginLoader.__MAIN_MODULE + '.py'))
+        module = importlib.util.module_from_spec(spec)
+        sys.modules[module_name] = module
+        try:
+            spec.loader.exec_module(module)
+        except Exception:
+            del sys.modules[module_name]
+            raise
+        return module
+
     def load(self, plugin: str):
         """
-        Loads and returns a plugin module
+        Returns the live instance of a plugin, importing, constructing and opening it the first time it is used
+        """
+        instance = self.__instances.get(plugin['name'])
+        if instance is None:
+            instance = self.__create(plugin['name'], plugin['location'])
+        if plugin['name'] not in self.__opened:
+            self.__logger.debug("open(%s)", plugin['name'])
+            instance.open()
+            self.__opened.add(plugin['name'])  # Only once it's open, so a plugin which fails to open is tried again
+        return instance
+
+    def close(self):
+        """
+        Closes all of the plugins which have been opened
         """
-        self.__logger.debug("load(%s)", plugin['name'])
-        return imp.load_module(PluginLoader.__MAIN_MODULE, *plugin["info"]).Plugin(self.__config)
+        for name in list(self.__opened):
+            self.__logger.debug("close(%s)", name)
+            try:
+                self.__instances[name].close()
+            except Exception as e:
+                self.__logger.exception(f'Error closing plugin {name}:\n{e}')
+            self.__opened.discard(name)
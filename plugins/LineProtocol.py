@@ -0,0 +1,169 @@
+"""
+InfluxDB line protocol encoder shared by the InfluxDB output plugins
+"""
+
+import math
+from datetime import datetime, timezone
+
+from Metric import MISSING_TIMESTAMP, MetricBatch
+from SeriesRegistry import REGISTRY, SeriesCache
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+# Nanoseconds per unit for each precision, using both the v1.x and v2.x names
+PRECISIONS = {'n': 1, 'ns': 1, 'u': 10 ** 3, 'us': 10 ** 3, 'ms': 10 ** 6, 's': 10 ** 9, 'm': 60 * 10 ** 9,
+              'h': 3600 * 10 ** 9}
+
+_MEASUREMENTS = ('actual', 'target', 'delta', 'text')
+
+_MEASUREMENT_ESCAPES = str.maketrans({',': r'\,', ' ': r'\ ', '\n': r'\n'})
+_TAG_ESCAPES = str.maketrans({',': r'\,', '=': r'\=', ' ': r'\ ', '\n': r'\n'})
+_STRING_FIELD_ESCAPES = str.maketrans({'\\': '\\\\', '"': r'\"', '\n': r'\n'})
+
+
+def escape_measurement(name: str) -> str:
+    """
+    Escapes a measurement name
+    """
+    return name.translate(_MEASUREMENT_ESCAPES)
+
+
+def escape_tag(value: str) -> str:
+    """
+    Escapes a tag key or value
+    """
+    return value.translate(_TAG_ESCAPES)
+
+
+def format_string_field(value: str) -> str:
+    """
+    Quotes and escapes a string field value
+    """
+    return f'"{value.translate(_STRING_FIELD_ESCAPES)}"'
+
+
+def to_epoch(timestamp, precision: str) -> int:
+    """
+    Converts a timestamp to an integer number of precision units since the epoch.
+    Naive datetimes are taken to be UTC and integers are assumed to already be in the right precision.
+    """
+    if isinstance(timestamp, int):
+        return timestamp
+    if timestamp.tzinfo is None:
+        timestamp = timestamp.replace(tzinfo=timezone.utc)
+    delta = timestamp - _EPOCH
+    nanoseconds = (delta.days * 86400 + delta.seconds) * 10 ** 9 + delta.microseconds * 1000
+    return nanoseconds // PRECISIONS[precision]
+
+
+class LineProtocolEncoder:
+    """
+    Encodes metrics as InfluxDB line protocol, in a single pass and without building intermediate point objects.
+    Each metric becomes up to four lines - actual, target, delta (when there's an actual and a target) and text - each
+    with a single 'value' field.  Each line is tagged with the supplied tags, taken from the metric's plugin and
+    descriptor, along with any tags of the metric's series.  The escaped measurement and tags of each series are
+    cached against its series id.
+    """
+
+    def __init__(self, precision: str = 's', tags=('plugin', 'descriptor')) -> None:
+        if precision not in PRECISIONS:
+            raise ValueError(f'precision must be one of {", ".join(PRECISIONS)}')
+        self.precision = precision
+        self._tags = tags
+        self._cache = SeriesCache()
+        self._last_timestamp = None
+        self._last_epoch = None
+
+    def _prefixes(self, series_id: int):
+        """
+        Returns the escaped measurement and tags, followed by the field key, of each of the series' measurements
+        """
+        prefixes = self._cache.get(series_id)
+        if prefixes is None:
+            plugin, descriptor = REGISTRY.name(series_id)
+            values = dict(REGISTRY.tags(series_id) or {})
+            values.update((tag, value) for tag, value in (('plugin', plugin), ('descriptor', descriptor))
+                          if tag in self._tags)
+            tags = ''.join(f',{escape_tag(tag)}={escape_tag(str(values[tag]))}'
+                           for tag in sorted(values)
+                           if values[tag] is not None and values[tag] != '')
+            prefixes = tuple(f'{escape_measurement(measurement)}{tags} value=' for measurement in _MEASUREMENTS)
+            self._cache.set(series_id, prefixes)
+        return prefixes
+
+    def _epoch(self, timestamp) -> int:
+        # Most metrics in a batch share a timestamp, so only convert it when it changes
+        if timestamp is not self._last_timestamp:
+            self._last_epoch = to_epoch(timestamp, self.precision)
+            self._last_timestamp = timestamp
+        return self._last_epoch
+
+    def encode_lines(self, timestamp, metrics) -> list:
+        """
+        Returns a line for each of the points in the metrics, which can be a list or a MetricBatch.
+        Metrics without their own timestamp are given the supplied one.
+        """
+        if isinstance(metrics, MetricBatch):
+            return self._encode_batch_lines(timestamp, metrics)
+
+        lines = []
+        append = lines.append
+        for metric in metrics:
+            actual_prefix, target_prefix, delta_prefix, text_prefix = self._prefixes(metric.series_id)
+            epoch = self._epoch(timestamp if metric.timestamp is None else metric.timestamp)
+            actual = metric.actual
+            target = metric.target
+            if actual is not None and actual != '':
+                actual = float(actual)
+                if math.isfinite(actual):
+                    append(f'{actual_prefix}{actual!r} {epoch}')
+            else:
+                actual = None
+            if target is not None and target != '':
+                target = float(target)
+                if math.isfinite(target):
+                    append(f'{target_prefix}{target!r} {epoch}')
+                if actual is not None:
+                    delta = actual - target
+                    if math.isfinite(delta):
+                        append(f'{delta_prefix}{delta!r} {epoch}')
+            if metric.text is not None and metric.text != '':
+                append(f'{text_prefix}{format_string_field(str(metric.text))} {epoch}')
+        return lines
+
+    def _encode_batch_lines(self, timestamp, batch: MetricBatch) -> list:
+        """
+        Encodes a batch column-wise, without creating a Metric for each row
+        """
+        # pylint: disable=too-many-locals
+        lines = []
+        append = lines.append
+        cycle_epoch = self._epoch(timestamp)
+        divisor = PRECISIONS[self.precision] // 1000  # Batch timestamps are in microseconds
+        for series_id, actual, target, text, microseconds in zip(batch.series_ids, batch.actual, batch.target,
+                                                                 batch.text, batch.timestamps):
+            actual_prefix, target_prefix, delta_prefix, text_prefix = self._prefixes(series_id)
+            if microseconds == MISSING_TIMESTAMP:
+                epoch = cycle_epoch
+            elif divisor:
+                epoch = microseconds // divisor
+            else:
+                epoch = microseconds * 1000
+            # NaN, for a missing value, isn't equal to itself.  Infinities are skipped as influx can't store them
+            # pylint: disable=comparison-with-itself
+            if actual == actual and not math.isinf(actual):
+                append(f'{actual_prefix}{actual!r} {epoch}')
+            if target == target and not math.isinf(target):
+                append(f'{target_prefix}{target!r} {epoch}')
+                delta = actual - target
+                if delta == delta and not math.isinf(delta):
+                    append(f'{delta_prefix}{delta!r} {epoch}')
+            if text is not None:
+                append(f'{text_prefix}{format_string_field(str(text))} {epoch}')
+        return lines
+
+    def encode(self, timestamp, metrics) -> bytes:
+        """
+        Returns the metrics as a line protocol request body
+        """
+        return '\n'.join(self.encode_lines(timestamp, metrics)).encode('utf-8')
@@ -2,11 +2,21 @@
 Console output plugin
 """
 
+import asyncio
 import logging
+import os
+import threading
+import time
 from abc import ABC, abstractmethod
 from datetime import datetime
+from tempfile import gettempdir
+from typing import Callable, Optional
 
 from AppConfig import AppConfig
+from Metric import Metric
+from Spool import Spool
+
+_SPOOL_SEGMENT_BYTES = 1024 * 1024  # Size at which a new spool segment file is started
 
 
 def _get_plugin_logger(config: AppConfig, plugin_name: str) -> logging.Logger:
@@ -45,66 +55,337 @@ class PluginBase(ABC):
     def _read_configuration(self, config: AppConfig):
         pass
 
+    def open(self):
+        """
+        Called once, before the plugin is first used.
+        Plugins are kept alive between polls so this is the place to create any sessions, clients or file handles
+        """
+
+    def close(self):
+        """
+        Called once, when the application is shutting down, to release anything acquired in open()
+        """
+
 
 class InputPluginBase(PluginBase):
     """Base class for all Input plugins"""
 
+    # Set by the application to a function which publishes metrics read outside of the polling cycle, e.g. history
+    # being backfilled, to the outputs straight away - returning once they've been written, True if every output did
+    publisher: Optional[Callable[[list], bool]] = None
+
     @abstractmethod
     def _read_metrics(self):
         """
         Subclass method to Read temperature(s) from an input source
         """
 
+    def published(self):
+        """
+        Called once the metrics from the plugin's last read have been written to every output, e.g. so it can record
+        how far it's got
+        """
+
     def read(self):
         """
         Reads temperature(s) from an input source
         """
 
+        if not self._begin_read():
+            return []
+
+        try:
+            (metrics, text_metrics) = self._read_metrics()
+            return self._end_read(metrics, text_metrics)
+        except Exception:
+            self._logger.exception('Error reading metrics, aborting read')
+            return []
+
+    def _begin_read(self) -> bool:
+        """
+        Determines if a read can go ahead
+        """
+
         if self._invalid_config:
             self._logger.debug('Invalid config, aborting read')
-            return []
+            return False
 
         debug_message = f'Reading metrics from {self.plugin_name}'
         if self._simulation:
             debug_message += ' [SIMULATED]'
             self._logger.debug(debug_message)
+        return True
 
-        try:
-            (metrics, text_metrics) = self._read_metrics()
-            text_metrics = f'{datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")} {text_metrics}'
-            if self._simulation:
-                self._logger.info(f'[SIMULATED] {text_metrics}')
-            else:
-                self._logger.debug(text_metrics)
-            return metrics
-        except Exception:
-            self._logger.exception('Error reading metrics, aborting read')
-            return []
+    def _end_read(self, metrics, text_metrics):
+        """
+        Logs the metrics which have been read and returns them
+        """
+
+        text_metrics = f'{datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")} {text_metrics}'
+        if self._simulation:
+            self._logger.info(f'[SIMULATED] {text_metrics}')
+        else:
+            self._logger.debug(text_metrics)
+        return metrics
 
 
 class OutputPluginBase(PluginBase):
     """Base class for all output plugins"""
 
+    # pylint: disable=too-many-instance-attributes
+
+    # True if _write_metrics honours each metric's own timestamp, so batches from several cycles can be merged into one.
+    # Otherwise buffering is only possible if the plugin overrides _write_cycles
+    _accepts_merged_batches: bool = False
+    _spool: Spool = None
+    _spool_replay_batch_size: int = None
+
+    def __init__(self, config: AppConfig, plugin_name: str, plugin_type: str) -> None:
+        super().__init__(config, plugin_name, plugin_type)
+
+        if config.get_boolean_or_default(plugin_name, 'spool', False) and not self._simulation:
+            directory = config.get_string_or_default(plugin_name, 'spoolDirectory',
+                                                     os.path.join(gettempdir(), 'evologger-spool', plugin_name))
+            self._spool = Spool(directory, plugin_name,
+                                max_bytes=int(config.get_float_or_default(plugin_name, 'spoolMaxSizeMB', 50) * 1048576),
+                                max_age_seconds=config.get_float_or_default(plugin_name, 'spoolMaxAgeHours', 168) * 3600,
+                                segment_bytes=_SPOOL_SEGMENT_BYTES,
+                                logger=self._logger)
+            self._spool_replay_batch_size = config.get_int_or_default(plugin_name, 'spoolReplayBatchSize', 5000)
+            self._logger.debug(f'Spooling failed writes to {directory}')
+
+        # Optional buffering of metrics across cycles so they can be written in fewer, larger batches
+        self._flush_every_cycles = config.get_int_or_default(plugin_name, 'flushEveryCycles', 0)
+        self._flush_interval = config.get_float_or_default(plugin_name, 'flushIntervalSeconds', 0)
+        self._max_buffered_points = config.get_int_or_default(plugin_name, 'maxBufferedPoints', 0)
+        self._buffering = self._flush_every_cycles > 1 or self._flush_interval > 0
+        self._buffer = []  # (timestamp, metrics) for each buffered cycle
+        self._buffered_points = 0
+        self._buffer_started = None
+        self._buffer_lock = threading.Lock()
+        can_write_cycles = self._accepts_merged_batches or \
+            type(self)._write_cycles is not OutputPluginBase._write_cycles  # pylint: disable=comparison-with-callable
+        if self._buffering and not can_write_cycles:
+            self._logger.warning('Buffering is not supported by this plugin, each cycle will be written as it happens')
+            self._buffering = False
+
     @abstractmethod
-    def _write_metrics(self, timestamp, metrics) -> str:
+    def _write_metrics(self, timestamp, metrics) -> int:
         """
         Implementations-specific temperature writer
+        Returns the number of points written (None => one per metric).  Errors should be raised, not swallowed,
+        so the write is reported as failed.
         """
 
-    def write(self, timestamp, metrics):
+    @property
+    def honours_metric_timestamps(self) -> bool:
+        """
+        True if each metric is written with its own timestamp, if it has one, rather than that of the cycle - so history,
+        e.g. metrics being backfilled, can be written to the output
+        """
+        return self._accepts_merged_batches
+
+    @property
+    def has_buffered_metrics(self) -> bool:
+        """
+        True if metrics are being held in the buffer, so they haven't been written yet and would be lost if the
+        application stopped
+        """
+        return bool(self._buffer)
+
+    def write(self, timestamp, metrics) -> int:
         """
         Writes the teemperatures to an output destination
+        Returns the number of points written, or None if the write was aborted
+        """
+        if not self._begin_write():
+            return None
+
+        with self._buffer_lock:
+            if not self._buffering:
+                return self._write_batch([(timestamp, metrics)])
+            self._buffer_metrics(timestamp, metrics)
+            if not self._buffer_is_due():
+                return 0
+            return self._write_batch(self._take_buffer())
+
+    def flush(self) -> int:
+        """
+        Writes any buffered metrics now, whether or not they are due to be written
+        Returns the number of points written, or None if the write was aborted
+        """
+        with self._buffer_lock:
+            if not self._buffer:
+                return 0
+            self._logger.debug(f'Flushing {self._buffered_points} buffered metrics')
+            return self._write_batch(self._take_buffer())
+
+    def close(self):
+        """
+        Writes any buffered metrics before the application shuts down
+        """
+        self.flush()
+
+    def _write_cycles(self, cycles) -> int:
+        """
+        Writes several buffered cycles, a list of (timestamp, metrics), at once.
+        By default they are merged into a single batch, with metrics without their own timestamp given that of the cycle
+        they were read in.  Plugins which don't honour each metric's timestamp can override this instead.
+        Returns the number of points written (None => one per metric)
+        """
+        merged = []
+        for cycle_timestamp, metrics in cycles:
+            for m in metrics:
+                # Metrics are shared between the outputs, so copy rather than change them
+                merged.append(m if m.timestamp is not None else
+                              Metric(m.plugin, m.descriptor, m.actual, m.target, m.text, cycle_timestamp))
+        return self._write_metrics(cycles[-1][0], merged)
+
+    def _write_batch(self, cycles) -> int:
+        try:
+            if len(cycles) == 1:
+                points = self._write_metrics(*cycles[0])
+            else:
+                points = self._write_cycles(cycles)
+        except Exception:
+            self._logger.exception('Error writing metrics, aborting write')
+            for timestamp, metrics in cycles:
+                self._spool_failed_write(timestamp, metrics)
+            return None
+
+        self._replay_spool(self._write_metrics)
+        return sum(len(metrics) for _, metrics in cycles) if points is None else points
+
+    def _buffer_metrics(self, timestamp, metrics):
+        if not self._buffer:
+            self._buffer_started = time.monotonic()
+        self._buffer.append((timestamp, metrics))
+        self._buffered_points += len(metrics)
+
+    def _buffer_is_due(self) -> bool:
+        """
+        Determines if the buffered metrics should be written now
+        """
+        return (0 < self._flush_every_cycles <= len(self._buffer)) or \
+               (0 < self._flush_interval <= time.monotonic() - self._buffer_started) or \
+               (0 < self._max_buffered_points <= self._buffered_points)
+
+    def _take_buffer(self):
+        """
+        Empties the buffer, returning the buffered (timestamp, metrics) cycles
+        """
+        cycles = self._buffer
+        self._buffer = []
+        self._buffered_points = 0
+        self._buffer_started = None
+        return cycles
+
+    def _spool_failed_write(self, timestamp, metrics):
+        """
+        Saves a batch which failed to be written so it can be replayed later
+        """
+        if self._spool is None:
+            return
+        try:
+            self._spool.append(timestamp, metrics)
+        except Exception as e:
+            self._logger.exception(f'Error spooling metrics, {len(metrics)} metrics lost:\n{e}')
+
+    def _replay_spool(self, write):
+        """
+        Replays any spooled batches now the output is accepting writes again
+        """
+        if self._spool is None or self._spool.is_empty():
+            return
+        try:
+            self._spool.replay(write, self._spool_replay_batch_size, self._accepts_merged_batches)
+        except Exception as e:
+            self._logger.exception(f'Error replaying spooled metrics:\n{e}')
+        self._logger.info(f'Spool: {self._spool.spooled} spooled, {self._spool.replayed} replayed, '
+                          f'{self._spool.dropped} dropped')
+
+    def _begin_write(self) -> bool:
+        """
+        Determines if a write can go ahead
         """
         if self._invalid_config:
             self._logger.warning('Invalid config, aborting write')
-            return
+            return False
 
         debug_message = 'Writing metrics to ' + self.plugin_name
         if self._simulation:
             debug_message += ' [SIMULATED]'
         self._logger.debug(debug_message)
+        return True
+
+
+class AsyncInputPluginBase(InputPluginBase):
+    """
+    Base class for Input plugins implemented with asyncio.
+    read() is a coroutine which runs on the application's event loop, rather than on a thread of its own
+    """
+
+    @abstractmethod
+    async def _read_metrics(self):  # pylint: disable=invalid-overridden-method
+        """
+        Subclass coroutine to Read temperature(s) from an input source
+        """
+
+    async def read(self):  # pylint: disable=invalid-overridden-method
+        """
+        Reads temperature(s) from an input source
+        """
+
+        if not self._begin_read():
+            return []
 
         try:
-            self._write_metrics(timestamp, metrics)
+            (metrics, text_metrics) = await self._read_metrics()
+            return self._end_read(metrics, text_metrics)
+        except Exception:
+            self._logger.exception('Error reading metrics, aborting read')
+            return []
+
+
+class AsyncOutputPluginBase(OutputPluginBase):
+    """
+    Base class for output plugins implemented with asyncio.
+    write() is a coroutine which runs on the application's event loop, rather than on a thread of its own
+    """
+
+    def __init__(self, config: AppConfig, plugin_name: str, plugin_type: str) -> None:
+        super().__init__(config, plugin_name, plugin_type)
+        if self._buffering:
+            self._logger.warning('Buffering is not supported by async plugins, each cycle will be written as it happens')
+            self._buffering = False
+
+    @abstractmethod
+    async def _write_metrics(self, timestamp, metrics) -> int:  # pylint: disable=invalid-overridden-method
+        """
+        Implementations-specific temperature writer coroutine
+        Returns the number of points written (None => one per metric).  Errors should be raised, not swallowed,
+        so the write is reported as failed.
+        """
+
+    async def write(self, timestamp, metrics) -> int:  # pylint: disable=invalid-overridden-method
+        """
+        Writes the teemperatures to an output destination
+        Returns the number of points written, or None if the write was aborted
+        """
+        if not self._begin_write():
+            return None
+
+        try:
+            points = await self._write_metrics(timestamp, metrics)
         except Exception:
             self._logger.exception('Error writing metrics, aborting write')
+            self._spool_failed_write(timestamp, metrics)
+            return None
+
+        if self._spool is not None and not self._spool.is_empty():
+            # The spool is file based so replay it on a thread, with each batch written back on the event loop
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(None, self._replay_spool,
+                                       lambda t, m: asyncio.run_coroutine_threadsafe(self._write_metrics(t, m),
+                                                                                     loop).result())
+        return len(metrics) if points is None else points
@@ -5,15 +5,19 @@ Console output plugin
 from AppConfig import AppConfig
 from plugins.PluginBase import OutputPluginBase
 
+PLUGIN_TYPE = 'output'
+
 
 class Plugin(OutputPluginBase):
     """Console output Plugin immplementation"""
 
+    _accepts_merged_batches = True
+
     def _read_configuration(self, config: AppConfig):
         self._hot_water = config.get_string_or_default('DEFAULT', 'HotWater', None)
 
     def __init__(self, config: AppConfig) -> None:
-        super().__init__(config, 'Console', 'output')
+        super().__init__(config, 'Console', PLUGIN_TYPE)
 
     def _write_metrics(self, timestamp, metrics):
         """
@@ -38,3 +42,5 @@ class Plugin(OutputPluginBase):
 
         if self._simulation is False:
             self._logger.info(text_metrics)
+
+        return len(metrics)
@@ -1,74 +1,330 @@
 """
 CSV file output plugin
 """
+# pylint: disable=too-many-instance-attributes
 
 import csv
-import os.path
+import gzip
+import itertools
+import json
+import os
+import shutil
+import time
+from datetime import datetime
 
 from AppConfig import AppConfig
+from SeriesRegistry import SeriesCache
 from plugins.PluginBase import OutputPluginBase
 
+PLUGIN_TYPE = 'output'
+_ROTATIONS = ('none', 'daily', 'size')
+_FORMATS = ('wide', 'long')
+_KINDS = (' [A]', ' [T]', ' [S]')  # Suffixed to the series in the headings of the actual, target and text columns
+_LONG_HEADER = ['time', 'plugin', 'descriptor', 'actual', 'target', 'text', 'ts']
+
+
+class _CountingWriter:
+    """
+    Passes text through to a file, counting the characters written so the file's size is known without asking the OS
+    """
+
+    def __init__(self, file, size: int) -> None:
+        self._file = file
+        self.size = size
+
+    def write(self, text: str):
+        """
+        Writes the text to the file, adding its length to the size
+        """
+        self.size += len(text)
+        return self._file.write(text)
+
+
+class _ColumnIndex:
+    """
+    The column of each series in the wide format, persisted next to the file so a series' column never moves.
+    New series are given the next free column.  A file written before the plugin was part of the heading keeps its
+    columns, each taken over by the first series with that descriptor.
+    """
+
+    def __init__(self, filename: str, logger) -> None:
+        self.filename = filename
+        self._logger = logger
+        self.headings = []  # Excludes the Time column
+        self._positions = {}
+        self._legacy = set()  # Loaded headings which could still be '<descriptor> [X]', without the plugin
+        self._changed = False
+        self.loaded = False
+
+    def load(self, csv_filename: str):
+        """
+        Loads the index, or creates it from the header of an existing file so its columns are kept
+        """
+        headings = []
+        self.loaded = True
+        if os.path.isfile(self.filename):
+            with open(self.filename, encoding='UTF-8') as f:
+                headings = json.load(f)
+        elif os.path.isfile(csv_filename) and os.path.getsize(csv_filename) > 0:
+            with open(csv_filename, encoding='UTF-8', newline='') as f:
+                headings = next(csv.reader(f), ['Time'])[1:]  # pylint: disable=no-member
+            self._changed = True
+        self.headings = headings
+        self._positions = {}
+        for position, heading in enumerate(headings, start=1):
+            self._positions.setdefault(heading, position)
+        self._legacy = set(self._positions)
+
+    def position(self, heading: str, legacy_heading: str) -> int:
+        """
+        Returns the column for the heading, taking over the column of its legacy heading or adding one if it's new
+        """
+        position = self._positions.get(heading)
+        if position is None and legacy_heading in self._legacy:
+            self._legacy.discard(legacy_heading)
+            position = self._positions.pop(legacy_heading)
+            self._positions[heading] = position
+            self.headings[position - 1] = heading
+            self._changed = True
+            self._logger.info(f'Column "{legacy_heading}" at position {position} renamed "{heading}"')
+        elif position is None:
+            self.headings.append(heading)
+            position = self._positions[heading] = len(self.headings)
+            self._changed = True
+            self._logger.info(f'New column "{heading}" added at position {position}')
+        return position
+
+    def save(self):
+        """
+        Saves the index if a column has been added, to a temporary file which then replaces it so it's never seen half
+        written
+        """
+        if not self._changed:
+            return
+        temp_file = f'{self.filename}.tmp'
+        with open(temp_file, 'w', encoding='UTF-8') as f:
+            json.dump(self.headings, f)
+        os.replace(temp_file, self.filename)
+        self._changed = False
+
 
 class Plugin(OutputPluginBase):
     """CSV output Plugin immplementation"""
 
+    @property
+    def honours_metric_timestamps(self) -> bool:
+        return True  # Metrics with a timestamp of their own get a row (wide) or ts (long) of their own
+
     def _read_configuration(self, config: AppConfig):
         self._filename = config.get(self.plugin_name, "filename")
+        self._buffer_size = config.get_int_or_default(self.plugin_name, 'bufferSizeKB', 64) * 1024
+        self._file_flush_interval = config.get_float_or_default(self.plugin_name, 'fileFlushIntervalSeconds', 0)
+        self._fsync = config.get_boolean_or_default(self.plugin_name, 'fsync', False)
+        self._rotate = config.get_string_or_default(self.plugin_name, 'rotate', 'none').lower()
+        if self._rotate not in _ROTATIONS:
+            raise ValueError(f'rotate must be one of {", ".join(_ROTATIONS)}')
+        self._rotate_size = int(config.get_float_or_default(self.plugin_name, 'rotateSizeMB', 10) * 1048576)
+        self._compress_rotated = config.get_boolean_or_default(self.plugin_name, 'compressRotated', True)
+        self._format = config.get_string_or_default(self.plugin_name, 'format', 'wide').lower()
+        if self._format not in _FORMATS:
+            raise ValueError(f'format must be one of {", ".join(_FORMATS)}')
+        self._columns = _ColumnIndex(f'{self._filename}.columns.json', self._logger) if self._format == 'wide' else None
+        self._positions = SeriesCache()  # Series id => its [actual, target, text] columns
+        self._file = None
+        self._writer = None
+        self._counter = None
+        self._file_day = None  # UTC date of the rows in the current file, for daily rotation
+        self._last_flush = None
 
     def __init__(self, config: AppConfig) -> None:
-        super().__init__(config, 'Csv', 'output')
+        super().__init__(config, 'Csv', PLUGIN_TYPE)
 
-    def _write_metrics(self, timestamp, metrics):
+    def open(self):
         """
-        Writes the temperatures to the configured file
+        Opens the file, which is kept open for the lifetime of the plugin
+        """
+        if self._simulation or self._invalid_config:
+            return
+        try:
+            self._open_file()
+        except Exception:
+            # Already logged, and retried on the next write
+            pass
+
+    def close(self):
+        """
+        Writes any buffered rows and closes the file
         """
+        super().close()
+        self._close_file()
+
+    def _open_file(self):
+        if self._file is not None:
+            return
+        try:
+            self._file = open(self._filename, 'a', buffering=self._buffer_size, encoding='UTF-8', newline='')
+        except Exception as e:
+            self._logger.error(f'Error opening {self._filename} for writing - aborting write\n{e}')
+            raise
+        size = os.fstat(self._file.fileno()).st_size
+        self._counter = _CountingWriter(self._file, size)
+        self._writer = csv.writer(self._counter, delimiter=',', quoting=csv.QUOTE_MINIMAL)  # pylint: disable=no-member
+        self._file_day = datetime.utcfromtimestamp(os.path.getmtime(self._filename)).date() if size > 0 else None
+        if self._columns is not None and not self._columns.loaded:
+            self._columns.load(self._filename)
+        self._last_flush = time.monotonic()
 
-        csv_file = None
-        writer = None
+    def _close_file(self):
+        if self._file is None:
+            return
+        try:
+            self._flush_file(force=True)
+        finally:
+            self._file.close()
+            self._file = None
+            self._writer = None
+            self._counter = None
 
+    def _abandon_file(self):
+        """
+        Drops the file handle after an error, so the file is reopened on the next write
+        """
         try:
-            csv_write_headers = not self._simulation and not os.path.isfile(self._filename)
+            self._close_file()
+        except Exception:
+            self._file = None
+            self._writer = None
+            self._counter = None
 
-            if not self._simulation:
-                try:
-                    csv_file = open(self._filename, 'a', encoding='UTF-8')
-                except Exception as e:
-                    self._logger.exception(f'Error opening {self._filename} for writing - aborting write\n{e}')
+    def _flush_file(self, force: bool = False):
+        """
+        Hands the buffered rows to the OS, when forced or every fileFlushIntervalSeconds, and optionally fsyncs them
+        """
+        now = time.monotonic()
+        if not force and now - self._last_flush < self._file_flush_interval:
+            return
+        self._file.flush()
+        if self._fsync:
+            os.fsync(self._file.fileno())
+        self._last_flush = now
 
-                writer = csv.writer(csv_file, delimiter=',', quoting=csv.QUOTE_MINIMAL)
+    def _rotation_is_due(self, timestamp: datetime) -> bool:
+        if self._counter.size == 0:
+            return False
+        if self._rotate == 'daily':
+            return self._file_day is not None and timestamp.date() != self._file_day
+        if self._rotate == 'size':
+            return self._counter.size >= self._rotate_size
+        return False
 
-            if not self._simulation and csv_write_headers:
+    def _rotate_file(self):
+        """
+        Renames the current file, compressing it if required, and starts a new one
+        """
+        self._close_file()
 
-                self._logger.debug(f'Creating {self._filename}')
+        stem, extension = os.path.splitext(self._filename)
+        if self._rotate == 'daily':
+            suffix = self._file_day.strftime('%Y-%m-%d')
+        else:
+            suffix = datetime.utcnow().strftime('%Y-%m-%d-%H%M%S')
+        rotated = f'{stem}.{suffix}{extension}'
+        counter = 1
+        while os.path.exists(rotated) or os.path.exists(rotated + '.gz'):
+            rotated = f'{stem}.{suffix}-{counter}{extension}'
+            counter += 1
 
-                fieldnames = ['Time']
-                for metric in metrics:
-                    if metric.actual is not None:
-                        fieldnames.append(metric.descriptor + ' [A]')
-                    if metric.target is not None:
-                        fieldnames.append(metric.descriptor + ' [T]')
-                    if metric.text is not None:
-                        fieldnames.append(metric.descriptor + ' [S]')
-                    if metric.timestamp is not None:
-                        fieldnames.append(metric.descriptor + ' [TS]')
+        os.replace(self._filename, rotated)
+        if self._compress_rotated:
+            # Streamed, so the whole file is never held in memory
+            with open(rotated, 'rb') as source, gzip.open(rotated + '.gz', 'wb') as destination:
+                shutil.copyfileobj(source, destination)
+            os.remove(rotated)
+            rotated += '.gz'
+        self._logger.info(f'Rotated {self._filename} to {rotated}')
 
-                writer.writerow(fieldnames)
+        self._open_file()
 
-            row = [timestamp]
-            for metric in metrics:
-                if metric.actual is not None:
-                    row.append(metric.actual)
+    def _wide_rows(self, timestamp, metrics):
+        """
+        Returns a row for each distinct timestamp in the metrics, with each value in its series' column
+        """
+        rows = {}
+        for metric in metrics:
+            effective_timestamp = timestamp if metric.timestamp is None else metric.timestamp
+            values = rows.get(effective_timestamp)
+            if values is None:
+                values = rows[effective_timestamp] = {}
+            positions = self._positions.get(metric.series_id)
+            if positions is None:
+                positions = [None, None, None]  # Only given a column once the series has a value for it
+                self._positions.set(metric.series_id, positions)
+            for kind, value in enumerate((metric.actual, metric.target, metric.text)):
+                if value is not None:
+                    if positions[kind] is None:
+                        # Plugins can read series with the same descriptor, e.g. Outside, so both make the heading
+                        positions[kind] = self._columns.position(f'{metric.plugin} {metric.descriptor}{_KINDS[kind]}',
+                                                                 f'{metric.descriptor}{_KINDS[kind]}')
+                    values[positions[kind]] = value
 
-                if metric.target is not None:
-                    row.append(metric.target)
+        result = []
+        for effective_timestamp, values in rows.items():
+            row = [None] * (max(values, default=0) + 1)
+            row[0] = effective_timestamp
+            for position, value in values.items():
+                row[position] = value
+            result.append(row)
+        return result
 
-                if metric.text is not None:
-                    row.append(metric.text)
+    @staticmethod
+    def _long_rows(timestamp, metrics):
+        """
+        Returns a row per metric, lazily so that even very large batches aren't copied
+        """
+        return ((timestamp, m.plugin, m.descriptor, m.actual, m.target, m.text, m.timestamp) for m in metrics)
 
-                if metric.timestamp is not None:
-                    row.append(metric.timestamp)
+    def _write_rows(self, chunks):
+        if self._counter.size == 0:
+            self._logger.debug(f'Creating {self._filename}')
+            self._writer.writerow(['Time'] + self._columns.headings if self._columns is not None else _LONG_HEADER)
+        self._writer.writerows(itertools.chain.from_iterable(chunks))
 
-        finally:
-            if self._simulation is False and writer is not None:
-                writer.writerow(row)
-                csv_file.close()
+    def _write_metrics(self, timestamp, metrics):
+        """
+        Writes the temperatures to the configured file
+        """
+        return self._write_cycles([(timestamp, metrics)])
+
+    def _write_cycles(self, cycles):
+        """
+        Writes the rows for each cycle with a single writerows call, unless the file needs to be rotated part way through
+        """
+        if self._simulation:
+            return sum(len(metrics) for _, metrics in cycles)
+
+        self._open_file()
+
+        try:
+            chunks = []
+            for timestamp, metrics in cycles:
+                if self._rotate != 'none' and self._rotation_is_due(timestamp):
+                    self._write_rows(chunks)
+                    chunks = []
+                    self._rotate_file()
+
+                if self._columns is not None:
+                    chunks.append(self._wide_rows(timestamp, metrics))
+                else:
+                    chunks.append(self._long_rows(timestamp, metrics))
+                self._file_day = timestamp.date()
+
+            self._write_rows(chunks)
+            self._flush_file()
+            if self._columns is not None:
+                self._columns.save()
+        except Exception as e:
+            self._logger.error(f'Error writing to {self._filename} - aborting write\n{e}')
+            self._abandon_file()
+            raise
+
+        return sum(len(metrics) for _, metrics in cycles)
@@ -14,6 +14,8 @@ from Metric import *
 from Scheduler import Scheduler
 from plugins.PluginBase import InputPluginBase
 
+PLUGIN_TYPE = 'input'
+
 
 class Plugin(InputPluginBase):
     """DarkSky input Plugin immplementation"""
@@ -34,7 +36,7 @@ class Plugin(InputPluginBase):
                                    )
 
     def __init__(self, config: AppConfig) -> None:
-        super().__init__(config, 'DarkSky', 'input')
+        super().__init__(config, 'DarkSky', PLUGIN_TYPE)
 
     @staticmethod
     def _dt(u: int):
@@ -6,13 +6,15 @@ import json
 import random
 from datetime import timedelta
 
-import requests
-
 from AppConfig import AppConfig
+from HttpTransport import get_transport
 from Metric import *
 from Scheduler import Scheduler
 from plugins.PluginBase import InputPluginBase
 
+PLUGIN_TYPE = 'input'
+API_HOSTS = ('consumer-api.data.n3rgy.com',)
+
 
 class Plugin(InputPluginBase):
     """DCC Api Ingestion"""
@@ -31,7 +33,7 @@ class Plugin(InputPluginBase):
                                    )
 
     def __init__(self, config: AppConfig) -> None:
-        super().__init__(config, 'DCCApi', 'input')
+        super().__init__(config, 'DCCApi', PLUGIN_TYPE)
 
     @staticmethod
     def _adjust_dt(dt: str, period: int) -> str:
@@ -48,7 +50,7 @@ class Plugin(InputPluginBase):
         if start_range != 0 and end_range != 0:
             base_url = f'{base_url}?start={start_range}&end={end_range}'
 
-        rdata = json.loads(requests.get(url=base_url, headers=headers).content)
+        rdata = json.loads(get_transport().get(base_url, headers=headers).content)
 
         if 'Message' in rdata:
             self._logger.error(rdata['Message'])
@@ -7,8 +7,12 @@ import time
 import requests
 
 from AppConfig import AppConfig
+from HttpTransport import get_transport
+from SeriesRegistry import SeriesCache
 from plugins.PluginBase import OutputPluginBase
 
+PLUGIN_TYPE = 'output'
+
 
 class Plugin(OutputPluginBase):
     """EMON CMS output Plugin immplementation"""
@@ -17,35 +21,41 @@ class Plugin(OutputPluginBase):
         api_key = config.get(self.plugin_name, "apiKey")
         node = config.get(self.plugin_name, "node")
         self._post_url = f'http://emoncms.org/input/post?apikey={api_key}&node={node}'
+        self._keys = SeriesCache()  # Series id => (actual key, target key)
 
     def __init__(self, config: AppConfig) -> None:
-        super().__init__(config, 'Emoncms', 'output')
+        super().__init__(config, 'Emoncms', PLUGIN_TYPE)
 
     def _write_metrics(self, timestamp, metrics):
         """
         Writes the temperatures to emoncms.org
         """
 
-        url = f'{self._post_url}&time={time.mktime(timestamp.timetuple())}&json={{'
-
+        fields = []
         for metric in metrics:
-            url = f'{url}{metric.descriptor} Actual: {str(metric.actual)},'
+            keys = self._keys.get(metric.series_id)
+            if keys is None:
+                keys = (f'{metric.descriptor}Actual', f'{metric.descriptor}Target')
+                self._keys.set(metric.series_id, keys)
+            fields.append(f'{keys[0]}:{metric.actual}')
             if metric.target is not None:
-                url += f'{metric.descriptor} Target: {str(metric.target)},'
+                fields.append(f'{keys[1]}:{metric.target}')
 
-        url += '}'
-        url = url.replace(",}", "}")
-        url = url.replace(" ", "")
+        url = f'{self._post_url}&time={time.mktime(timestamp.timetuple())}&json={{{",".join(fields)}}}'
 
         try:
             if self._simulation is False:
                 self._logger.debug('URL: %s', url)
-                with requests.get(url) as response:
+                with get_transport().get(url) as response:
                     self._logger.debug(
                         f'Emon API response from {url}: {response.status_code} {response.reason} {response.content}')  # pylint disable=W1201
                     response.raise_for_status()
         except requests.HTTPError as e:
-            self._logger.exception(
+            self._logger.error(
                 f'Emon API HTTPError from {url}: {response.status_code} {response.reason} - aborting write\nError: {e}')
+            raise
         except Exception as e:
-            self._logger.exception(f'Emon API error writing to {url} - aborting write\nError: {e}')
+            self._logger.error(f'Emon API error writing to {url} - aborting write\nError: {e}')
+            raise
+
+        return len(metrics)
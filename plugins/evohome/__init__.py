@@ -4,21 +4,33 @@ Evohome input plugin - for getting all your zone and DHW temperatures
 # pylint: disable=too-many-arguments,protected-access
 
 import http  # Need this for disabling http debugging if necessary
-import io
 import json
 import logging
+import itertools
 import random
+import time
+from collections import Counter
+from concurrent import futures
 from tempfile import gettempdir
 
 import requests
 from evohomeclient import EvohomeClient
-from evohomeclient2 import EvohomeClient as EvohomeClient2
+from evohomeclient2 import AuthenticationError, EvohomeClient as EvohomeClient2
 
 from AppConfig import AppConfig
+from HttpTransport import get_transport
 from Metric import *
 from Scheduler import Scheduler
+from TokenStore import TokenStore, get_token_store
 from plugins.PluginBase import InputPluginBase, _get_plugin_logger
 
+PLUGIN_TYPE = 'input'
+API_HOSTS = ('tccna.honeywell.com',)
+
+DEFAULT_INSTALLATION_CACHE_MINUTES = 60
+DEFAULT_RAW_DATA_DUMP_INTERVAL_MINUTES = 15
+_TOKEN_EXPIRY_FORMAT = "%Y-%m-%d %H:%M:%S.%f"
+
 
 class EvohomeMultiLocationClient(EvohomeClient2):
     """
@@ -26,9 +38,48 @@ class EvohomeMultiLocationClient(EvohomeClient2):
     """
 
     def __init__(self, config: AppConfig, plugin_name, username: str, password: str, debug: bool = False,
-                 refresh_token=None, access_token=None, access_token_expires=None):
-        super().__init__(username, password, debug, refresh_token, access_token, access_token_expires)
+                 refresh_token=None, access_token=None, access_token_expires=None, token_store: TokenStore = None):
+        # The base class logs in straight away, so these must be set first
         self._logger = _get_plugin_logger(config, f'{plugin_name}:{self.__class__.__name__}')
+        self._token_store = token_store
+        # The tokens the client was built from, or last adopted from the store - so it can tell if someone else has
+        # refreshed them since.  The base class forgets a revoked access token before logging in again, so its own
+        # tokens can't be used for this
+        self._adopted_tokens = self._stored_form(access_token, refresh_token, access_token_expires)
+        super().__init__(username, password, debug, refresh_token, access_token, access_token_expires)
+
+    @staticmethod
+    def _stored_form(access_token, refresh_token, access_token_expires):
+        expires = None if access_token_expires is None else access_token_expires.strftime(_TOKEN_EXPIRY_FORMAT)
+        return [access_token, refresh_token, expires]
+
+    def token_data(self):
+        """
+        Returns the tokens in the form they're stored in
+        """
+        return self._stored_form(self.access_token, self.refresh_token, self.access_token_expires)
+
+    def _basic_login(self):
+        """
+        Gets a new access token via the token store, if there is one, so that only one of the clients sharing it does
+        """
+        if self._token_store is None:
+            super()._basic_login()
+            return
+
+        def fetch(current):
+            if current is not None and current[1]:
+                # Whoever saved these may have used our refresh token, so theirs is the one which will work
+                self.refresh_token = current[1]
+            # fetch() isn't a method, so super() needs to be told the class and instance
+            super(EvohomeMultiLocationClient, self)._basic_login()  # pylint: disable=super-with-arguments
+            return self.token_data()
+
+        tokens = self._token_store.refresh(self._adopted_tokens, fetch)
+        self._adopted_tokens = tokens
+        self.access_token = tokens[0]
+        self.refresh_token = tokens[1]
+        self.access_token_expires = datetime.strptime(tokens[2], _TOKEN_EXPIRY_FORMAT)
 
     def get_location(self, locationId=None):
         """
@@ -50,6 +101,20 @@ class EvohomeMultiLocationClient(EvohomeClient2):
         self._logger.debug(f'Location {actual_location} found')
         return actual_location
 
+    def get_locations(self, locationIds=None):
+        """
+        Get the locations with the supplied names or ids, every location if one of them is 'all', or the first location
+        if none are specified
+        """
+
+        if not locationIds:
+            return [self.get_location()]
+
+        if any(locationId.lower() == 'all' for locationId in locationIds):
+            return list(self.locations)
+
+        return [self.get_location(locationId) for locationId in locationIds]
+
     def get_heating_system(self, locationId=None):
         """
         Get the heating system for the location with the supplied id or name, or for the first location if none is specified
@@ -104,19 +169,47 @@ class Plugin(InputPluginBase):
         self._config = config
         section = config[self.plugin_name]
         self._plugin_version = config.get_int_or_default(self.plugin_name, 'APIVersion', 2)
-        self._token_file = f'{gettempdir()}/{self.plugin_name}.v{self._plugin_version}_access_tokens.json'
+        # Actually getting a token is rate-limited, though using it is not.
+        # So we get and store tokens we can reuse them
+        # https://github.com/watchforstock/evohome-client/issues/57
+        self._token_store = get_token_store(
+            f'{gettempdir()}/{self.plugin_name}.v{self._plugin_version}_access_tokens.json', self._logger)
+        self._client_tokens = None  # The v1 session-id the client was created with, or last saved
         self._http_debug = config.get_boolean_or_default('DEFAULT', 'httpDebug', False)
         self._username = section['username']
         self._password = section['password']
-        self._location = config.get_string_or_default(self.plugin_name, 'Location', None)
-        if self._location is None:
+        # A list of location names or ids, or 'all'
+        self._locations = [location.strip()
+                           for location in config.get_string_or_default(self.plugin_name, 'Location', '').split(',')
+                           if location.strip() != '']
+        if not self._locations:
             self._logger.debug('No location specified, will use the first by default')
         else:
-            self._logger.debug(f'Using location: {self._location}')
+            self._logger.debug(f'Using location(s): {", ".join(self._locations)}')
 
         self._hotwater = section['HotWater']
         self._hotwater_setpoint = config.get_float_or_default(self.plugin_name, 'HotWaterSetPoint', None)
 
+        # The client is kept between polls, and the installation details it fetched when it logged in are only
+        # fetched again once they're this old
+        self._installation_cache_seconds = config.get_float_or_default(self.plugin_name, 'installationCacheMinutes',
+                                                                       DEFAULT_INSTALLATION_CACHE_MINUTES) * 60
+        self._client = None
+        self._installation_expires = 0.0
+        # Calls made to the API during the last poll, by type:
+        #   login - creating the client, which logs in and fetches the installation and the status of each location
+        #   installation - fetching the installation details again, once they've expired
+        #   status - fetching the status of the location, which has the temperatures of every zone and the hot water
+        self.api_calls = Counter()
+
+        # The raw data the temperatures were read from is logged along with any error reading them, but only once per
+        # poll and then not again for this long, so an API problem doesn't flood the log
+        self._raw_data_dump_interval = config.get_float_or_default(self.plugin_name, 'rawDataDumpIntervalMinutes',
+                                                                   DEFAULT_RAW_DATA_DUMP_INTERVAL_MINUTES) * 60
+        self._raw_data = None  # The raw data of the current poll, once it's been needed
+        self._raw_data_dumped = False  # Whether the raw data has been logged during the current poll
+        self._next_raw_data_dump = 0.0
+
         self.scheduler = Scheduler(plugin_name=self.plugin_name,
                                    polling_interval=config.get_string_or_default(self.plugin_name,
                                                                                  'pollingInterval',
@@ -124,39 +217,57 @@ class Plugin(InputPluginBase):
                                    )
 
         self._logger.debug(f'Leveraging API Version {self._plugin_version}')
+        if self._plugin_version == 1 and (len(self._locations) > 1 or 'all' in map(str.lower, self._locations)):
+            self._logger.warning('Only the first location can be read with v1 of the API')
 
     def __init__(self, config: AppConfig) -> None:
-        super().__init__(config, 'EvoHome', 'input')
+        super().__init__(config, 'EvoHome', PLUGIN_TYPE)
+
+    def close(self):
+        self._client = None
 
     def _get_evoclient(self):
         """
-        Returns an instance of an Evohome client which caches credentials
+        Returns the client kept from previous polls, creating it first if need be
+        """
+        if self._client is None:
+            self.api_calls['login'] += 1
+            self._client = self._call_api(self._create_evoclient)
+            self._installation_expires = time.monotonic() + self._installation_cache_seconds
+        elif self._plugin_version == 2 and time.monotonic() >= self._installation_expires:
+            self._logger.debug('Cached installation details have expired, fetching them again')
+            self.api_calls['installation'] += 1
+            self._call_api(self._client.installation)
+            self._installation_expires = time.monotonic() + self._installation_cache_seconds
+        return self._client
+
+    def _create_evoclient(self):
+        """
+        Returns a new instance of an Evohome client, using the cached credentials if there are any
         """
 
         # The Evohome client library turns off global debugging so save the value incase we need to re-enable!
         global_debug = logging.getLogger().isEnabledFor(logging.DEBUG)
-        try:
-            self._logger.debug(f'Reading token cache from {self._token_file}')
-            # Actually getting a token is rate-limited, though using it is not.
-            # So we get and store tokens we can reuse them
-            # https://github.com/watchforstock/evohome-client/issues/57
-            with io.open(self._token_file, "r", encoding='UTF-8') as f:
-                token_data = json.load(f)
-                if self._plugin_version == 2:
-                    access_token = token_data[0]
-                    refresh_token = token_data[1]
-                    access_token_expires = datetime.strptime(token_data[2], "%Y-%m-%d %H:%M:%S.%f")
-                    self._logger.debug(f'Using cached credentials expiring at {access_token_expires}')
-                else:
-                    self._logger.debug(f'Successfully loaded cached credentials')
-        except (IOError, ValueError):
-            token_data = None
-            access_token = None
-            refresh_token = None
-            access_token_expires = None
+        token_data = self._token_store.read()
+        access_token = None
+        refresh_token = None
+        access_token_expires = None
+        if token_data is None:
             self._logger.debug('No cached credentials available')
+        elif self._plugin_version == 2:
+            try:
+                access_token = token_data[0]
+                refresh_token = token_data[1]
+                access_token_expires = datetime.strptime(token_data[2], _TOKEN_EXPIRY_FORMAT)
+                self._logger.debug(f'Using cached credentials expiring at {access_token_expires}')
+            except (IndexError, TypeError, ValueError):
+                access_token = refresh_token = None
+                self._logger.debug('Cached credentials are invalid, ignoring them')
+        else:
+            self._logger.debug(f'Successfully loaded cached credentials')
 
         if self._plugin_version == 1:
+            # The v1 client logs in when it's first used, so there's no need to force it to here
             client = EvohomeClient(username=self._username,
                                    password=self._password,
                                    debug=self._config.is_debugging_enabled(self.plugin_name),
@@ -165,7 +276,8 @@ class Plugin(InputPluginBase):
             client = EvohomeMultiLocationClient(self._config, self.plugin_name, self._username, self._password,
                                                 debug=self._config.is_debugging_enabled(self.plugin_name),
                                                 refresh_token=refresh_token, access_token=access_token,
-                                                access_token_expires=access_token_expires)
+                                                access_token_expires=access_token_expires,
+                                                token_store=self._token_store)
         if global_debug:
             logging.getLogger().setLevel(logging.DEBUG)
 
@@ -173,50 +285,153 @@ class Plugin(InputPluginBase):
         if self._config.is_debugging_enabled(self.plugin_name) is True and self._http_debug is False:
             http.client.HTTPConnection.debuglevel = 0
 
-        # Force Authentication of Client if leveraging v1 api
-        if self._plugin_version == 1:
-            self._logger.debug(f'Retrieved {len(list(client.temperatures()))} Devices when performing pre-auth checks.')
+        self._client_tokens = token_data
+        self._save_tokens(client)
+        return client
 
-        # save session-id's so we don't need to re-authenticate every polling cycle.
-        with io.open(self._token_file, "w", encoding='UTF-8') as f:
-            if self._plugin_version == 1:
-                token_data = client.user_data
-            else:
-                token_data = [client.access_token, client.refresh_token, str(client.access_token_expires)]
-            json.dump(token_data, f)
+    def _save_tokens(self, client):
+        """
+        Saves the v1 client's session-id, if it's logged in again, so we don't need to re-authenticate every time we
+        start.  Session-ids someone else has saved since the client was created are newer, so they're kept.
+        The v2 client's tokens are saved by the token store as it refreshes them
+        """
+        if self._plugin_version != 1 or client.user_data is None:
+            return
+        if self._token_store.replace(self._client_tokens, client.user_data):
+            self._client_tokens = client.user_data
 
-        return client
+    @staticmethod
+    def _call_api(call, *args, **kwargs):
+        """
+        Makes a call with the client library, which doesn't use the shared HTTP transport, within the API's rate limit
+        and records how it went so polling backs off if the API is struggling
+        """
+        rate_limiter = get_transport().rate_limiter
+        rate_limiter.acquire(API_HOSTS[0])
+        try:
+            result = call(*args, **kwargs)
+        except requests.HTTPError as ex:
+            if ex.response is not None:
+                rate_limiter.record(API_HOSTS[0], ex.response.status_code)
+            raise
+        except (requests.ConnectionError, requests.Timeout):
+            rate_limiter.record(API_HOSTS[0], None)
+            raise
+        rate_limiter.record(API_HOSTS[0], 200)
+        return result
+
+    def _discard_client_if_unauthorised(self, ex: Exception):
+        """
+        Throws the client away if the exception means it can no longer authenticate, so a new one is created next time
+        """
+        unauthorised = isinstance(ex, AuthenticationError) or (
+            isinstance(ex, requests.HTTPError) and ex.response is not None and ex.response.status_code == 401)
+        if unauthorised and self._client is not None:
+            self._logger.warning('EvoHome API authentication failed - the client will be recreated on the next poll')
+            self._client = None
 
     def _get_raw_data(self, client):
         """
-        Get the same temp data that EvoClient pulls back for debugging/error diagnostics
+        Get the same temp data that EvoClient pulls back for debugging/error diagnostics.
+        This is normally what the temperatures were read from during this poll, and is only fetched from the API if
+        they couldn't be
         """
+        if self._raw_data is not None:
+            return self._raw_data
+
+        if self._plugin_version == 1 and client.full_data is not None:
+            self._raw_data = json.dumps(client.full_data)
+            return self._raw_data
+
+        self.api_calls['raw'] += 1
         if self._plugin_version == 1:
             headers = {'content-type': 'application/json', 'sessionId': client.user_data['sessionId']}
 
-            r = requests.get(
+            r = get_transport().get(
                 f'https://tccna.honeywell.com/WebAPI/api/locations?userId={client.user_data["userInfo"]["userID"]}&allData=True',
                 headers=headers)
         else:
-            location = client.get_location(self._location)
-            r = requests.get(
+            location = client.get_locations(self._locations)[0]
+            r = get_transport().get(
                 f'https://tccna.honeywell.com/WebAPI/emea/api/v1/location/{location.locationId}/status?includeTemperatureControlSystems=True',
                 headers=client._headers())
-        return r.text
+        self._raw_data = r.text
+        return self._raw_data
+
+    def _raw_data_for_log(self, client) -> str:
+        """
+        Returns the raw data to log with an error, if it's not been logged already this poll and it's been long enough
+        since it was last logged
+        """
+        if self._raw_data_dumped:
+            return 'raw_data=<as logged above>'
+        now = time.monotonic()
+        if now < self._next_raw_data_dump:
+            return f'raw_data=<not logged again for another {self._next_raw_data_dump - now:.0f}s>'
+
+        self._raw_data_dumped = True
+        self._next_raw_data_dump = now + self._raw_data_dump_interval
+        try:
+            return f'raw_data={self._get_raw_data(client)}'
+        except Exception as ex:
+            return f'raw_data=<unavailable: {ex}>'
 
-    def _is_hotwater_on(self, client) -> bool:
+    def _get_statuses(self, client, locations):
         """
-        Determines if the hot water is on or not
+        Gets the status of each location - the temperatures and setpoints of every zone and the state of the hot water -
+        in a single call per location, made at the same time when there's more than one.
+        Returns the location along with its status or, if getting it failed, the exception
         """
-        if self._plugin_version == 2:
-            location = client.get_location(self._location)
-            status = location.status()
-            if 'dhw' in status['gateways'][0]['temperatureControlSystems'][0]:
-                self._logger.debug('DHW found')
-                dhw = status['gateways'][0]['temperatureControlSystems'][0]['dhw']
-                return dhw['stateStatus']['state'] == 'On'
-            self._logger.debug('No DHW found')
-        return False
+        self.api_calls['status'] += len(locations)
+        if len(locations) == 1:
+            return [(locations[0], self._get_status(locations[0]))]
+
+        # Refresh the access token now if need be, rather than in each of the threads
+        client._headers()
+        with futures.ThreadPoolExecutor(max_workers=len(locations),
+                                        thread_name_prefix=f'{self.plugin_name}-status') as executor:
+            return list(zip(locations, executor.map(self._get_status, locations)))
+
+    def _get_status(self, location):
+        try:
+            return self._call_api(location.status)
+        except Exception as ex:
+            return ex
+
+    def _zones_from_status(self, location, status):
+        """
+        Generates the zones of every heating system in the location from its status, in the same form as the v1
+        client's temperatures() but tagged with where each zone is, or the KeyError if a zone is missing something
+        """
+        for gateway in status['gateways']:
+            for system in gateway['temperatureControlSystems']:
+                tags = {'location': location.name, 'gateway': gateway['gatewayId'], 'system': system['systemId']}
+
+                if 'dhw' in system:
+                    self._logger.debug('DHW found')
+                    try:
+                        dhw = system['dhw']
+                        yield {'thermostat': 'DOMESTIC_HOT_WATER',
+                               'id': dhw['dhwId'],
+                               'name': '',
+                               'temp': dhw['temperatureStatus']['temperature'],
+                               'setpoint': '',
+                               'mode': 'DHWOn' if dhw['stateStatus']['state'] == 'On' else 'DHWOff',
+                               'tags': tags}
+                    except KeyError as ex:
+                        yield ex
+
+                for zone in system['zones']:
+                    try:
+                        temperature = zone['temperatureStatus']
+                        yield {'thermostat': 'EMEA_ZONE',
+                               'id': zone['zoneId'],
+                               'name': zone['name'],
+                               'temp': temperature['temperature'] if temperature['isAvailable'] else None,
+                               'setpoint': zone['setpointStatus']['targetHeatTemperature'],
+                               'tags': tags}
+                    except KeyError as ex:
+                        yield ex
 
     # pylint disable=E1101
     def _read_metrics(self):
@@ -228,13 +443,18 @@ class Plugin(InputPluginBase):
             self._logger.debug("Not running as not within Cron window!")
             return [], ''
 
+        self.api_calls.clear()
+        self._raw_data = None
+        self._raw_data_dumped = False
         client = None
         temperatures = []
+        prefix_location = False  # Whether zones are prefixed with their location, to tell them apart
 
         try:
             if not self._simulation:
                 client = self._get_evoclient()
         except Exception as e:
+            self._discard_client_if_unauthorised(e)
             self._logger.exception(f'EvoHome API error - aborting read\n{e}')
             return ([], '')
 
@@ -251,11 +471,31 @@ class Plugin(InputPluginBase):
 
         try:
             if self._plugin_version == 1:
+                # The client is kept between polls, so make sure it doesn't just return what it read last time
+                self.api_calls['status'] += 1
+                # So what the client last read isn't taken for this poll's raw data
+                client.full_data = None  # pylint: disable=attribute-defined-outside-init
+                self._call_api(client._populate_full_data, force_refresh=True)
                 zones = client.temperatures()
             else:
-                heating_system = client.get_heating_system(self._location)
-                zones = heating_system.temperatures()
+                # Everything is read from the one status per location, including whether the hot water is on
+                locations = client.get_locations(self._locations)
+                prefix_location = len(locations) > 1
+                statuses = []
+                for location, status in self._get_statuses(client, locations):
+                    if isinstance(status, Exception):
+                        self._discard_client_if_unauthorised(status)
+                        self._logger.error(f'EvoHome API error getting the status of {location.name} - skipping\n'
+                                           f'{status}')
+                    else:
+                        statuses.append((location, status))
+                if not statuses:
+                    return ([], '')
+                self._raw_data = json.dumps(statuses[0][1] if len(locations) == 1 else [s for _, s in statuses])
+                zones = itertools.chain.from_iterable(self._zones_from_status(location, status)
+                                                      for location, status in statuses)
         except Exception as e:
+            self._discard_client_if_unauthorised(e)
             self._logger.exception(f'EvoHome API error getting temperatures - aborting\n{e}')
             return ([], '')
 
@@ -264,30 +504,32 @@ class Plugin(InputPluginBase):
                 zone = next(zones)
                 if self._plugin_version == 2:
                     if isinstance(zone, KeyError):
-                        if heating_system.hotwater is not None:
-                            self._logger.exception(
-                                f'EvoHome API key error getting temperatures - could be hot water- status: {heating_system.hotwater.temperatureStatus} - skipping\n{zone}\nraw_data={self._get_raw_data(client)}')
-                        else:
-                            self._logger.exception(
-                                f'EvoHome API key error getting temperatures - skipping\n{zone}\nraw_data={self._get_raw_data(client)}')
+                        self._logger.error(
+                            f'EvoHome API key error getting temperatures - skipping\n{zone}\n{self._raw_data_for_log(client)}')
                     else:
                         if isinstance(zone, Exception):
-                            self._logger.exception(
-                                f'EvoHome API error getting temperatures - skipping\n{zone}\nraw_data={self._get_raw_data(client)}')
+                            self._logger.error(
+                                f'EvoHome API error getting temperatures - skipping\n{zone}\n{self._raw_data_for_log(client)}')
             except StopIteration:
                 break
             except Exception as ex:
+                self._discard_client_if_unauthorised(ex)
                 self._logger.exception(
-                    f'EvoHome API error getting temperatures - skipping\n{ex}\nraw_data={self._get_raw_data(client)}')
+                    f'EvoHome API error getting temperatures - skipping\n{ex}\n{self._raw_data_for_log(client)}')
             else:
+                if isinstance(zone, Exception):
+                    continue  # Logged above
+
                 # normalise response for DHW to be consistent with normal zones
                 if zone['thermostat'] == 'DOMESTIC_HOT_WATER':
                     zone['name'] = self._hotwater
-                    if self._is_hotwater_on(client) or zone['mode'] == 'DHWOn':
+                    if zone['mode'] == 'DHWOn':
                         if self._hotwater_setpoint is not None:
                             zone['setpoint'] = self._hotwater_setpoint
                     else:
                         zone['setpoint'] = 0.0
+                if prefix_location:
+                    zone['name'] = f'{zone["tags"]["location"]} - {zone["name"]}'
 
                 text_temperatures += f'{zone["name"]} ({zone["temp"]} A'
 
@@ -311,15 +553,22 @@ class Plugin(InputPluginBase):
                     temp = Metric(plugin=self.plugin_name,
                                   descriptor=zone['name'],
                                   actual=temp_or_default(zone['temp']),
-                                  target=temp_or_default(zone['setpoint'])
+                                  target=temp_or_default(zone['setpoint']),
+                                  tags=zone.get('tags')
                                   )
                     text_temperatures += f', {zone["setpoint"]} T'
                 else:
-                    temp = Metric(plugin == self.plugin_name,
+                    temp = Metric(plugin=self.plugin_name,
                                   descriptor=zone['name'],
-                                  actual=temp_or_default(zone['temp']))
+                                  actual=temp_or_default(zone['temp']),
+                                  tags=zone.get('tags'))
                 text_temperatures += ') '
                 temperatures.append(temp)
 
+        # The v1 client logs in again when its session expires
+        if self._client is not None:
+            self._save_tokens(self._client)
+
+        self._logger.debug(f'API calls: {dict(self.api_calls)}')
         self._logger.debug(text_temperatures)
         return (temperatures, text_temperatures)
@@ -1,61 +1,25 @@
 """
 InfluxDB v1.x input plugin
 """
+# pylint: disable=too-many-instance-attributes
 
 import urllib.parse
 
 from influxdb import InfluxDBClient
 
 from AppConfig import AppConfig
+from plugins.LineProtocol import LineProtocolEncoder
 from plugins.PluginBase import OutputPluginBase
 
-
-def _get_measurements(time, plugin, descriptor, actual, target, text, timestamp, logger):
-    """
-    Returns the actual, target, delta and text data points
-    """
-
-    record_actual = None
-    record_target = None
-    record_delta = None
-    record_text = None
-
-    def create_point(name: str, value: float):
-        try:
-            return {
-                "measurement": name,
-                "tags": {
-                    "plugin": plugin,
-                    "descriptor": descriptor
-                },
-                "time": time if timestamp is None else timestamp,
-                "fields": {
-                    "value": value
-                }
-            }
-        except Exception as e:
-            logger.exception(
-                f'Error creating data point for {name}, plugin: {plugin}, descriptor: {descriptor}, value: {value}:\n{e}')
-            return {}
-
-    if actual is not None and actual != '':
-        record_actual = create_point("actual", float(actual))
-
-    if target is not None and target != '':
-        record_target = create_point("target", float(target))
-
-    if record_actual is not None and record_target is not None:
-        record_delta = create_point("delta", float(actual) - float(target))
-
-    if text is not None and text != '':
-        record_text = create_point("text", str(text))
-
-    return record_actual, record_target, record_delta, record_text
+PLUGIN_TYPE = 'output'
+_TIME_PRECISIONS = ('h', 'm', 's', 'ms', 'u', 'n')
 
 
 class Plugin(OutputPluginBase):
     """InfluxDB v1.x output Plugin immplementation"""
 
+    _accepts_merged_batches = True
+
     def _read_configuration(self, config: AppConfig):
         section = config[self.plugin_name]
         self._hostname = section["hostname"]
@@ -63,49 +27,63 @@ class Plugin(OutputPluginBase):
         self._database = section["database"]
         self._username = section["username"]
         self._password = section["password"]
+        self._batch_size = config.get_int_or_default(self.plugin_name, 'batchSize', 5000)
+        self._gzip = config.get_boolean_or_default(self.plugin_name, 'gzip', False)
+        self._time_precision = config.get_string_or_default(self.plugin_name, 'timePrecision', 's')
+        if self._time_precision not in _TIME_PRECISIONS:
+            raise ValueError(f'timePrecision must be one of {", ".join(_TIME_PRECISIONS)}')
+        self._retention_policy = config.get_string_or_default(self.plugin_name, 'retentionPolicy', None)
+        self._encoder = LineProtocolEncoder(self._time_precision, tags=('plugin', 'descriptor'))
+        self._client = None
         self._logger.debug(f'Influx Host: {self._hostname}:{self._port} Database: {self._database}')
 
     def __init__(self, config: AppConfig) -> None:
-        super().__init__(config, 'InfluxDB', 'output')
+        super().__init__(config, 'InfluxDB', PLUGIN_TYPE)
+
+    def open(self):
+        """
+        Creates the client, and so its connection pool, which is kept for the lifetime of the plugin
+        """
+        self._get_client()
+
+    def close(self):
+        super().close()
+        if self._client is not None:
+            self._client.close()
+            self._client = None
+
+    def _get_client(self) -> InfluxDBClient:
+        if self._client is None:
+            self._client = InfluxDBClient(self._hostname, self._port, self._username, self._password, self._database,
+                                          gzip=self._gzip)
+        return self._client
 
     def _write_metrics(self, timestamp, metrics):
         """
         Writes the metrics to the database
         """
 
-        influx_client = InfluxDBClient(self._hostname, self._port, self._username, self._password, self._database)
-
-        data = []
-        for metric in metrics:
-
-            record_actual, record_target, record_delta, record_text = _get_measurements(timestamp,
-                                                                                        metric.plugin,
-                                                                                        metric.descriptor,
-                                                                                        metric.actual,
-                                                                                        metric.target,
-                                                                                        metric.text,
-                                                                                        metric.timestamp,
-                                                                                        self._logger)
-
-            if record_actual:
-                data.append(record_actual)
-            if record_target:
-                data.append(record_target)
-            if record_delta:
-                data.append(record_delta)
-            if record_text:
-                data.append(record_text)
+        influx_client = self._get_client()
+        lines = self._encoder.encode_lines(timestamp, metrics)
 
         try:
             if self._simulation is False:
                 self._logger.debug('Writing all measurements to influx...')
-                influx_client.write_points(data)
+                params = {'db': self._database, 'precision': self._time_precision}
+                if self._retention_policy is not None:
+                    params['rp'] = self._retention_policy
+                batch_size = self._batch_size if self._batch_size > 0 else len(lines)
+                for start in range(0, len(lines), batch_size):
+                    influx_client.write(lines[start:start + batch_size], params=params, protocol='line')
             else:
-                self._logger.debug(f'Metrics to be written: {data}')
+                self._logger.debug('Metrics to be written: %s', '\n'.join(lines))
         except Exception as e:
             if hasattr(e, 'request'):
-                self._logger.exception(
+                self._logger.error(
                     f'Error Writing to {self._database} at {self._hostname}:{self._port} - aborting write.\nRequest: {e.request.method} {urllib.parse.unquote(e.request.url)}\nBody: {e.request.body}.\nResponse: {e.response}\nError:{e}')
             else:
-                self._logger.exception(
+                self._logger.error(
                     f'Error Writing to {self._database} at {self._hostname}:{self._port} - aborting write\nError:{e}')
+            raise
+
+        return len(lines)
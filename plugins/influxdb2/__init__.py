@@ -1,50 +1,27 @@
 """
 InfluxDB v2.x input plugin
 """
+# pylint: disable=too-many-instance-attributes
 
-from influxdb_client import InfluxDBClient, Point
-from influxdb_client.client.write_api import SYNCHRONOUS
+import threading
+
+from influxdb_client import InfluxDBClient
+from influxdb_client.client.write_api import SYNCHRONOUS, WriteOptions, WriteType
 
 from AppConfig import AppConfig
+from plugins.LineProtocol import LineProtocolEncoder
 from plugins.PluginBase import OutputPluginBase
 
-
-def _get_measurements(time, plugin, descriptor, actual, target, text, logger):
-    """
-    Returns the actual, target, delta and text data points
-    """
-
-    record_actual = None
-    record_target = None
-    record_delta = None
-    record_text = None
-
-    def create_point(name: str, value: float):
-        try:
-            return Point(name).time(time).tag("descriptor", descriptor).field("value", value)
-        except Exception as e:
-            logger.exception(
-                f'Error creating data point for {name}, plugin: {plugin}, descriptor: {descriptor}, value: {value}:\n{e}')
-            return Point(name)
-
-    if actual is not None and actual != '':
-        record_actual = create_point("actual", float(actual))
-
-    if target is not None and target != '':
-        record_target = create_point("target", float(target))
-
-    if record_actual is not None and record_target is not None:
-        record_delta = create_point("delta", float(actual) - float(target))
-
-    if text is not None and text != '':
-        record_text = create_point("text", str(text))
-
-    return record_actual, record_target, record_delta, record_text
+PLUGIN_TYPE = 'output'
+_WRITE_PRECISIONS = ('s', 'ms', 'us', 'ns')
+_WRITE_MODES = ('synchronous', 'batching')
 
 
 class Plugin(OutputPluginBase):
     """InfluxDB v2.x output Plugin immplementation"""
 
+    _accepts_merged_batches = True
+
     def _read_configuration(self, config: AppConfig):
         section = config[self.plugin_name]
         self._hostname = section["hostname"]
@@ -52,49 +29,116 @@ class Plugin(OutputPluginBase):
         self._org = section["org"]
         self._bucket = section["bucket"]
         self._apikey = section["apikey"]
+        self._gzip = config.get_boolean_or_default(self.plugin_name, 'gzip', False)
+        self._write_precision = config.get_string_or_default(self.plugin_name, 'writePrecision', 's')
+        if self._write_precision not in _WRITE_PRECISIONS:
+            raise ValueError(f'writePrecision must be one of {", ".join(_WRITE_PRECISIONS)}')
+        self._write_mode = config.get_string_or_default(self.plugin_name, 'writeMode', 'synchronous').lower()
+        if self._write_mode not in _WRITE_MODES:
+            raise ValueError(f'writeMode must be one of {", ".join(_WRITE_MODES)}')
+        self._write_options = SYNCHRONOUS if self._write_mode == 'synchronous' else WriteOptions(
+            write_type=WriteType.batching,
+            batch_size=config.get_int_or_default(self.plugin_name, 'batchSize', 1000),
+            flush_interval=config.get_int_or_default(self.plugin_name, 'batchFlushIntervalMs', 1000),
+            jitter_interval=config.get_int_or_default(self.plugin_name, 'batchJitterIntervalMs', 0),
+            retry_interval=config.get_int_or_default(self.plugin_name, 'retryIntervalMs', 5000),
+            max_retries=config.get_int_or_default(self.plugin_name, 'maxRetries', 5),
+            max_retry_delay=config.get_int_or_default(self.plugin_name, 'maxRetryDelayMs', 30000),
+            max_retry_time=config.get_int_or_default(self.plugin_name, 'maxRetryTimeMs', 60000))
+        self._encoder = LineProtocolEncoder(self._write_precision, tags=('descriptor',))
+        self._client = None
+        self._write_api = None
+
+        # Counters fed by the batching write api's callbacks
+        self._counter_lock = threading.Lock()
+        self.points_written = 0
+        self.points_failed = 0
+        self.retries = 0
         self._logger.debug(f'Influx Host: {self._hostname}:{self._port} Org: {self._org}, Bucket:{self._bucket}')
 
     def __init__(self, config: AppConfig) -> None:
-        super().__init__(config, 'InfluxDB2', 'output')
+        super().__init__(config, 'InfluxDB2', PLUGIN_TYPE)
 
-    def _write_metrics(self, timestamp, metrics):
+    def open(self):
         """
-        Writes the metrics to the org bucket
+        Creates the client and write api, which are kept for the lifetime of the plugin
         """
+        self._get_write_api()
 
-        influx_client = InfluxDBClient(url=f'{self._hostname}:{self._port}', token=self._apikey, org=self._org)
-        write_api = influx_client.write_api(write_options=SYNCHRONOUS)
-
-        data = []
-        for metric in metrics:
+    def close(self):
+        """
+        Drains anything still queued by the batching write api before closing the client
+        """
+        super().close()
+        if self._write_api is not None:
+            self._logger.debug('Flushing any queued points to influx...')
+            self._write_api.close()
+            self._write_api = None
+        if self._client is not None:
+            self._client.close()
+            self._client = None
+        if self._write_mode == 'batching':
+            self._logger.info(f'Points written: {self.points_written}, failed: {self.points_failed}, '
+                              f'retries: {self.retries}')
+
+    def _get_write_api(self):
+        if self._write_api is None:
+            self._client = InfluxDBClient(url=f'{self._hostname}:{self._port}', token=self._apikey, org=self._org,
+                                          enable_gzip=self._gzip)
+            self._write_api = self._client.write_api(write_options=self._write_options,
+                                                     success_callback=self._on_success,
+                                                     error_callback=self._on_error,
+                                                     retry_callback=self._on_retry)
+        return self._write_api
+
+    @staticmethod
+    def _count_points(data) -> int:
+        if isinstance(data, bytes):
+            return data.count(b'\n') + 1
+        return data.count('\n') + 1
+
+    def _on_success(self, _, data):
+        with self._counter_lock:
+            self.points_written += self._count_points(data)
+
+    def _on_error(self, _, data, exception):
+        points = self._count_points(data)
+        with self._counter_lock:
+            self.points_failed += points
+        self._logger.error(f'Error Writing {points} points to {self._bucket} at {self._hostname}:{self._port} - '
+                           f'batch dropped\nError:{exception}')
+
+    def _on_retry(self, _, data, exception):
+        with self._counter_lock:
+            self.retries += 1
+        self._logger.warning(f'Retrying write of {self._count_points(data)} points to {self._bucket}\nError:{exception}')
 
-            record_actual, record_target, record_delta, record_text = _get_measurements(timestamp, metric.plugin,
-                                                                                        metric.descriptor,
-                                                                                        metric.actual, metric.target,
-                                                                                        metric.text,
-                                                                                        self._logger)
+    def _write_metrics(self, timestamp, metrics):
+        """
+        Writes the metrics to the org bucket.
+        In batching mode the points are queued and written in the background, so errors are reported by the callbacks
+        """
 
-            if record_actual:
-                data.append(record_actual)
-            if record_target:
-                data.append(record_target)
-            if record_delta:
-                data.append(record_delta)
-            if record_text:
-                data.append(record_text)
+        write_api = self._get_write_api()
+        lines = self._encoder.encode_lines(timestamp, metrics)
 
         try:
             if self._simulation is False:
                 self._logger.debug('Writing all measurements to influx...')
-                write_api.write(bucket=self._bucket, record=data)
+                # The batching api splits a list into one item per point, so batchSize is honoured
+                record = lines if self._write_mode == 'batching' else '\n'.join(lines).encode('utf-8')
+                write_api.write(bucket=self._bucket, record=record, write_precision=self._write_precision)
         except Exception as e:
             if hasattr(e, 'response'):
                 if e.response.status == 401:
-                    self._logger.exception(
+                    self._logger.error(
                         f'Insufficient write permissions to Bucket: "{self._bucket}" - aborting write\nError:{e}')
                 else:
-                    self._logger.exception(
+                    self._logger.error(
                         f'Error Writing to {self._bucket} at {self._hostname}:{self._port} - aborting write.\nResponse: {e.body.json()}\nError:{e}')
             else:
-                self._logger.exception(
+                self._logger.error(
                     f'Error Writing to {self._bucket} at {self._hostname}:{self._port} - aborting write\nError:{e}')
+            raise
+
+        return len(lines)
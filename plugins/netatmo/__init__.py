@@ -1,36 +1,53 @@
 """
-Netatmo input plugin - for getting the outside temperature
+Netatmo input plugin - for getting the outside temperature, and everything else your weather stations measure
 """
 # pylint: disable=protected-access,too-few-public-methods,too-many-instance-attributes
 
-import io
+import json
+import os
 import random
 import ssl
+import threading
+import time
+from concurrent import futures
 from datetime import timedelta
-from json import dump, load
 from tempfile import gettempdir
+from typing import Callable
 from urllib import parse
 
 import requests
 
 from AppConfig import AppConfig
+from HttpTransport import get_transport
 from Metric import *
+from TokenStore import get_token_store
 from plugins.PluginBase import InputPluginBase, _get_plugin_logger
 
 ssl._create_default_https_context = ssl._create_unverified_context
+PLUGIN_TYPE = 'input'
+API_HOSTS = ('api.netatmo.com',)
 _STATION_TYPE = 'NAMain'  # Indoor station type
 _OUTDOOR_MODULE_TYPE = 'NAModule1'  # Outdoor module type
+# Dashboard fields whose history getmeasure returns
+_MEASURE_TYPES = ('Temperature', 'CO2', 'Humidity', 'Pressure', 'Noise', 'Rain', 'WindStrength', 'WindAngle',
+                  'GustStrength', 'GustAngle')
+_MAX_MEASURE_POINTS = 1024  # The most measurements getmeasure returns per request
+_MEASURE_INTERVAL_SECONDS = 300  # Roughly how often the stations and modules measure
 
+DEFAULT_BACKFILL_MAX_DAYS = 7
+DEFAULT_BACKFILL_MIN_GAP_MINUTES = 30
+DEFAULT_BACKFILL_CONCURRENCY = 2
 
-def _post_request(url: str, request_params, logger):
+
+def _post_request(url: str, request_params, logger, retry: bool = False):
     full_url = f'https://api.netatmo.com/{url}'
     params = parse.urlencode(request_params).encode('utf-8')
     logger.debug(full_url)
     try:
-        with requests.post(full_url, headers={
+        with get_transport().post(full_url, headers={
             'Content-Type': 'application/x-www-form-urlencoded;charset=utf-8'
         },
-                           data=params, timeout=30) as response:
+                                  data=params, retry=retry) as response:
             response.raise_for_status()
             return response.json()
     except requests.HTTPError as err:
@@ -52,83 +69,127 @@ class ModuleNotFound(Exception):
     """
 
 
+class BackfillFailed(Exception):
+    """
+    Exception thrown when a module's history can't be fetched, or the outputs fail to write it
+    """
+
+
 class Authenticate:
     """
     Manages Netatmo authentication tokens
     """
 
+    _TIME_FORMAT = "%Y-%m-%d %H:%M:%S.%f"
+
     # pylint: disable=too-many-arguments
     def __init__(self, config: AppConfig, plugin_name, client_id: str, client_secret: str, username: str,
                  password: str) -> None:
         self._logger = _get_plugin_logger(config, f'{plugin_name}:{self.__class__.__name__}')
-        self._token_file = f'{gettempdir()}/{plugin_name}.access_tokens.json'
+        # Saved so we don't need to re-authenticate every time we start, and shared with anything else using them
+        self._token_store = get_token_store(f'{gettempdir()}/{plugin_name}.access_tokens.json', self._logger)
         self._client_id = client_id
         self._client_secret = client_secret
         self._username = username
         self._password = password
 
+    def _expires(self, token_data) -> datetime:
         try:
-            # Fetch previously saved tokens we can reuse them
-            with io.open(self._token_file, 'r', encoding='UTF-8') as f:
-                token_data = load(f)
-                self._access_token = token_data[0]
-                self._refresh_token = token_data[1]
-                self._access_token_expires = datetime.strptime(token_data[2], "%Y-%m-%d %H:%M:%S.%f")
-            self._logger.debug(f'Using cached credentials expiring at {self._access_token_expires}')
-        except (IOError, ValueError):
-            self._access_token = None
-            self._refresh_token = None
-            self._access_token_expires = datetime.utcnow() - timedelta(hours=1)
-            self._logger.debug('No cached credentials available')
+            return datetime.strptime(token_data[2], self._TIME_FORMAT)
+        except (IndexError, TypeError, ValueError):
+            return datetime.utcnow() - timedelta(hours=1)
 
     def access_token(self) -> str:
         """
         Returns an access token for the Netatmo API
         """
-        if self._access_token_expires < datetime.utcnow():
-            if self._refresh_token is None:
-                self._logger.debug('No stored refresh token => Get new tokens using credentials')
-                get_token_request = {
-                    "grant_type": "password",
-                    "client_id": self._client_id,
-                    "client_secret": self._client_secret,
-                    "username": self._username,
-                    "password": self._password,
-                    "scope": 'read_station'
-                }
-            else:
-                self._logger.debug('Store refresh token found => Use this to get new tokens')
-                get_token_request = {
-                    "grant_type": "refresh_token",
-                    "refresh_token": self._refresh_token,
-                    "client_id": self._client_id,
-                    "client_secret": self._client_secret
-                }
-            resp = _post_request('oauth2/token', get_token_request, self._logger)
-            if resp is not None:
-                self._access_token = resp['access_token']
-                self._refresh_token = resp['refresh_token']
-                self._access_token_expires = datetime.utcnow() + timedelta(seconds=int(resp['expire_in']))
-
-                # save session-id's so we don't need to re-authenticate every polling cycle.
-                with io.open(self._token_file, "w", encoding='UTF-8') as f:
-                    token_data = [self._access_token, self._refresh_token, str(self._access_token_expires)]
-                    dump(token_data, f)
-
-                return self._access_token
-
-            # If we didn't get a valid response and we used a refresh token then we will try again gettng q brand new token
-            if self._refresh_token is not None:
-                self._refresh_token = None
-                return self.access_token()
-            return None
-
-        self._logger.debug('Existing valid token found => use this')
-        return self._access_token
+        token_data = self._token_store.read()
+        if token_data is not None and self._expires(token_data) >= datetime.utcnow():
+            self._logger.debug('Existing valid token found => use this')
+            return token_data[0]
+
+        token_data = self._token_store.refresh(token_data, self._get_tokens)
+        return None if token_data is None else token_data[0]
+
+    def _get_tokens(self, token_data):
+        """
+        Gets new tokens, using the refresh token if there is one and the credentials if not (or if it's rejected)
+        """
+        if token_data is not None and self._expires(token_data) >= datetime.utcnow():
+            return token_data  # Already refreshed, by another process
+
+        refresh_token = token_data[1] if token_data is not None and len(token_data) > 1 else None
+        if refresh_token is not None:
+            self._logger.debug('Store refresh token found => Use this to get new tokens')
+            resp = _post_request('oauth2/token', {
+                "grant_type": "refresh_token",
+                "refresh_token": refresh_token,
+                "client_id": self._client_id,
+                "client_secret": self._client_secret
+            }, self._logger)
+        else:
+            resp = None
+
+        # If we didn't get a valid response and we used a refresh token then we will try again gettng q brand new token
+        if resp is None:
+            self._logger.debug('No stored refresh token => Get new tokens using credentials')
+            resp = _post_request('oauth2/token', {
+                "grant_type": "password",
+                "client_id": self._client_id,
+                "client_secret": self._client_secret,
+                "username": self._username,
+                "password": self._password,
+                "scope": 'read_station'
+            }, self._logger)
+            if resp is None:
+                return None
+
+        access_token_expires = datetime.utcnow() + timedelta(seconds=int(resp['expire_in']))
+        return [resp['access_token'], resp['refresh_token'], access_token_expires.strftime(self._TIME_FORMAT)]
+
+
+class _Module:
+    """
+    A station or module, and what's needed to turn its dashboard data into metrics
+    """
+
+    __slots__ = ('station_id', 'module_id', 'station_name', 'module_name', 'descriptor_prefix', 'tags', 'fields')
+
+    # pylint: disable=too-many-arguments,too-many-positional-arguments
+    def __init__(self, station_id: str, module_id: str, station_name: str, module_name: str, descriptor_prefix: str,
+                 tags: dict, fields) -> None:
+        self.station_id = station_id
+        self.module_id = module_id  # The same as the station_id for the station itself
+        self.station_name = station_name
+        self.module_name = module_name
+        self.descriptor_prefix = descriptor_prefix
+        self.tags = tags
+        self.fields = fields  # The dashboard fields to read, or None for all of them
+
+
+def _allowed(allow_list, name: str) -> bool:
+    return allow_list is None or (name or '').lower() in allow_list
+
+
+def _allow_list(config: AppConfig, plugin_name: str, option: str):
+    """
+    Reads a comma separated allow-list of names, in lower case, or None if everything is allowed
+    """
+    names = {name.strip().lower()
+             for name in config.get_string_or_default(plugin_name, option, '').split(',') if name.strip() != ''}
+    return names or None
+
+
+def _describe(metrics) -> str:
+    return ' '.join(f'{m.descriptor} ({m.actual if m.text is None else m.text})' for m in metrics)
 
 
 class Plugin(InputPluginBase):
-    """Netatmo outdoor module input Plugin immplementation"""
+    """
+    Netatmo weather station input Plugin immplementation.
+    Every station, module and dashboard field - or those in the allow-lists - is read from the one getstationsdata
+    call, along with the outside temperature from the outdoor module
+    """
 
     def _read_configuration(self, config: AppConfig):
         self._config = config
@@ -150,6 +211,11 @@ class Plugin(InputPluginBase):
 
         self._zone = config.get_string_or_default(self.plugin_name, 'Outside', 'Outside')
 
+        # Optional allow-lists of the stations, modules and dashboard fields to read, everything if not specified
+        self._stations = _allow_list(config, self.plugin_name, 'stations')
+        self._modules = _allow_list(config, self.plugin_name, 'modules')
+        self._fields = _allow_list(config, self.plugin_name, 'fields')
+
         if self._station_name is None:
             self._logger.debug("No station name supplied => use the first station of type: '%s' found", _STATION_TYPE)
         else:
@@ -164,8 +230,44 @@ class Plugin(InputPluginBase):
 
         self._logger.debug("Outside Zone: %s", self._zone)
 
+        # Module id => _Module, or None if it's not in the allow-lists, built from the first response and then only
+        # again when a module appears which isn't in it
+        self._index = None
+        self._outdoor_module_id = None
+
+        # The history of each module is backfilled from getmeasure when there's a gap since the last point written
+        self._backfill = config.get_boolean_or_default(self.plugin_name, 'backfill', False)
+        self._backfill_max_seconds = config.get_float_or_default(self.plugin_name, 'backfillMaxDays',
+                                                                 DEFAULT_BACKFILL_MAX_DAYS) * 86400
+        self._backfill_min_gap = config.get_float_or_default(self.plugin_name, 'backfillMinGapMinutes',
+                                                             DEFAULT_BACKFILL_MIN_GAP_MINUTES) * 60
+        self._backfill_concurrency = max(config.get_int_or_default(self.plugin_name, 'backfillConcurrency',
+                                                                   DEFAULT_BACKFILL_CONCURRENCY), 1)
+        self._backfill_chunk_points = min(config.get_int_or_default(self.plugin_name, 'backfillChunkPoints',
+                                                                    _MAX_MEASURE_POINTS), _MAX_MEASURE_POINTS)
+        self._last_points_file = config.get_string_or_default(self.plugin_name, 'backfillStateFile', '') or \
+            f'{gettempdir()}/{self.plugin_name}.last_points.json'
+        self._last_points = None  # Module id => time (epoch seconds) of the last point written, once it's been read
+        self._read_points = {}  # Module id => time of the latest data read, which becomes its last point once written
+        self._backfilling = set()  # Ids of the modules whose history is being backfilled
+        self._backfill_lock = threading.Lock()
+        self._backfill_executor = None
+        self._stopping = threading.Event()  # Set when the plugin is closed, so a running backfill stops
+        if self._backfill:
+            self._logger.debug(f'Backfilling gaps of over {self._backfill_min_gap:g}s, recorded in '
+                               f'{self._last_points_file}')
+
+        self._authenticate = Authenticate(config, self.plugin_name, self._client_id, self._client_secret,
+                                          self._username, self._password)
+
     def __init__(self, config: AppConfig) -> None:
-        super().__init__(config, 'Netatmo', 'input')
+        super().__init__(config, 'Netatmo', PLUGIN_TYPE)
+
+    def close(self):
+        self._stopping.set()
+        if self._backfill_executor is not None:
+            self._backfill_executor.shutdown(wait=False, cancel_futures=True)
+            self._backfill_executor = None
 
     def _find_station(self, stations):
         if self._station_name is None:
@@ -191,48 +293,274 @@ class Plugin(InputPluginBase):
             find_by = f'name: {self._module_name}'
 
         if module is None:
-            module_names_and_types = {', '.join({f"{m['module_name']} ({m['type']})": m for m in modules})}
+            module_names_and_types = ', '.join(f"{m['module_name']} ({m['type']})" for m in modules)
             raise ModuleNotFound(f"Module not found by {find_by} - module list: [{module_names_and_types}]")
 
         return module
 
+    @staticmethod
+    def _modules_of(devices):
+        """
+        Generates each station and its modules, along with the station
+        """
+        for station in devices:
+            yield station, station
+            for module in station.get('modules', []):
+                yield station, module
+
+    def _build_index(self, devices):
+        """
+        Indexes the stations and modules by their id, working out which are to be read and what their metrics are
+        called, and finds the outdoor module the outside temperature is read from
+        """
+        stations = [station for station in devices if _allowed(self._stations, station.get('station_name'))]
+        prefix_station = len(stations) > 1  # Whether metrics are prefixed with their station, to tell them apart
+
+        self._index = {}
+        for station, module in self._modules_of(devices):
+            station_name = station.get('station_name')
+            module_name = module.get('module_name') or station_name
+            if _allowed(self._stations, station_name) and _allowed(self._modules, module_name):
+                self._index[module['_id']] = _Module(
+                    station['_id'], module['_id'], station_name, module_name,
+                    f'{station_name} - {module_name}' if prefix_station else module_name,
+                    {'station': station_name, 'module': module_name, 'type': module.get('type')}, self._fields)
+            else:
+                self._index[module['_id']] = None
+        self._logger.debug(f'Reading {sum(m is not None for m in self._index.values())} of {len(self._index)} '
+                           f'stations/modules')
+
+        try:
+            self._outdoor_module_id = self._find_module(self._find_station(devices)['modules'])['_id']
+        except ModuleNotFound as mex:
+            self._outdoor_module_id = None
+            self._logger.error('%s', mex)
+
+    def _metrics_from_devices(self, devices):
+        """
+        Turns the stations and modules in a getstationsdata response into metrics - the outside temperature and then
+        every dashboard field of the stations and modules being read
+        """
+        if self._index is None or any(module['_id'] not in self._index for _, module in self._modules_of(devices)):
+            self._build_index(devices)
+
+        metrics = []
+        for _, module in self._modules_of(devices):
+            dashboard = module.get('dashboard_data')
+            if dashboard is None:
+                self._logger.debug(f'No data from {module.get("module_name")} (reachable: {module.get("reachable")})')
+                continue
+
+            if module['_id'] == self._outdoor_module_id and 'Temperature' in dashboard:
+                metrics.append(Metric(self.plugin_name, self._zone, round(dashboard['Temperature'], 1)))
+
+            indexed = self._index[module['_id']]
+            if indexed is None:
+                continue
+            for field, value in dashboard.items():
+                if indexed.fields is None:
+                    if field == 'time_utc' or field.startswith('date_'):
+                        continue  # When the data was measured, rather than a measurement
+                elif field.lower() not in indexed.fields:
+                    continue
+                descriptor = f'{indexed.descriptor_prefix} {field}'
+                if isinstance(value, str):
+                    metrics.append(Metric(self.plugin_name, descriptor, text=value, tags=indexed.tags))
+                else:
+                    metrics.append(Metric(self.plugin_name, descriptor, value, tags=indexed.tags))
+        return metrics
+
+    def _read_last_points(self) -> dict:
+        try:
+            with open(self._last_points_file, 'r', encoding='UTF-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except (IOError, ValueError) as ex:
+            self._logger.warning(f'Unable to read the last points from {self._last_points_file}: {ex}')
+            return {}
+
+    def _save_last_points(self):
+        """
+        Writes the last points to a temporary file which then replaces the file, so it's never seen half written
+        """
+        temp_file = f'{self._last_points_file}.{os.getpid()}.tmp'
+        with open(temp_file, 'w', encoding='UTF-8') as f:
+            json.dump(self._last_points, f)
+        os.replace(temp_file, self._last_points_file)
+
+    def _find_gaps(self, devices):
+        """
+        Compares the time of each module's latest data with that of the last point written for it, returning the gaps,
+        (module, measure types, begin, end), to be backfilled.  The latest data of the other modules becomes their last
+        point once it's been written, in published()
+        """
+        gaps = []
+        with self._backfill_lock:
+            if self._last_points is None:
+                self._last_points = self._read_last_points()
+            self._read_points = {}
+
+            for _, module in self._modules_of(devices):
+                indexed = self._index[module['_id']]
+                dashboard = module.get('dashboard_data') or {}
+                latest = dashboard.get('time_utc')
+                if indexed is None or latest is None or module['_id'] in self._backfilling:
+                    continue
+
+                last = self._last_points.get(module['_id'])
+                types = [t for t in _MEASURE_TYPES
+                         if t in dashboard and (indexed.fields is None or t.lower() in indexed.fields)]
+                if last is not None and types and latest - last > self._backfill_min_gap:
+                    gaps.append((indexed, types, int(max(last, latest - self._backfill_max_seconds)) + 1, latest - 1))
+                    self._backfilling.add(module['_id'])
+                else:
+                    self._read_points[module['_id']] = latest
+        return gaps
+
+    def published(self):
+        """
+        The latest data read has been written, so it's the last point of each module which isn't being backfilled
+        """
+        with self._backfill_lock:
+            if not self._read_points:
+                return
+            for module_id, latest in self._read_points.items():
+                if module_id not in self._backfilling:
+                    self._last_points[module_id] = max(self._last_points.get(module_id, 0), latest)
+            self._read_points = {}
+            self._save_last_points()
+
+    def _start_backfill(self, gaps):
+        """
+        Backfills the gaps in the background, so the poll isn't held up
+        """
+        for indexed, _, begin, end in gaps:
+            self._logger.info(f'Backfilling the history of {indexed.descriptor_prefix} from '
+                              f'{datetime.utcfromtimestamp(begin)} to {datetime.utcfromtimestamp(end)}')
+        if self._backfill_executor is None:
+            self._backfill_executor = futures.ThreadPoolExecutor(max_workers=1,
+                                                                 thread_name_prefix=f'{self.plugin_name}-backfill')
+        self._backfill_executor.submit(self._backfill_gaps, gaps, self.publisher)
+
+    def _backfill_gaps(self, gaps, publish: Callable[[list], bool]):
+        """
+        Fetches the history of each gap, in chunks of as many measurements as getmeasure returns at once, several at a
+        time within the API's rate limit, publishing each chunk with publish() as it's fetched.
+        The chunks are fetched and published in order, so only a few are held in memory and each module's last point
+        only moves on once everything before it has been written.  If a chunk can't be fetched or written, or the plugin
+        is closed, the rest of its gap is left for the next poll to carry on with
+        """
+        span = self._backfill_chunk_points * _MEASURE_INTERVAL_SECONDS
+        chunks = [(indexed, types, chunk_begin, min(chunk_begin + span - 1, end))
+                  for indexed, types, begin, end in gaps
+                  for chunk_begin in range(begin, end + 1, span)]
+        published = 0
+        try:
+            with futures.ThreadPoolExecutor(max_workers=self._backfill_concurrency,
+                                            thread_name_prefix=f'{self.plugin_name}-getmeasure') as executor:
+                for i in range(0, len(chunks), self._backfill_concurrency):
+                    if self._stopping.is_set():
+                        self._logger.info(f'Stopping the backfill after {published} points - carrying on from there '
+                                          f'next time')
+                        return
+                    window = chunks[i:i + self._backfill_concurrency]
+                    for (indexed, _, _, end), metrics in zip(window, executor.map(self._fetch_history, window)):
+                        if metrics:
+                            if not publish(metrics):
+                                raise BackfillFailed(
+                                    f'Not every output wrote the history of {indexed.descriptor_prefix}')
+                            published += len(metrics)
+                        with self._backfill_lock:
+                            self._last_points[indexed.module_id] = max(self._last_points.get(indexed.module_id, 0), end)
+                            self._save_last_points()
+            self._logger.info(f'Backfilled {published} points in {len(chunks)} chunks')
+        except Exception as ex:
+            self._logger.exception(f'Error backfilling, after {published} points - carrying on from there next time\n'
+                                   f'{ex}')
+        finally:
+            with self._backfill_lock:
+                self._backfilling.difference_update(indexed.module_id for indexed, _, _, _ in gaps)
+
+    def _fetch_history(self, chunk):
+        """
+        Fetches a module's measurements from getmeasure, a page at a time, as timestamped metrics
+        """
+        # pylint: disable=too-many-locals
+        indexed, types, begin, end = chunk
+        metrics = []
+        while begin <= end:
+            access_token = self._authenticate.access_token()
+            if access_token is None:
+                raise BackfillFailed('Failed to retrieve a valid access token')
+            params = {'access_token': access_token, 'device_id': indexed.station_id, 'scale': 'max',
+                      'type': ','.join(types), 'date_begin': begin, 'date_end': end,
+                      'limit': self._backfill_chunk_points, 'optimize': 'false', 'real_time': 'true'}
+            if indexed.module_id != indexed.station_id:
+                params['module_id'] = indexed.module_id
+            response = _post_request('api/getmeasure', params, self._logger, retry=True)
+            if response is None:
+                raise BackfillFailed(f'Failed to retrieve the history of {indexed.descriptor_prefix}')
+
+            measurements = response['body'] or {}  # Measurement time => the value of each type
+            times = sorted(int(t) for t in measurements)
+            for t in times:
+                timestamp = datetime.utcfromtimestamp(t)
+                for measure_type, value in zip(types, measurements[str(t)]):
+                    if value is not None:
+                        metrics.append(Metric(self.plugin_name, f'{indexed.descriptor_prefix} {measure_type}', value,
+                                              timestamp=timestamp, tags=indexed.tags))
+            if len(times) < self._backfill_chunk_points:
+                break
+            begin = times[-1] + 1  # A full page, so there may be more
+        return metrics
+
+    @staticmethod
+    def _simulated_devices():
+        """
+        A station with an outdoor module, with random readings, in the same form as getstationsdata returns them
+        """
+        return [{'_id': '70:ee:50:00:00:01', 'type': _STATION_TYPE, 'station_name': 'Home', 'module_name': 'Indoor',
+                 'dashboard_data': {'time_utc': int(time.time()),
+                                    'Temperature': round(random.uniform(18.0, 23.0), 1),
+                                    'Humidity': random.randint(40, 60),
+                                    'CO2': random.randint(400, 1200),
+                                    'Pressure': round(random.uniform(990.0, 1030.0), 1),
+                                    'Noise': random.randint(35, 60),
+                                    'temp_trend': 'stable'},
+                 'modules': [{'_id': '02:00:00:00:00:01', 'type': _OUTDOOR_MODULE_TYPE, 'module_name': 'Outdoor',
+                              'dashboard_data': {'time_utc': int(time.time()),
+                                                 'Temperature': round(random.uniform(12.0, 23.0), 1),
+                                                 'Humidity': random.randint(50, 90)}}]}]
+
     # pylint disable=E1101
     def _read_metrics(self):
         """
-        Reads the outside temperature from a Netatmo outdoor module
+        Reads every station and module from Netatmo
         """
 
-        debug_message = f"Reading Temp for {self._station_name if self._station_name is not None else f'the first {_STATION_TYPE} station'} from the {self._module_name if self._module_name is not None else f'first {_OUTDOOR_MODULE_TYPE} outdoor'} module from {self.plugin_name}"
         if self._simulation:
-            debug_message += ' [SIMULATED]'
-            self._logger.debug(debug_message)
-
-            temp = round(random.uniform(12.0, 23.0), 1)
-            text_temperatures = f'{self._zone} ({temp})'
-            return ([Metric(self._zone, temp)], text_temperatures)
+            self._logger.debug(f'Reading stations from {self.plugin_name} [SIMULATED]')
+            metrics = self._metrics_from_devices(self._simulated_devices())
+            return metrics, _describe(metrics)
 
         try:
-            access_token = Authenticate(self._config, self.plugin_name, self._client_id, self._client_secret,
-                                        self._username, self._password).access_token()
+            access_token = self._authenticate.access_token()
             if access_token is None:
                 raise Exception('Failed to retrieve a valid access token')
 
-            response = _post_request('api/getstationsdata', {'access_token': access_token}, self._logger)
+            response = _post_request('api/getstationsdata', {'access_token': access_token}, self._logger,
+                                     retry=True)
             if response is None:
                 raise Exception('Failed to retrieve station data')
             try:
-                raw_data = response['body']['devices']
-
-                station = self._find_station(raw_data)
-                module = self._find_module(station['modules'])
-
-                temp = round(module['dashboard_data']['Temperature'], 1)
-
-                text_temperatures = f'{self._zone} ({temp})'
-                return ([Metric(self._zone, temp)], text_temperatures)
-
-            except ModuleNotFound as mex:
-                self._logger.error('%s', mex)
+                devices = response['body']['devices']
+                metrics = self._metrics_from_devices(devices)
+                if self._backfill and self.publisher is not None:
+                    gaps = self._find_gaps(devices)
+                    if gaps:
+                        self._start_backfill(gaps)
+                return metrics, _describe(metrics)
             except Exception:
                 self._logger.exception('Failed to parse station/module data from %s', response)
 
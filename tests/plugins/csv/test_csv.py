@@ -0,0 +1,180 @@
+import gzip
+import json
+import os
+from datetime import datetime
+
+import pytest
+
+from AppConfig import AppConfig
+from Metric import Metric
+from plugins.csv import Plugin
+
+
+def _plugin(tmp_path, settings: str = '') -> Plugin:
+    ini_file = tmp_path / 'config.ini'
+    ini_file.write_text(f'[Csv]\nfilename={tmp_path / "temps.csv"}\n{settings}\n', encoding='UTF-8')
+    plugin = Plugin(AppConfig(str(ini_file)))
+    plugin.open()
+    return plugin
+
+
+def _cycle(day: int, minute: int = 0):
+    return datetime(2022, 1, day, 12, minute), [Metric('evohome', 'Kitchen', 21.2, 12.0),
+                                               Metric('darksky', 'Outside', 21.3)]
+
+
+@pytest.mark.unit
+def test_header_is_written_once_and_a_row_per_cycle(tmp_path):
+    target = _plugin(tmp_path)
+
+    target.write(*_cycle(1, 0))
+    target.write(*_cycle(1, 1))
+    target.close()
+
+    assert (tmp_path / 'temps.csv').read_text(encoding='UTF-8').splitlines() == [
+        'Time,evohome kitchen [A],evohome kitchen [T],darksky outside [A]',
+        '2022-01-01 12:00:00,21.2,12.0,21.3',
+        '2022-01-01 12:01:00,21.2,12.0,21.3',
+    ]
+
+
+@pytest.mark.unit
+def test_buffered_cycles_are_written_as_rows_of_their_own(tmp_path):
+    target = _plugin(tmp_path, 'flushEveryCycles=2')
+
+    assert target.write(*_cycle(1, 0)) == 0
+    assert target.write(*_cycle(1, 1)) == 4
+    target.close()
+
+    assert len((tmp_path / 'temps.csv').read_text(encoding='UTF-8').splitlines()) == 3
+
+
+@pytest.mark.unit
+def test_daily_rotation_compresses_the_previous_day(tmp_path):
+    target = _plugin(tmp_path, 'rotate=daily')
+
+    target.write(*_cycle(1))
+    target.write(*_cycle(2))
+    target.close()
+
+    with gzip.open(tmp_path / 'temps.2022-01-01.csv.gz', 'rt', encoding='UTF-8') as rotated:
+        assert rotated.read().splitlines()[1].startswith('2022-01-01')
+    current = (tmp_path / 'temps.csv').read_text(encoding='UTF-8').splitlines()
+    assert current[0].startswith('Time'), 'Expected the new file to start with a header'
+    assert current[1].startswith('2022-01-02')
+
+
+@pytest.mark.unit
+def test_size_rotation(tmp_path):
+    target = _plugin(tmp_path, 'rotate=size\nrotateSizeMB=0.00001\ncompressRotated=false')
+
+    for minute in range(3):
+        target.write(*_cycle(1, minute))
+    target.close()
+
+    rotated = [name for name in os.listdir(tmp_path) if name.startswith('temps.2')]
+    assert len(rotated) == 2
+    assert all(name.endswith('.csv') for name in rotated)
+
+
+@pytest.mark.unit
+def test_columns_keep_their_position_when_series_come_and_go(tmp_path):
+    target = _plugin(tmp_path)
+    target.write(*_cycle(1))
+    target.write(datetime(2022, 1, 1, 12, 1), [Metric('darksky', 'Outside', 20.0), Metric('evohome', 'Hall', 19.0)])
+    target.close()
+
+    assert (tmp_path / 'temps.csv').read_text(encoding='UTF-8').splitlines() == [
+        'Time,evohome kitchen [A],evohome kitchen [T],darksky outside [A]',
+        '2022-01-01 12:00:00,21.2,12.0,21.3',
+        '2022-01-01 12:01:00,,,20.0,19.0',
+    ]
+    assert json.loads((tmp_path / 'temps.csv.columns.json').read_text(encoding='UTF-8')) == \
+        ['evohome kitchen [A]', 'evohome kitchen [T]', 'darksky outside [A]', 'evohome hall [A]']
+
+
+@pytest.mark.unit
+def test_new_columns_are_added_to_the_header_on_rotation(tmp_path):
+    target = _plugin(tmp_path, 'rotate=daily')
+    target.write(*_cycle(1))
+    target.write(datetime(2022, 1, 1, 13), [Metric('evohome', 'Hall', 19.0)])
+    target.write(*_cycle(2))
+    target.close()
+
+    assert (tmp_path / 'temps.csv').read_text(encoding='UTF-8').splitlines()[0] == \
+        'Time,evohome kitchen [A],evohome kitchen [T],darksky outside [A],evohome hall [A]'
+
+
+@pytest.mark.unit
+def test_the_column_index_survives_a_restart(tmp_path):
+    target = _plugin(tmp_path)
+    target.write(*_cycle(1))
+    target.close()
+
+    target = _plugin(tmp_path)
+    target.write(datetime(2022, 1, 1, 12, 1), [Metric('darksky', 'Outside', 20.0)])
+    target.close()
+
+    assert (tmp_path / 'temps.csv').read_text(encoding='UTF-8').splitlines()[-1] == '2022-01-01 12:01:00,,,20.0'
+
+
+@pytest.mark.unit
+def test_a_file_headed_without_the_plugin_keeps_its_columns(tmp_path):
+    (tmp_path / 'temps.csv').write_text('Time,kitchen [A],kitchen [T],outside [A]\n'
+                                        '2022-01-01 11:59:00,21.0,12.0,21.1\n', encoding='UTF-8')
+
+    target = _plugin(tmp_path)
+    target.write(*_cycle(1))
+    target.write(datetime(2022, 1, 1, 12, 1), [Metric('netatmo', 'Outside', 20.9)])
+    target.close()
+
+    assert (tmp_path / 'temps.csv').read_text(encoding='UTF-8').splitlines() == [
+        'Time,kitchen [A],kitchen [T],outside [A]',
+        '2022-01-01 11:59:00,21.0,12.0,21.1',
+        '2022-01-01 12:00:00,21.2,12.0,21.3',
+        '2022-01-01 12:01:00,,,,20.9',
+    ]
+    assert json.loads((tmp_path / 'temps.csv.columns.json').read_text(encoding='UTF-8')) == \
+        ['evohome kitchen [A]', 'evohome kitchen [T]', 'darksky outside [A]', 'netatmo outside [A]']
+
+
+@pytest.mark.unit
+def test_plugins_reading_the_same_descriptor_get_columns_of_their_own(tmp_path):
+    target = _plugin(tmp_path)
+    target.write(datetime(2022, 1, 1, 12), [Metric('darksky', 'Outside', 21.3), Metric('netatmo', 'Outside', 20.9)])
+    target.close()
+
+    assert (tmp_path / 'temps.csv').read_text(encoding='UTF-8').splitlines() == [
+        'Time,darksky outside [A],netatmo outside [A]',
+        '2022-01-01 12:00:00,21.3,20.9',
+    ]
+
+
+@pytest.mark.unit
+def test_metrics_with_their_own_timestamp_get_a_row_of_their_own(tmp_path):
+    target = _plugin(tmp_path)
+    target.write(datetime(2022, 1, 1, 12), [Metric('dccapi', 'Electricity', 0.5, timestamp=datetime(2022, 1, 1, 11)),
+                                            Metric('dccapi', 'Electricity', 0.7, timestamp=datetime(2022, 1, 1, 11, 30)),
+                                            Metric('darksky', 'Outside', 21.3)])
+    target.close()
+
+    assert (tmp_path / 'temps.csv').read_text(encoding='UTF-8').splitlines() == [
+        'Time,dccapi electricity [A],darksky outside [A]',
+        '2022-01-01 11:00:00,0.5',
+        '2022-01-01 11:30:00,0.7',
+        '2022-01-01 12:00:00,,21.3',
+    ]
+
+
+@pytest.mark.unit
+def test_long_format_writes_a_row_per_metric(tmp_path):
+    target = _plugin(tmp_path, 'format=long')
+    target.write(*_cycle(1))
+    target.close()
+
+    assert (tmp_path / 'temps.csv').read_text(encoding='UTF-8').splitlines() == [
+        'time,plugin,descriptor,actual,target,text,ts',
+        '2022-01-01 12:00:00,evohome,kitchen,21.2,12.0,,',
+        '2022-01-01 12:00:00,darksky,outside,21.3,,,',
+    ]
+    assert not os.path.exists(tmp_path / 'temps.csv.columns.json')
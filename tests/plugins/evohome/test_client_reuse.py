@@ -0,0 +1,117 @@
+import json
+import os
+from datetime import datetime, timedelta
+from urllib.parse import urlparse
+
+import httpretty
+import pytest
+
+from AppConfig import AppConfig
+from TokenStore import TokenStore
+from plugins.evohome import Plugin
+from test_base import TestBase, mock_data_file
+
+
+def _calls(path: str) -> int:
+    return len([r for r in httpretty.latest_requests() if urlparse(r.path).path.endswith(path)])
+
+
+class TestClientReuse(TestBase):
+    installation_file_name = 'single_installation.json'
+    ini_file_name = 'single_installation.ini'
+
+    @pytest.fixture
+    def target(self, tmp_path):
+        httpretty.reset()
+        self.setup_class()
+        target = Plugin(AppConfig(mock_data_file(self.ini_file_name)))
+        target._token_store = TokenStore(str(tmp_path / 'tokens.json'))
+        yield target
+        httpretty.disable()
+        httpretty.reset()
+
+    @pytest.mark.unit
+    def test_the_client_is_only_created_once(self, target):
+        target.read()
+        tokens = _calls('/Auth/OAuth/Token')  # httpretty records each POST twice, so compare with the first read
+        target.read()
+
+        assert _calls('/Auth/OAuth/Token') == tokens
+        assert _calls('/userAccount') == 1
+        assert _calls('/installationInfo') == 1
+
+    @pytest.mark.unit
+    def test_tokens_are_only_written_when_they_change(self, target):
+        target.read()
+        written = os.stat(target._token_store.filename).st_mtime_ns
+
+        target.read()
+
+        assert os.stat(target._token_store.filename).st_mtime_ns == written
+
+    @pytest.mark.unit
+    def test_a_revoked_cached_access_token_is_replaced(self, target):
+        expires = (datetime.now() + timedelta(hours=1)).strftime('%Y-%m-%d %H:%M:%S.%f')
+        target._token_store.write(['revoked', 'refresh', expires])
+        httpretty.register_uri(httpretty.GET, "https://tccna.honeywell.com/WebAPI/emea/api/v1/userAccount",
+                               responses=[httpretty.Response(status=401, body='[{"code": "Unauthorized"}]'),
+                                          httpretty.Response(body=json.dumps(self.account_info))])
+
+        temperatures = target.read()
+
+        assert _calls('/Auth/OAuth/Token') > 0, 'A new access token should have been fetched'
+        assert target._token_store.read()[0] == json.loads(self.token)['access_token']
+        assert len(temperatures) == 6
+
+    @pytest.mark.unit
+    def test_tokens_another_process_has_refreshed_are_not_overwritten(self, target):
+        target.read()
+        expires = (datetime.now() + timedelta(hours=1)).strftime('%Y-%m-%d %H:%M:%S.%f')
+        TokenStore(target._token_store.filename).write(['rotated', 'rotated refresh', expires])
+
+        target.read()
+
+        assert TokenStore(target._token_store.filename).read() == ['rotated', 'rotated refresh', expires]
+
+    @pytest.mark.unit
+    def test_the_installation_is_fetched_again_once_it_has_expired(self, target):
+        target._installation_cache_seconds = 0
+
+        target.read()
+        target.read()
+
+        assert _calls('/userAccount') == 1
+        assert _calls('/installationInfo') == 2
+
+    @pytest.mark.unit
+    def test_the_client_is_recreated_after_an_authentication_failure(self, target):
+        target.read()
+        httpretty.register_uri(httpretty.GET,
+                               "https://tccna.honeywell.com/WebAPI/emea/api/v1/location/1/status?includeTemperatureControlSystems=True",
+                               status=401, body='[{"code": "Unauthorized"}]')
+        target.read()
+        assert target._client is None
+
+        self.setup_class()
+        target.read()
+
+        assert _calls('/userAccount') == 2
+
+    @pytest.mark.unit
+    def test_a_poll_reads_zones_and_hot_water_from_a_single_status_call(self, target):
+        target.read()
+        before = len(httpretty.latest_requests())
+
+        temperatures = target.read()
+
+        assert len(httpretty.latest_requests()) - before == 1
+        assert dict(target.api_calls) == {'status': 1}
+        assert len(temperatures) == 6, 'Expected 6 Temps (5 rooms + HW)'
+        hot_water = [x for x in temperatures if x.descriptor == 'hotwater'][0]
+        assert (hot_water.actual, hot_water.target) == (56, 0.0), 'The hot water is off in the status'
+
+    @pytest.mark.unit
+    def test_the_first_poll_logs_in(self, target):
+        target.read()
+
+        assert dict(target.api_calls) == {'login': 1, 'status': 1}
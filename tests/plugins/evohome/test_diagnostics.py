@@ -0,0 +1,66 @@
+import copy
+import json
+import logging
+
+import httpretty
+import pytest
+
+from AppConfig import AppConfig
+from TokenStore import TokenStore
+from plugins.evohome import Plugin
+from test_base import TestBase, mock_data_file
+
+_STATUS_URL = "https://tccna.honeywell.com/WebAPI/emea/api/v1/location/1/status?includeTemperatureControlSystems=True"
+
+
+class TestDiagnostics(TestBase):
+    installation_file_name = 'single_installation.json'
+    ini_file_name = 'single_installation.ini'
+
+    @pytest.fixture
+    def target(self, tmp_path):
+        httpretty.reset()
+        self.setup_class()
+        target = Plugin(AppConfig(mock_data_file(self.ini_file_name)))
+        target._token_store = TokenStore(str(tmp_path / 'tokens.json'))
+        target.read()  # Creates the client
+        yield target
+        httpretty.disable()
+        httpretty.reset()
+
+    def _break_zones(self, count: int):
+        status = copy.deepcopy(self.location_1_status)
+        for zone in status['gateways'][0]['temperatureControlSystems'][0]['zones'][:count]:
+            del zone['setpointStatus']
+        # The client has already been created, so only the status is needed.  Registering it again without a reset
+        # makes httpretty go back to the original after the first request
+        httpretty.reset()
+        httpretty.register_uri(httpretty.GET, _STATUS_URL, body=json.dumps(status))
+
+    @pytest.mark.unit
+    def test_the_raw_data_is_logged_once_without_fetching_it_again(self, target, caplog):
+        self._break_zones(3)
+
+        with caplog.at_level(logging.ERROR):
+            temperatures = target.read()
+
+        assert len(temperatures) == 3, 'Expected the other 2 rooms and the hot water'
+        assert len(httpretty.latest_requests()) == 1, 'Expected only the status to be fetched'
+        assert dict(target.api_calls) == {'status': 1}
+        errors = [r.getMessage() for r in caplog.records if 'key error' in r.getMessage()]
+        assert len(errors) == 3
+        assert '"zoneId": "1571555"' in errors[0]
+        assert all('raw_data=<as logged above>' in e for e in errors[1:])
+
+    @pytest.mark.unit
+    def test_the_raw_data_is_not_logged_again_until_the_interval_has_passed(self, target, caplog):
+        self._break_zones(1)
+
+        with caplog.at_level(logging.ERROR):
+            target.read()
+            target.read()
+            target._next_raw_data_dump = 0.0
+            target.read()
+
+        dumps = [r.getMessage() for r in caplog.records if '"zoneId"' in r.getMessage()]
+        assert len(dumps) == 2
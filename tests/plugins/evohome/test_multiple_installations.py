@@ -1,6 +1,10 @@
+import json
+
+import httpretty
 import pytest
 
 from AppConfig import AppConfig
+from TokenStore import TokenStore
 from plugins.evohome import Plugin
 from test_base import TestBase, mock_data_file
 
@@ -22,5 +26,53 @@ class TestMultipleInstallations(TestBase):
     @pytest.mark.unit
     def test_hot_water_temp_is_not_returned_for_a_location_without_hot_water(self):
         temperatures = self.target.read()
-        hot_water = [x for x in temperatures if x.zone == "Hot Water"]
+        hot_water = [x for x in temperatures if x.descriptor == "hotwater"]
         assert len(hot_water) == 0, f'Expected no Hot Water zone but found {len(hot_water)}'
+
+
+class TestAllLocations(TestBase):
+    installation_file_name = 'two_installations.json'
+    ini_file_name = 'two_installations.ini'
+
+    @pytest.fixture
+    def target(self, tmp_path):
+        httpretty.reset()
+        self.setup_class()
+        config = AppConfig(mock_data_file(self.ini_file_name))
+        config['EvoHome']['location'] = 'all'
+        target = Plugin(config)
+        target._token_store = TokenStore(str(tmp_path / 'tokens.json'))
+        target.read()  # Creates the client
+        yield target
+        httpretty.disable()
+        httpretty.reset()
+
+    @pytest.mark.unit
+    def test_every_location_is_read(self, target):
+        temperatures = target.read()
+
+        assert dict(target.api_calls) == {'status': 2}
+        assert len(temperatures) == 10, 'Expected 9 rooms and the hot water in London'
+        assert [t.descriptor for t in temperatures if 'hotwater' in t.descriptor] == ['london-hotwater']
+        assert 'dublin-office2' in [t.descriptor for t in temperatures]
+
+    @pytest.mark.unit
+    def test_metrics_are_tagged_with_where_they_are(self, target):
+        temperatures = {t.descriptor: t for t in target.read()}
+
+        assert temperatures['london-hotwater'].tags == {'location': 'London', 'gateway': '12345', 'system': '12345'}
+        assert temperatures['dublin-office2'].tags == {'location': 'Dublin', 'gateway': '54321', 'system': '54321'}
+
+    @pytest.mark.unit
+    def test_a_location_which_fails_is_skipped(self, target):
+        httpretty.reset()
+        httpretty.register_uri(httpretty.GET,
+                               "https://tccna.honeywell.com/WebAPI/emea/api/v1/location/1/status?includeTemperatureControlSystems=True",
+                               status=500, body='')
+        httpretty.register_uri(httpretty.GET,
+                               "https://tccna.honeywell.com/WebAPI/emea/api/v1/location/2/status?includeTemperatureControlSystems=True",
+                               body=json.dumps(self.location_2_status))
+
+        temperatures = target.read()
+
+        assert temperatures and all(t.descriptor.startswith('dublin-') for t in temperatures)
@@ -22,6 +22,6 @@ class TestSingleInstallation(TestBase):
     @pytest.mark.unit
     def test_hot_water_temp_is_returned_for_a_location_with_hot_water(self):
         temperatures = self.target.read()
-        hot_water = [x for x in temperatures if x.zone == "Hot Water"]
+        hot_water = [x for x in temperatures if x.descriptor == "hotwater"]
 
         assert len(hot_water) == 1, 'Expected 1 Hot Water zone but found %s' % len(hot_water)
@@ -0,0 +1,297 @@
+import json
+import os
+import threading
+import time
+from datetime import datetime
+from urllib.parse import parse_qs
+
+import httpretty
+import pytest
+
+from AppConfig import AppConfig
+from HttpTransport import HttpTransport
+from TokenStore import TokenStore
+from plugins.netatmo import Plugin
+
+
+def _mock_data_file(filename: str) -> str:
+    return os.path.join(os.path.dirname(__file__), f'mock_data/{filename}')
+
+
+def _read(target):
+    return {m.descriptor: m.actual if m.text is None else m.text for m in target.read()}
+
+
+@pytest.fixture
+def stations():
+    with open(_mock_data_file('getstationsdata.json'), encoding='utf-8') as data_file:
+        return json.load(data_file)
+
+
+@pytest.fixture
+def netatmo(tmp_path, stations, monkeypatch):
+    transport = HttpTransport(backoff_factor=0)
+    monkeypatch.setattr('plugins.netatmo.get_transport', lambda: transport)
+
+    def create(**options):
+        config = AppConfig(_mock_data_file('netatmo.ini'))
+        for option, value in options.items():
+            config['Netatmo'][option] = value
+        target = Plugin(config)
+        target._authenticate._token_store = TokenStore(str(tmp_path / 'tokens.json'))
+        target._last_points_file = str(tmp_path / 'last_points.json')
+        httpretty.register_uri(httpretty.POST, 'https://api.netatmo.com/api/getstationsdata',
+                               body=lambda request, uri, headers: (200, headers, json.dumps(stations)))
+        return target
+
+    httpretty.enable()
+    httpretty.register_uri(httpretty.POST, 'https://api.netatmo.com/oauth2/token',
+                           body='{"access_token": "access", "refresh_token": "refresh", "expire_in": 10800}')
+    yield create
+    httpretty.disable()
+    httpretty.reset()
+
+
+@pytest.mark.unit
+def test_every_station_module_and_field_is_read_from_one_call(netatmo):
+    target = netatmo()
+
+    actual = _read(target)
+
+    # httpretty records each POST twice
+    assert len([r for r in httpretty.latest_requests() if r.path == '/api/getstationsdata']) in (1, 2)
+    assert actual['outside'] == 4.3, 'The outside temperature is read from the outdoor module, as before'
+    assert actual['home-indoorco2'] == 650
+    assert actual['home-indoorpressure_trend'] == 'up'
+    assert actual['home-gardenhumidity'] == 88
+    assert actual['home-raingaugesum_rain_24'] == 3.1
+    assert actual['cottage-loungetemperature'] == 17.5
+    assert not [d for d in actual if d.endswith('time_utc') or '_date' in d], 'Times are not measurements'
+    assert not [d for d in actual if 'bedroom' in d], 'The unreachable module has no data'
+
+
+@pytest.mark.unit
+def test_metrics_are_tagged_with_their_station_and_module(netatmo):
+    target = netatmo()
+
+    humidity = next(m for m in target.read() if m.descriptor == 'home-gardenhumidity')
+
+    assert humidity.tags == {'station': 'Home', 'module': 'Garden', 'type': 'NAModule1'}
+
+
+@pytest.mark.unit
+def test_only_what_is_in_the_allow_lists_is_read(netatmo):
+    target = netatmo(stations='Home', modules='garden, Indoor', fields='Temperature,humidity')
+
+    actual = _read(target)
+
+    assert actual == {'outside': 4.3, 'indoortemperature': 21.3, 'indoorhumidity': 48, 'gardentemperature': 4.27,
+                      'gardenhumidity': 88}
+
+
+@pytest.mark.unit
+def test_the_stations_and_modules_are_only_searched_when_a_new_one_appears(netatmo, stations, monkeypatch):
+    target = netatmo()
+    searches = []
+    original = target._find_station
+    monkeypatch.setattr(target, '_find_station', lambda devices: searches.append(1) or original(devices))
+
+    target.read()
+    target.read()
+    assert len(searches) == 1
+
+    stations['body']['devices'][1]['modules'].append(
+        {'_id': '02:00:00:00:00:02', 'type': 'NAModule1', 'module_name': 'Patio',
+         'dashboard_data': {'Temperature': 6.1}})
+    actual = _read(target)
+
+    assert len(searches) == 2
+    assert actual['cottage-patiotemperature'] == 6.1
+
+
+@pytest.mark.unit
+def test_the_outdoor_module_can_be_chosen_by_name(netatmo):
+    target = netatmo(StationName='Cottage', OutdoorModule='Lounge')
+
+    actual = _read(target)
+
+    assert 'outside' not in actual, 'Cottage has no module named Lounge, only its station is'
+    assert actual['home-gardentemperature'] == 4.27, 'Everything else is still read'
+
+
+@pytest.mark.unit
+def test_a_simulated_read_returns_the_outside_temperature(netatmo):
+    target = netatmo(simulation='true')
+
+    metrics = target.read()
+
+    outside = next(m for m in metrics if m.descriptor == 'outside')
+    assert outside.plugin == 'netatmo'
+    assert 12.0 <= outside.actual <= 23.0
+
+
+_GARDEN = '02:00:00:00:00:01'
+_GARDEN_LATEST = 1643199990
+
+
+@pytest.fixture
+def getmeasure():
+    """
+    Serves a measurement every 150s, so more than getmeasure's limit fit in a chunk, failing for the times in fail_from
+    """
+    requests = []
+    fail_from = []
+
+    def measurements(request, uri, headers):
+        params = {k: v[0] for k, v in parse_qs(request.body.decode()).items()}
+        requests.append(params)
+        begin, end, limit = int(params['date_begin']), int(params['date_end']), int(params['limit'])
+        if fail_from and end >= fail_from[0]:
+            return 500, headers, '{"error": {"code": 500, "message": "Internal error"}}'
+        times = [t for t in range(begin + (-begin % 150), end + 1, 150)][:limit]
+        return 200, headers, json.dumps({'body': {str(t): [t % 1000 / 10, 50] for t in times}, 'status': 'ok'})
+
+    httpretty.register_uri(httpretty.POST, 'https://api.netatmo.com/api/getmeasure', body=measurements)
+    return requests, fail_from
+
+
+def _backfill(target, last_points):
+    with open(target._last_points_file, 'w', encoding='UTF-8') as f:
+        json.dump(last_points, f)
+    published = []
+    target.publisher = lambda metrics: published.append(metrics) or True
+    target.read()
+    target.published()
+    if target._backfill_executor is not None:
+        target._backfill_executor.shutdown(wait=True)
+        target._backfill_executor = None
+    with open(target._last_points_file, encoding='UTF-8') as f:
+        return published, json.load(f)
+
+
+@pytest.mark.unit
+def test_nothing_is_backfilled_without_a_last_point(netatmo, getmeasure):
+    target = netatmo(backfill='true')
+
+    published, last_points = _backfill(target, {})
+
+    assert published == []
+    assert last_points[_GARDEN] == _GARDEN_LATEST
+    assert len(last_points) == 4, 'Every module with data, including the stations'
+
+
+@pytest.mark.unit
+def test_the_last_point_only_moves_on_once_the_reading_has_been_written(netatmo, getmeasure):
+    target = netatmo(backfill='true')
+    target.publisher = lambda metrics: True
+
+    target.read()
+
+    assert not os.path.exists(target._last_points_file), 'Nothing has been written yet'
+    target.published()
+    with open(target._last_points_file, encoding='UTF-8') as f:
+        assert json.load(f)[_GARDEN] == _GARDEN_LATEST
+
+
+@pytest.mark.unit
+def test_a_backfill_stops_when_the_outputs_fail_to_write_it(netatmo, getmeasure):
+    target = netatmo(backfill='true', backfillChunkPoints='4', backfillConcurrency='1')
+    begin = _GARDEN_LATEST - 3600
+    with open(target._last_points_file, 'w', encoding='UTF-8') as f:
+        json.dump({_GARDEN: begin}, f)
+    attempts = []
+    target.publisher = lambda metrics: attempts.append(metrics) and False
+
+    target.read()
+    target._backfill_executor.shutdown(wait=True)
+
+    assert len(attempts) == 1
+    with open(target._last_points_file, encoding='UTF-8') as f:
+        assert json.load(f)[_GARDEN] == begin
+
+
+@pytest.mark.unit
+def test_a_backfill_stops_once_the_plugin_is_closed(netatmo, getmeasure):
+    target = netatmo(backfill='true', backfillChunkPoints='4', backfillConcurrency='1')
+    begin = _GARDEN_LATEST - 3600
+    with open(target._last_points_file, 'w', encoding='UTF-8') as f:
+        json.dump({_GARDEN: begin}, f)
+    started = threading.Event()
+    published = []
+
+    def publish(metrics):
+        started.wait(5)
+        published.append(metrics)
+        target.close()  # As evologger shuts down
+        return True
+
+    target.publisher = publish
+    target.read()
+    executor = target._backfill_executor
+    started.set()
+    executor.shutdown(wait=True)
+
+    assert len(published) == 1
+    with open(target._last_points_file, encoding='UTF-8') as f:
+        assert json.load(f)[_GARDEN] == begin + 1200, 'Carries on after the chunk which was written next time'
+
+
+@pytest.mark.unit
+def test_a_gap_is_backfilled_in_pages_and_chunks(netatmo, getmeasure):
+    requests, _ = getmeasure
+    target = netatmo(backfill='true', backfillChunkPoints='4', backfillConcurrency='1')
+    begin = _GARDEN_LATEST - 3600
+
+    published, last_points = _backfill(target, {_GARDEN: begin})
+
+    garden = [m for batch in published for m in batch]
+    temperatures = [m for m in garden if m.descriptor == 'home-gardentemperature']
+    assert [m.timestamp for m in temperatures] == [datetime.utcfromtimestamp(t)
+                                                   for t in range(begin + 150 - begin % 150, _GARDEN_LATEST, 150)]
+    assert all(m.tags['module'] == 'Garden' for m in garden)
+    assert {(r['device_id'], r['module_id'], r['type'], r['scale']) for r in requests} == \
+           {('70:ee:50:00:00:01', _GARDEN, 'Temperature,Humidity', 'max')}
+    assert len(published) == 3, 'An hour is 3 chunks of 4 x 5 minutes, each published as it is fetched'
+    assert len(requests) > 3, 'Each chunk has more than 4 measurements, so takes more than one page'
+    assert last_points[_GARDEN] == _GARDEN_LATEST - 1
+
+
+@pytest.mark.unit
+def test_a_failed_backfill_carries_on_from_the_last_chunk_written(netatmo, getmeasure):
+    requests, fail_from = getmeasure
+    fail_from.append(_GARDEN_LATEST - 1800)
+    target = netatmo(backfill='true', backfillChunkPoints='4', backfillConcurrency='1')
+    begin = _GARDEN_LATEST - 3600
+
+    published, last_points = _backfill(target, {_GARDEN: begin})
+
+    assert len(published) == 1
+    assert last_points[_GARDEN] == begin + 1200, 'Only the first chunk was written'
+
+    fail_from.clear()
+    published, last_points = _backfill(target, last_points)
+
+    assert min(m.timestamp for batch in published for m in batch) > datetime.utcfromtimestamp(begin + 1200)
+    assert last_points[_GARDEN] == _GARDEN_LATEST - 1
+
+
+@pytest.mark.unit
+def test_chunks_are_fetched_concurrently_but_published_in_order(netatmo, monkeypatch):
+    target = netatmo(backfill='true', backfillChunkPoints='2', backfillConcurrency='3')
+    fetching = []
+    most_at_once = []
+
+    def fetch(chunk):
+        fetching.append(chunk)
+        most_at_once.append(len(fetching))
+        time.sleep(0.05 if chunk[2] % 1200 else 0.01)  # So the chunks finish out of order
+        fetching.remove(chunk)
+        return [chunk[2]]
+
+    monkeypatch.setattr(target, '_fetch_history', fetch)
+    begin = _GARDEN_LATEST - 3600
+
+    published, _ = _backfill(target, {_GARDEN: begin})
+
+    assert published == [[t] for t in range(begin + 1, _GARDEN_LATEST, 600)]
+    assert max(most_at_once) == 3
@@ -0,0 +1,298 @@
+import asyncio
+import time
+from concurrent import futures
+from datetime import datetime
+
+import pytest
+import structlog
+
+import evologger
+from HttpTransport import HttpTransport
+from Metric import Metric
+from RateLimiter import RateLimiter
+from Scheduler import Scheduler
+from plugins.PluginBase import AsyncInputPluginBase, InputPluginBase, OutputPluginBase
+
+
+class _SyncInput(InputPluginBase):
+    def __init__(self, name, delay=0.0):
+        super().__init__(evologger.config, name, 'input')
+        self._delay = delay
+
+    def _read_configuration(self, config):
+        pass
+
+    def _read_metrics(self):
+        time.sleep(self._delay)
+        return [Metric(self.plugin_name, 'Zone', 1.0)], ''
+
+
+class _AsyncInput(AsyncInputPluginBase):
+    def __init__(self, name, delay=0.0):
+        super().__init__(evologger.config, name, 'input')
+        self._delay = delay
+
+    def _read_configuration(self, config):
+        pass
+
+    async def _read_metrics(self):
+        await asyncio.sleep(self._delay)
+        return [Metric(self.plugin_name, 'Zone', 2.0)], ''
+
+
+class _ScheduledInput(InputPluginBase):
+    def __init__(self, name):
+        super().__init__(evologger.config, name, 'input')
+        self.scheduler = Scheduler(name, '0,30 * * * *')
+        self.could_run = []
+
+    def _read_configuration(self, config):
+        pass
+
+    def _read_metrics(self):
+        self.could_run.append(self.scheduler.can_run_now())
+        return [], ''
+
+
+class _PublishedInput(_SyncInput):
+    def __init__(self, name):
+        super().__init__(name)
+        self.published_count = 0
+
+    def published(self):
+        self.published_count += 1
+
+
+class _FailingOutput(OutputPluginBase):
+    def _read_configuration(self, config):
+        pass
+
+    def _write_metrics(self, timestamp, metrics):
+        raise IOError('Unavailable')
+
+
+class _QuarterPast(datetime):
+    @classmethod
+    def utcnow(cls):
+        return datetime(2022, 1, 1, 12, 15)
+
+
+class _NothingScheduled:
+    def __init__(self, names):
+        self._names = names
+
+    def dispatch_all(self):
+        return [(name, datetime(2022, 1, 1, 12)) for name in self._names]
+
+    @staticmethod
+    def time_until_next_run():
+        return None
+
+
+class _Output(OutputPluginBase):
+    def __init__(self, name, accepts_merged_batches, flush_every_cycles=0):
+        self._accepts_merged_batches = accepts_merged_batches
+        super().__init__(evologger.config, name, 'output')
+        self.written = []
+        self._flush_every_cycles = flush_every_cycles
+        self._buffering = flush_every_cycles > 1
+
+    def _read_configuration(self, config):
+        pass
+
+    def _write_metrics(self, timestamp, metrics):
+        self.written.append(metrics)
+
+
+class _Loader:
+    def __init__(self, inputs):
+        self.inputs = [{'name': getattr(p, 'plugin_name', 'broken'), 'section': getattr(p, 'plugin_name', 'broken'),
+                        'plugin': p} for p in inputs]
+        self.outputs = []
+
+    @staticmethod
+    def load(plugin):
+        if isinstance(plugin['plugin'], Exception):
+            raise plugin['plugin']
+        return plugin['plugin']
+
+
+@pytest.fixture
+def loader(monkeypatch):
+    def create(*inputs):
+        monkeypatch.setattr(evologger, 'plugins', _Loader(inputs))
+        monkeypatch.setattr(evologger, 'in_flight', {})
+        monkeypatch.setattr(evologger, 'input_executor', futures.ThreadPoolExecutor(max_workers=len(inputs)))
+        monkeypatch.setattr(evologger, 'logger', structlog.get_logger('test'))
+
+    return create
+
+
+@pytest.mark.unit
+def test_sync_and_async_inputs_are_read_together_and_sorted(loader):
+    loader(_SyncInput('b', 0.2), _AsyncInput('a', 0.2))
+
+    started = time.monotonic()
+    actual = asyncio.run(evologger.read_metrics())
+
+    assert [m.plugin for m in actual] == ['a', 'b']
+    assert time.monotonic() - started < 0.35, 'Inputs should be read concurrently'
+
+
+@pytest.mark.unit
+@pytest.mark.parametrize('slow_plugin', [_SyncInput, _AsyncInput])
+def test_an_input_missing_its_deadline_is_skipped(slow_plugin, loader, monkeypatch):
+    monkeypatch.setattr(evologger, 'DEFAULT_READ_TIMEOUT', 0.1)
+    loader(slow_plugin('slow', 1.0), _SyncInput('fast'))
+
+    actual = asyncio.run(evologger.read_metrics())
+
+    assert [m.plugin for m in actual] == ['fast']
+
+
+@pytest.mark.unit
+def test_the_rate_limits_are_only_published_when_asked_for(loader, monkeypatch):
+    loader(_SyncInput('b'))
+    evologger.plugins.inputs[0]['hosts'] = ('api.example.com',)
+
+    actual = asyncio.run(evologger.read_metrics())
+
+    assert [m.plugin for m in actual] == ['b']
+
+
+@pytest.mark.unit
+def test_the_rate_limits_of_the_hosts_of_the_inputs_read_are_published(loader, monkeypatch):
+    monkeypatch.setitem(evologger.config['DEFAULT'], 'rateLimitMetrics', 'true')
+    monkeypatch.setattr(evologger, 'get_transport',
+                        lambda: HttpTransport(rate_limiter=RateLimiter({'api.example.com': (10, None)})))
+    loader(_SyncInput('b'))
+    evologger.plugins.inputs[0]['hosts'] = ('api.example.com',)
+
+    actual = asyncio.run(evologger.read_metrics())
+
+    assert [(m.plugin, m.descriptor, m.actual, m.target) for m in actual] == [
+        ('b', 'zone', 1.0, None),
+        ('ratelimiter', 'api.example.com-rate', 10, 10),
+        ('ratelimiter', 'api.example.com-stretch', 1, None)]
+
+
+@pytest.mark.unit
+def test_history_from_a_plugin_is_only_written_to_outputs_honouring_its_timestamps(loader, monkeypatch):
+    loader(_SyncInput('b'))
+    timestamped, untimestamped = _Output('timestamped', True), _Output('untimestamped', False)
+    evologger.plugins.outputs = [{'name': p.plugin_name, 'section': p.plugin_name, 'plugin': p}
+                                 for p in (timestamped, untimestamped)]
+    monkeypatch.setattr(evologger, 'output_executor', futures.ThreadPoolExecutor(max_workers=2))
+    monkeypatch.setattr(evologger, 'publish_lock', None)
+    history = [Metric('b', 'Zone', 1.0, timestamp=datetime(2022, 1, 1))]
+
+    async def publish_from_the_plugins_thread():
+        monkeypatch.setattr(evologger, 'event_loop', asyncio.get_running_loop())
+        await asyncio.get_running_loop().run_in_executor(None, evologger.publish_from_plugin, history)
+
+    asyncio.run(publish_from_the_plugins_thread())
+
+    assert timestamped.written == [history]
+    assert untimestamped.written == []
+
+
+@pytest.mark.unit
+def test_only_a_plugin_which_is_read_is_handed_its_tick(loader, monkeypatch):
+    monkeypatch.setattr('Scheduler.datetime', _QuarterPast)
+    busy, idle = _ScheduledInput('busy'), _ScheduledInput('idle')
+    loader(busy, idle)
+    evologger.in_flight['busy'] = futures.Future()
+    tick = datetime(2022, 1, 1, 12, 0)
+
+    asyncio.run(evologger.read_metrics({'busy': tick, 'idle': tick}))
+
+    assert idle.could_run == [True]
+    assert not busy.scheduler.can_run_now(), 'The skipped tick should not be left for a later read'
+
+
+@pytest.mark.unit
+@pytest.mark.parametrize('failing, expected', [(False, 1), (True, 0)])
+def test_inputs_are_told_once_every_output_has_written_what_they_read(loader, monkeypatch, failing, expected):
+    target = _PublishedInput('b')
+    loader(target)
+    outputs = [_Output('timestamped', True)] + ([_FailingOutput(evologger.config, 'failing', 'output')] if failing else [])
+    evologger.plugins.outputs = [{'name': p.plugin_name, 'section': p.plugin_name, 'plugin': p} for p in outputs]
+    monkeypatch.setattr(evologger, 'output_executor', futures.ThreadPoolExecutor(max_workers=2))
+    monkeypatch.setattr(evologger, 'publish_lock', None)
+
+    asyncio.run(evologger.poll_plugins())
+
+    assert target.published_count == expected
+
+
+@pytest.mark.unit
+def test_inputs_are_only_told_once_a_buffering_output_has_written_what_they_read(loader, monkeypatch):
+    target = _PublishedInput('b')
+    loader(target)
+    output = _Output('buffering', True, flush_every_cycles=2)
+    evologger.plugins.outputs = [{'name': 'buffering', 'section': 'buffering', 'plugin': output}]
+    monkeypatch.setattr(evologger, 'output_executor', futures.ThreadPoolExecutor(max_workers=2))
+    monkeypatch.setattr(evologger, 'publish_lock', None)
+
+    asyncio.run(evologger.poll_plugins())
+
+    assert (output.written, target.published_count) == ([], 0)
+    asyncio.run(evologger.poll_plugins())
+    assert (len(output.written), target.published_count) == (1, 1)
+
+
+@pytest.mark.unit
+def test_history_is_not_left_in_the_buffer_of_an_output(loader, monkeypatch):
+    loader(_SyncInput('b'))
+    output = _Output('buffering', True, flush_every_cycles=10)
+    evologger.plugins.outputs = [{'name': 'buffering', 'section': 'buffering', 'plugin': output}]
+    monkeypatch.setattr(evologger, 'output_executor', futures.ThreadPoolExecutor(max_workers=2))
+    monkeypatch.setattr(evologger, 'publish_lock', None)
+    history = [Metric('b', 'Zone', 1.0, timestamp=datetime(2022, 1, 1))]
+
+    async def publish_from_the_plugins_thread():
+        monkeypatch.setattr(evologger, 'event_loop', asyncio.get_running_loop())
+        return await asyncio.get_running_loop().run_in_executor(None, evologger.publish_from_plugin, history)
+
+    assert asyncio.run(publish_from_the_plugins_thread())
+    assert output.written == [history]
+
+
+@pytest.mark.unit
+@pytest.mark.filterwarnings('ignore:coroutine .publish_metrics. was never awaited')
+def test_publishing_from_a_plugin_gives_up_once_the_loop_has_stopped(loader, monkeypatch):
+    loader(_SyncInput('b'))
+    monkeypatch.setattr(evologger, 'DEFAULT_WRITE_TIMEOUT', 0.05)
+    loop = asyncio.new_event_loop()
+    monkeypatch.setattr(evologger, 'event_loop', loop)
+    try:
+        assert not evologger.publish_from_plugin([Metric('b', 'Zone', 1.0, timestamp=datetime(2022, 1, 1))])
+    finally:
+        loop.close()
+
+
+@pytest.mark.unit
+@pytest.mark.parametrize('poll_on_start, expected', [('true', 1), ('false', 0)])
+def test_every_input_is_polled_at_start_up_unless_told_not_to(loader, monkeypatch, poll_on_start, expected):
+    target = _ScheduledInput('b')
+    loader(target)
+    monkeypatch.setitem(evologger.config['DEFAULT'], 'pollOnStart', poll_on_start)
+    monkeypatch.setattr(evologger, 'continue_polling', True)
+    monkeypatch.setattr(evologger, 'event_loop', None)
+    monkeypatch.setattr(evologger, 'publish_lock', None)
+
+    asyncio.run(evologger.poll(_NothingScheduled(['b']), single_run=False))
+
+    assert len(target.could_run) == expected
+
+
+@pytest.mark.unit
+def test_a_plugin_which_cannot_be_loaded_does_not_stop_the_others(loader, monkeypatch):
+    loader(KeyError('username'), _SyncInput('b'))
+    evologger.plugins.outputs = [{'name': 'broken', 'section': 'broken', 'plugin': KeyError('filename')}]
+    monkeypatch.setattr(evologger, 'publish_lock', None)
+
+    actual = asyncio.run(evologger.read_metrics())
+
+    assert [m.plugin for m in actual] == ['b']
+    assert not asyncio.run(evologger.publish_metrics(actual)), 'Not every output wrote them'
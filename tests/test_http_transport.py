@@ -0,0 +1,115 @@
+import time
+
+import httpretty
+import pytest
+import requests
+
+from HttpTransport import HttpTransport
+
+
+@pytest.fixture
+def mock_http():
+    httpretty.enable()
+    yield
+    httpretty.disable()
+    httpretty.reset()
+
+
+@pytest.mark.unit
+def test_each_host_has_a_session_of_its_own():
+    target = HttpTransport()
+
+    assert target.session('https://api.netatmo.com/oauth2/token') is target.session('https://api.netatmo.com/api/x')
+    assert target.session('https://api.netatmo.com/') is not target.session('https://emoncms.org/')
+
+
+@pytest.mark.unit
+def test_requests_are_given_the_timeouts(monkeypatch):
+    target = HttpTransport(connect_timeout=5, read_timeout=20)
+    timeouts = []
+    response = requests.Response()
+    response.status_code = 200
+    monkeypatch.setattr(target.session('https://emoncms.org/'), 'request',
+                        lambda method, url, **kwargs: timeouts.append(kwargs['timeout']) or response)
+
+    target.get('https://emoncms.org/input/post')
+    target.get('https://emoncms.org/input/post', timeout=1)
+
+    assert timeouts == [(5, 20), 1]
+
+
+@pytest.mark.unit
+@pytest.mark.parametrize('status', [429, 503])
+def test_requests_are_retried_when_the_server_asks(mock_http, status):
+    httpretty.register_uri(httpretty.POST, 'https://api.netatmo.com/api/getstationsdata',
+                           responses=[httpretty.Response(body='busy', status=status, adding_headers={'Retry-After': '0'}),
+                                      httpretty.Response(body='{"status": "ok"}')])
+
+    response = HttpTransport(backoff_factor=0).post('https://api.netatmo.com/api/getstationsdata', data={'a': 1},
+                                                    retry=True)
+
+    assert response.json() == {'status': 'ok'}
+
+
+@pytest.mark.unit
+def test_a_post_is_only_retried_when_it_asks_to_be(mock_http):
+    httpretty.register_uri(httpretty.POST, 'https://api.netatmo.com/oauth2/token',
+                           responses=[httpretty.Response(body='busy', status=503),
+                                      httpretty.Response(body='{"status": "ok"}')])
+
+    response = HttpTransport(backoff_factor=0).post('https://api.netatmo.com/oauth2/token', data={'a': 1})
+
+    assert response.status_code == 503
+
+
+@pytest.mark.unit
+def test_each_retry_waits_for_the_rate_limit(mock_http):
+    httpretty.register_uri(httpretty.GET, 'https://emoncms.org/input/post',
+                           responses=[httpretty.Response(body='busy', status=503),
+                                      httpretty.Response(body='busy', status=503),
+                                      httpretty.Response(body='ok')])
+    target = HttpTransport(backoff_factor=0)
+    acquired = []
+    target.rate_limiter.acquire = acquired.append
+
+    target.get('https://emoncms.org/input/post')
+
+    assert acquired == ['emoncms.org'] * 3
+
+
+@pytest.mark.unit
+def test_retry_after_is_capped(mock_http):
+    httpretty.register_uri(httpretty.GET, 'https://emoncms.org/input/post',
+                           responses=[httpretty.Response(body='busy', status=429, adding_headers={'Retry-After': '3600'}),
+                                      httpretty.Response(body='ok')])
+    started = time.monotonic()
+
+    response = HttpTransport(max_retry_after=0.01).get('https://emoncms.org/input/post')
+
+    assert response.text == 'ok'
+    assert time.monotonic() - started < 5
+
+
+@pytest.mark.unit
+def test_the_last_response_is_returned_once_out_of_retries(mock_http):
+    httpretty.register_uri(httpretty.GET, 'https://emoncms.org/input/post', body='down', status=500)
+
+    response = HttpTransport(retries=2, backoff_factor=0).get('https://emoncms.org/input/post')
+
+    assert response.status_code == 500
+
+
+@pytest.mark.unit
+def test_requests_are_recorded_against_their_host(mock_http):
+    httpretty.register_uri(httpretty.GET, 'https://emoncms.org/input/post',
+                           responses=[httpretty.Response(body='busy', status=503),
+                                      httpretty.Response(body='ok'),
+                                      httpretty.Response(body='bad', status=400)])
+    target = HttpTransport(backoff_factor=0)
+
+    target.get('https://emoncms.org/input/post')
+    target.get('https://emoncms.org/input/post')
+
+    stats = target.stats()['emoncms.org']
+    assert (stats.requests, stats.errors, stats.retries) == (2, 1, 1)
+    assert stats.max_seconds >= stats.average_seconds > 0
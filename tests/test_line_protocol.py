@@ -0,0 +1,113 @@
+from datetime import datetime, timezone
+
+import pytest
+from influxdb.line_protocol import make_lines
+
+from Metric import Metric, MetricBatch
+from plugins.LineProtocol import LineProtocolEncoder, to_epoch
+
+_TIME = datetime(2022, 1, 1, 12, 30)
+
+
+@pytest.mark.unit
+def test_actual_target_delta_and_text_are_encoded():
+    metric = Metric('evohome', 'Living Room', 20.5, 21.0, 'Auto')
+
+    lines = LineProtocolEncoder('s').encode_lines(_TIME, [metric])
+
+    assert lines == [
+        'actual,descriptor=livingroom,plugin=evohome value=20.5 1641040200',
+        'target,descriptor=livingroom,plugin=evohome value=21.0 1641040200',
+        'delta,descriptor=livingroom,plugin=evohome value=-0.5 1641040200',
+        'text,descriptor=livingroom,plugin=evohome value="Auto" 1641040200',
+    ]
+
+
+@pytest.mark.unit
+def test_series_tags_are_added_to_the_lines():
+    metric = Metric('evohome', 'Cellar', 20.5, tags={'location': 'Home Farm', 'gateway': '12345'})
+
+    assert LineProtocolEncoder('s').encode_lines(_TIME, [metric]) == [
+        r'actual,descriptor=cellar,gateway=12345,location=Home\ Farm,plugin=evohome value=20.5 1641040200']
+    assert LineProtocolEncoder('s', tags=('descriptor',)).encode_lines(_TIME, [metric]) == [
+        r'actual,descriptor=cellar,gateway=12345,location=Home\ Farm value=20.5 1641040200']
+
+
+@pytest.mark.unit
+def test_tags_given_to_a_series_first_seen_untagged_are_encoded():
+    target = LineProtocolEncoder('s', tags=('descriptor',))
+    target.encode_lines(_TIME, [Metric('evohome', 'Attic', 19.0)])
+
+    assert target.encode_lines(_TIME, [Metric('evohome', 'Attic', 19.5, tags={'location': 'London'})]) == [
+        'actual,descriptor=attic,location=London value=19.5 1641040200']
+    assert target.encode_lines(_TIME, [Metric('evohome', 'Attic', 20.0)]) == [
+        'actual,descriptor=attic value=20.0 1641040200']
+
+
+@pytest.mark.unit
+def test_missing_values_are_skipped():
+    lines = LineProtocolEncoder('s').encode_lines(_TIME, [Metric('evohome', 'hall', None, 21.0),
+                                                           Metric('evohome', 'hall', '', None, '')])
+
+    assert lines == ['target,descriptor=hall,plugin=evohome value=21.0 1641040200']
+
+
+@pytest.mark.unit
+def test_tags_and_strings_are_escaped():
+    metric = Metric('a,b=c', 'd', text='say "hi"\\')
+
+    lines = LineProtocolEncoder('s', tags=('plugin',)).encode_lines(_TIME, [metric])
+
+    assert lines == [r'text,plugin=a\,b\=c value="say \"hi\"\\" 1641040200']
+
+
+@pytest.mark.unit
+def test_metric_timestamp_overrides_the_batch_time():
+    metric = Metric('evohome', 'hall', 20.0, timestamp=datetime(2022, 1, 1, 13, 0, tzinfo=timezone.utc))
+
+    lines = LineProtocolEncoder('ms', tags=('descriptor',)).encode_lines(_TIME, [metric])
+
+    assert lines == ['actual,descriptor=hall value=20.0 1641042000000']
+
+
+@pytest.mark.unit
+@pytest.mark.parametrize('precision', ['n', 'u', 'ms', 's', 'm', 'h'])
+def test_output_matches_the_influxdb_client(precision):
+    timestamp = datetime(2022, 1, 1, 12, 30, 15, 123456)
+    metrics = [Metric('evohome', f'zone {i}', 20.0 + i / 10, 21.0, 'Auto' if i % 2 else None) for i in range(5)]
+    points = []
+    for m in metrics:
+        for name, value in (('actual', m.actual), ('target', m.target), ('delta', m.actual - m.target),
+                            ('text', m.text)):
+            if value is not None:
+                points.append({'measurement': name, 'tags': {'plugin': m.plugin, 'descriptor': m.descriptor},
+                               'time': timestamp, 'fields': {'value': value}})
+
+    encoded = LineProtocolEncoder(precision).encode(timestamp, metrics)
+
+    assert encoded.decode('utf-8') == make_lines({'points': points}, precision).strip()
+
+
+@pytest.mark.unit
+def test_epoch_of_naive_times_is_utc():
+    assert to_epoch(datetime(1970, 1, 2), 's') == 86400
+    assert to_epoch(86400, 's') == 86400
+
+
+@pytest.mark.unit
+def test_unknown_precision_is_rejected():
+    with pytest.raises(ValueError):
+        LineProtocolEncoder('seconds')
+
+
+@pytest.mark.unit
+@pytest.mark.parametrize('precision', ['n', 'u', 'ms', 's', 'h'])
+def test_batches_are_encoded_like_lists(precision):
+    metrics = [Metric('evohome', 'Living Room', 20.5, 21.0, 'Auto'),
+               Metric('darksky', 'Outside', 12.0),
+               Metric('evohome', 'Hall', None, 19.0),
+               Metric('dccapi', 'Electricity', 0.5, timestamp=datetime(2022, 1, 1, 11, 30, 0, 250))]
+
+    encoder = LineProtocolEncoder(precision)
+
+    assert encoder.encode_lines(_TIME, MetricBatch.from_metrics(metrics)) == encoder.encode_lines(_TIME, metrics)
@@ -0,0 +1,58 @@
+import math
+from datetime import datetime, timezone
+
+import pytest
+
+from Metric import MISSING_TIMESTAMP, Metric, MetricBatch
+from SeriesRegistry import REGISTRY
+
+
+def _metrics():
+    return [Metric('evohome', 'Living Room', 20.5, 21.0),
+            Metric('darksky', 'Outside', 12.0, text='Cloudy'),
+            Metric('dccapi', 'Electricity', 0.5, timestamp=datetime(2022, 1, 1, 11, 30)),
+            Metric('evohome', 'Living Room', 20.6, 21.0)]
+
+
+@pytest.mark.unit
+def test_metric_has_no_instance_dict():
+    metric = Metric('evohome', 'Hall', 20.0)
+
+    assert not hasattr(metric, '__dict__')
+    with pytest.raises(AttributeError):
+        metric.zone = 'hall'
+
+
+@pytest.mark.unit
+def test_batch_stores_metrics_column_wise():
+    batch = MetricBatch.from_metrics(_metrics())
+
+    assert len(batch) == 4
+    assert [REGISTRY.name(series_id) for series_id in batch.series_ids] == \
+        [('evohome', 'livingroom'), ('darksky', 'outside'), ('dccapi', 'electricity'), ('evohome', 'livingroom')]
+    assert list(batch.actual) == [20.5, 12.0, 0.5, 20.6]
+    assert math.isnan(batch.target[1])
+    assert batch.text == [None, 'Cloudy', None, None]
+    assert batch.timestamps[0] == MISSING_TIMESTAMP
+    assert batch.timestamps[2] == 1641036600000000
+
+
+@pytest.mark.unit
+def test_iterating_a_batch_yields_the_original_metrics():
+    metrics = _metrics()
+
+    actual = list(MetricBatch.from_metrics(metrics))
+
+    assert [(m.plugin, m.descriptor, m.actual, m.target, m.text, m.timestamp) for m in actual] == \
+        [(m.plugin, m.descriptor, m.actual, m.target, m.text, m.timestamp) for m in metrics]
+
+
+@pytest.mark.unit
+def test_appended_metrics_are_sanitised_like_metric():
+    batch = MetricBatch()
+    batch.append('EvoHome', 'Master Bedroom', '21.5', timestamp=datetime(2022, 1, 1, tzinfo=timezone.utc))
+
+    metric = batch[0]
+
+    assert (metric.plugin, metric.descriptor, metric.actual) == ('evohome', 'masterbedroom', 21.5)
+    assert metric.timestamp == datetime(2022, 1, 1)
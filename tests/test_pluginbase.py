@@ -0,0 +1,76 @@
+from datetime import datetime
+
+import pytest
+
+from AppConfig import AppConfig
+from Metric import Metric
+from plugins.PluginBase import OutputPluginBase
+
+
+class _Output(OutputPluginBase):
+    _accepts_merged_batches = True
+
+    def __init__(self, config: AppConfig) -> None:
+        self.writes = []
+        super().__init__(config, 'Test', 'output')
+
+    def _read_configuration(self, config: AppConfig):
+        pass
+
+    def _write_metrics(self, timestamp, metrics):
+        self.writes.append((timestamp, metrics))
+        return len(metrics)
+
+
+def _config(tmp_path, settings: str) -> AppConfig:
+    ini_file = tmp_path / 'config.ini'
+    ini_file.write_text(f'[Test]\n{settings}\n', encoding='UTF-8')
+    return AppConfig(str(ini_file))
+
+
+def _cycle(minute: int):
+    return datetime(2022, 1, 1, 12, minute), [Metric('evohome', 'lounge', 20.0, 21.0)]
+
+
+@pytest.mark.unit
+def test_metrics_are_written_every_cycle_by_default(tmp_path):
+    target = _Output(_config(tmp_path, ''))
+
+    assert target.write(*_cycle(1)) == 1
+    assert target.write(*_cycle(2)) == 1
+    assert len(target.writes) == 2
+
+
+@pytest.mark.unit
+def test_buffered_cycles_are_written_as_one_batch(tmp_path):
+    target = _Output(_config(tmp_path, 'flushEveryCycles=3'))
+
+    assert target.write(*_cycle(1)) == 0
+    assert target.write(*_cycle(2)) == 0
+    assert target.write(*_cycle(3)) == 3
+
+    assert len(target.writes) == 1
+    timestamp, metrics = target.writes[0]
+    assert timestamp.minute == 3
+    assert [m.timestamp.minute for m in metrics] == [1, 2, 3], 'Each metric should keep the time of its own cycle'
+
+
+@pytest.mark.unit
+def test_buffer_is_written_when_it_holds_too_many_points(tmp_path):
+    target = _Output(_config(tmp_path, 'flushEveryCycles=10\nmaxBufferedPoints=2'))
+
+    target.write(*_cycle(1))
+    target.write(*_cycle(2))
+
+    assert len(target.writes) == 1
+
+
+@pytest.mark.unit
+def test_closing_flushes_the_buffer(tmp_path):
+    target = _Output(_config(tmp_path, 'flushIntervalSeconds=3600'))
+    target.write(*_cycle(1))
+
+    target.close()
+
+    assert len(target.writes) == 1
+    assert target.flush() == 0, 'Nothing should be left to flush'
@@ -0,0 +1,73 @@
+import os
+import sys
+
+import pytest
+
+from AppConfig import AppConfig
+from pluginloader import PluginLoader
+
+_plugins_folder = os.path.join(os.path.dirname(__file__), '..', 'plugins')
+
+
+@pytest.fixture
+def config(tmp_path):
+    ini_file = tmp_path / 'config.ini'
+    ini_file.write_text('[DEFAULT]\nsimulation=true\n[Console]\n[InfluxDB2]\nhostname=localhost\nport=8086\n'
+                        'org=org\nbucket=bucket\napikey=key\n[Netatmo]\ndisabled=true\n', encoding='UTF-8')
+    return AppConfig(str(ini_file))
+
+
+@pytest.mark.unit
+def test_plugins_are_discovered_without_being_imported(config):
+    sys.modules.pop('plugins.influxdb2', None)
+
+    target = PluginLoader(config, config.sections(), _plugins_folder)
+
+    assert sorted(p['name'] for p in target.outputs) == ['console', 'influxdb2']
+    assert not target.inputs, 'Netatmo is disabled so there should be no inputs'
+    assert 'plugins.influxdb2' not in sys.modules, 'Plugin should not be imported until it is first used'
+
+
+@pytest.mark.unit
+def test_load_returns_the_same_instance_every_time(config):
+    target = PluginLoader(config, config.sections(), _plugins_folder)
+    console = next(p for p in target.outputs if p['name'] == 'console')
+
+    first = target.load(console)
+
+    assert target.load(console) is first
+    assert 'console' in target.profile
+
+
+@pytest.mark.unit
+def test_the_api_hosts_of_plugins_are_discovered(config):
+    config['Netatmo']['disabled'] = 'false'
+
+    target = PluginLoader(config, config.sections(), _plugins_folder)
+
+    assert [p['hosts'] for p in target.inputs] == [('api.netatmo.com',)]
+    assert all(p['hosts'] == () for p in target.outputs)
+
+
+@pytest.mark.unit
+def test_a_plugin_which_fails_to_open_is_opened_again_next_time(config, monkeypatch):
+    target = PluginLoader(config, config.sections(), _plugins_folder)
+    console = next(p for p in target.outputs if p['name'] == 'console')
+    opened = []
+
+    def fail_to_open(plugin):
+        opened.append(plugin)
+        if len(opened) == 1:
+            raise IOError('Unavailable')
+
+    plugin_class = type(target.load(console))
+    target.close()
+    monkeypatch.setattr(plugin_class, 'open', fail_to_open)
+
+    with pytest.raises(IOError):
+        target.load(console)
+    instance = target.load(console)
+
+    assert opened == [instance, instance]
+    target.load(console)
+    assert len(opened) == 2, 'Once open it should stay open'
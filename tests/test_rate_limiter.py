@@ -0,0 +1,120 @@
+import httpretty
+import pytest
+
+from AppConfig import AppConfig
+from HttpTransport import HttpTransport
+from RateLimiter import HostLimiter, RateLimitExceeded, RateLimiter
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds: float):
+        self.now += seconds
+
+
+@pytest.mark.unit
+def test_requests_wait_for_the_rate_limit_after_a_burst():
+    clock = _Clock()
+    target = HostLimiter('api.netatmo.com', rate_per_minute=6, burst=2, clock=clock)
+
+    for _ in range(4):
+        target.acquire(sleep=clock.sleep)
+
+    assert clock.now == 1020, 'Two requests straight away, then one every 10s'
+    assert target.throttled == 2
+
+
+@pytest.mark.unit
+def test_a_request_which_would_wait_too_long_is_abandoned():
+    clock = _Clock()
+    target = HostLimiter('api.netatmo.com', rate_per_minute=1, clock=clock)
+    target.acquire(sleep=clock.sleep)
+
+    with pytest.raises(RateLimitExceeded):
+        target.acquire(max_wait=30, sleep=clock.sleep)
+    assert target.rejected == 1
+
+
+@pytest.mark.unit
+def test_a_429_stretches_the_interval_and_slows_the_rate_limit():
+    target = HostLimiter('api.netatmo.com', rate_per_minute=8)
+
+    target.record(429)
+    target.record(429)
+
+    assert target.stretch == 4
+    assert target.effective_rate_per_minute == 2
+
+
+@pytest.mark.unit
+def test_only_repeated_failures_stretch_the_interval():
+    target = HostLimiter('consumer-api.data.n3rgy.com', failures_before_backoff=3)
+
+    for status in (503, None, 200, 500, 502):
+        target.record(status)
+    assert target.stretch == 1, 'A healthy response resets the count of failures'
+
+    target.record(504)
+    assert target.stretch == 2
+
+
+@pytest.mark.unit
+def test_the_interval_recovers_gradually_once_healthy():
+    target = HostLimiter('api.netatmo.com', recovery_factor=0.5)
+    for _ in range(3):
+        target.record(429)
+
+    stretches = []
+    for _ in range(4):
+        target.record(200)
+        stretches.append(target.stretch)
+
+    assert stretches == [4, 2, 1, 1]
+
+
+@pytest.mark.unit
+def test_the_stretch_is_capped():
+    target = HostLimiter('api.netatmo.com', max_backoff=5)
+
+    for _ in range(10):
+        target.record(429)
+
+    assert target.stretch == 5
+
+
+@pytest.mark.unit
+def test_rate_limits_are_read_from_the_config(tmp_path):
+    ini_file = tmp_path / 'config.ini'
+    ini_file.write_text('[DEFAULT]\nrateLimitBackoffFactor=3\n[RateLimits]\napi.netatmo.com=8, 5\n'
+                        'tccna.honeywell.com=20\nbad.example.com=lots\n', encoding='UTF-8')
+
+    target = RateLimiter.from_config(AppConfig(str(ini_file)))
+
+    assert (target.host('api.netatmo.com').rate_per_minute, target.host('api.netatmo.com')._bucket.capacity) == (8, 5)
+    assert target.host('tccna.honeywell.com').rate_per_minute == 20
+    assert target.host('bad.example.com').rate_per_minute is None
+    target.record('tccna.honeywell.com', 429)
+    assert target.stretch(['api.netatmo.com', 'tccna.honeywell.com']) == 3
+    assert target.stretch([]) == 1
+
+
+@pytest.mark.unit
+def test_the_transport_records_responses_with_the_rate_limiter():
+    httpretty.enable()
+    try:
+        httpretty.register_uri(httpretty.POST, 'https://api.netatmo.com/api/getstationsdata',
+                               responses=[httpretty.Response(body='busy', status=429, adding_headers={'Retry-After': '0'}),
+                                          httpretty.Response(body='{}')])
+        target = HttpTransport(backoff_factor=0, rate_limiter=RateLimiter(recovery_factor=0.75))
+
+        target.post('https://api.netatmo.com/api/getstationsdata', retry=True)
+    finally:
+        httpretty.disable()
+        httpretty.reset()
+
+    assert target.rate_limiter.host('api.netatmo.com').stretch == 1.5, 'Backed off for the 429, then recovering'
@@ -0,0 +1,193 @@
+import random
+from datetime import datetime, timedelta
+
+import pytest
+
+from Scheduler import PollingScheduler, Scheduler
+
+
+class _Clock:
+    """Moves the monotonic and system clocks on together, unless told otherwise"""
+
+    def __init__(self):
+        self.monotonic = 1000.0
+        self.wall = datetime(2022, 1, 1, 12, 0, 0)
+
+    def advance(self, seconds: float):
+        self.monotonic += seconds
+        self.wall += timedelta(seconds=seconds)
+
+
+def _scheduler(clock: _Clock, missed_ticks: str = 'skip') -> PollingScheduler:
+    return PollingScheduler(missed_ticks, clock=lambda: clock.monotonic, wall_clock=lambda: clock.wall,
+                            jitter_source=random.Random(1))
+
+
+def _names(due):
+    return [name for name, _ in due]
+
+
+@pytest.mark.unit
+def test_sleeps_until_the_next_plugin_is_due_and_only_runs_that_plugin():
+    clock = _Clock()
+    clock.advance(10)
+    target = _scheduler(clock)
+    target.add('EvoHome', '* * * * *')
+    target.add('DCCApi', '0,30 * * * *')
+
+    assert target.time_until_next_run() == 50
+    clock.advance(50)
+    assert _names(target.pop_due()) == ['EvoHome']
+    assert target.pop_due() == []
+
+    for _ in range(28):
+        clock.advance(target.time_until_next_run())
+        assert _names(target.pop_due()) == ['EvoHome']
+
+    clock.advance(target.time_until_next_run())
+    assert sorted(_names(target.pop_due())) == ['DCCApi', 'EvoHome']
+
+
+class _QuarterPast(datetime):
+    """A time which none of the ticks are on"""
+
+    @classmethod
+    def utcnow(cls):
+        return datetime(2022, 1, 1, 12, 15)
+
+
+@pytest.mark.unit
+def test_the_plugins_own_scheduler_runs_for_the_tick_it_is_handed(monkeypatch):
+    clock = _Clock()
+    target = _scheduler(clock)
+    target.add('DCCApi', '0,30 * * * *')
+    plugin_scheduler = Scheduler('DCCApi', '0,30 * * * *')
+
+    clock.advance(30 * 60 + 65)  # Late enough that croniter.match on the current time would fail
+    assert target.pop_due() == [('DCCApi', datetime(2022, 1, 1, 12, 30))]
+
+    monkeypatch.setattr('Scheduler.datetime', _QuarterPast)
+    assert not plugin_scheduler.can_run_now(), 'Only the tick the plugin is handed counts'
+    plugin_scheduler.dispatch(datetime(2022, 1, 1, 12, 30))
+    assert plugin_scheduler.can_run_now()
+    assert not plugin_scheduler.can_run_now(), 'Each tick should only be run once'
+
+
+@pytest.mark.unit
+@pytest.mark.parametrize('policy, expected', [('skip', []), ('catchup', ['EvoHome'])])
+def test_missed_ticks(policy, expected):
+    clock = _Clock()
+    target = _scheduler(clock, policy)
+    target.add('EvoHome', '* * * * *')
+
+    clock.advance(60 * 5 + 10)
+
+    assert _names(target.pop_due()) == expected
+    assert target.time_until_next_run() == 50, 'Should carry on with the next tick in the future'
+
+
+@pytest.mark.unit
+def test_a_late_tick_is_not_a_missed_tick():
+    clock = _Clock()
+    target = _scheduler(clock)
+    target.add('EvoHome', '* * * * *')
+
+    clock.advance(75)
+
+    assert _names(target.pop_due()) == ['EvoHome']
+
+
+@pytest.mark.unit
+def test_a_tick_is_due_when_it_has_passed_on_the_system_clock():
+    clock = _Clock()
+    target = _scheduler(clock)
+    target.add('EvoHome', '* * * * *')
+
+    clock.wall += timedelta(seconds=60)  # e.g. suspended, when the monotonic clock doesn't move
+
+    assert target.time_until_next_run() == 0
+    assert _names(target.pop_due()) == ['EvoHome']
+
+
+@pytest.mark.unit
+def test_an_offset_delays_the_poll_but_not_the_tick():
+    clock = _Clock()
+    clock.advance(20)
+    target = _scheduler(clock)
+    target.add('EvoHome', '* * * * *', offset=15)
+
+    assert target.time_until_next_run() == 55
+    clock.advance(54)
+    assert target.pop_due() == []
+    clock.advance(1)
+    assert target.pop_due() == [('EvoHome', datetime(2022, 1, 1, 12, 1))]
+    assert target.time_until_next_run() == 60
+
+
+@pytest.mark.unit
+def test_an_offset_tick_still_pending_is_not_skipped():
+    clock = _Clock()
+    clock.advance(10)
+    target = _scheduler(clock)
+    target.add('EvoHome', '* * * * *', offset=30)
+
+    assert target.time_until_next_run() == 20, 'The 12:00 tick is run at 12:00:30, which is still to come'
+
+
+@pytest.mark.unit
+def test_jitter_stays_within_its_window():
+    clock = _Clock()
+    target = _scheduler(clock)
+    target.add('EvoHome', '* * * * *', offset=5, jitter=10)
+
+    waits = []
+    for _ in range(50):
+        wait = target.time_until_next_run()
+        clock.advance(wait)
+        waits.append(clock.wall.second + clock.wall.microsecond / 1000000)
+        assert _names(target.pop_due()) == ['EvoHome']
+
+    assert all(5 <= w <= 15 for w in waits)
+    assert len(set(waits)) > 1, 'A fresh amount of jitter should be used for each tick'
+
+
+@pytest.mark.unit
+def test_stagger_spreads_the_plugins_across_the_interval():
+    clock = _Clock()
+    target = _scheduler(clock)
+    for name in ('EvoHome', 'Netatmo', 'DarkSky', 'DCCApi'):
+        target.add(name, '*/4 * * * *')
+    target.stagger()
+
+    fired = []
+    while len(fired) < 4:
+        clock.advance(target.time_until_next_run())
+        fired += [(name, clock.wall) for name, _ in target.pop_due()]
+
+    # Started on the 12:00 tick, so the plugins offset from it are still to run for it
+    assert fired == [('Netatmo', datetime(2022, 1, 1, 12, 1)),
+                     ('DarkSky', datetime(2022, 1, 1, 12, 2)),
+                     ('DCCApi', datetime(2022, 1, 1, 12, 3)),
+                     ('EvoHome', datetime(2022, 1, 1, 12, 4))]
+
+
+@pytest.mark.unit
+def test_ticks_are_skipped_while_the_polling_interval_is_stretched():
+    clock = _Clock()
+    stretch = {'EvoHome': 1.0}
+    target = PollingScheduler(clock=lambda: clock.monotonic, wall_clock=lambda: clock.wall,
+                              stretch=lambda name: stretch[name])
+    target.add('EvoHome', '* * * * *')
+
+    def minutes_run(count):
+        minutes = []
+        for _ in range(count):
+            clock.advance(target.time_until_next_run())
+            minutes += [tick.minute for _, tick in target.pop_due()]
+        return minutes
+
+    assert minutes_run(2) == [1, 2]
+    stretch['EvoHome'] = 2.5
+    assert minutes_run(6) == [5, 8], 'Runs every 3 minutes, the first tick at least 2.5 minutes after the last run'
+    stretch['EvoHome'] = 1.0
+    assert minutes_run(2) == [9, 10]
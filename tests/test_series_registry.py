@@ -0,0 +1,62 @@
+import pytest
+
+from Metric import Metric
+from SeriesRegistry import SeriesCache, SeriesRegistry
+
+
+@pytest.mark.unit
+def test_a_series_gets_the_same_id_however_it_is_written():
+    target = SeriesRegistry()
+
+    first = target.get_id('EvoHome', 'Living Room')
+
+    assert target.get_id('EvoHome', 'Living Room') == first
+    assert target.get_id('evohome', 'livingroom') == first
+    assert target.get_id('evohome', 'hall') != first
+    assert target.name(first) == ('evohome', 'livingroom')
+    assert len(target) == 2
+
+
+@pytest.mark.unit
+def test_hits_and_misses_are_counted():
+    target = SeriesRegistry()
+
+    for _ in range(3):
+        target.get_id('evohome', 'Hall')
+
+    assert (target.hits, target.misses) == (2, 1)
+    assert target.hit_rate == pytest.approx(2 / 3)
+
+
+@pytest.mark.unit
+def test_metrics_share_the_interned_names():
+    first = Metric('EvoHome', 'Living Room', 20.0)
+    second = Metric('evohome', 'livingroom', 21.0)
+
+    assert first.series_id == second.series_id
+    assert first.descriptor is second.descriptor
+
+
+@pytest.mark.unit
+def test_series_cache():
+    target = SeriesCache()
+
+    target.set(5, 'prefix')
+
+    assert target.get(5) == 'prefix'
+    assert target.get(4) is None
+    assert target.get(100) is None
+
+
+@pytest.mark.unit
+def test_the_tags_are_part_of_the_series():
+    target = SeriesRegistry()
+
+    untagged = target.get_id('evohome', 'Kitchen')
+    london = target.get_id('evohome', 'Kitchen', {'location': 'London', 'gateway': 12345})
+
+    assert london != untagged
+    assert target.get_id('EvoHome', 'kitchen', {'gateway': '12345', 'location': 'London'}) == london
+    assert target.get_id('evohome', 'Kitchen', {'location': 'Dublin'}) not in (untagged, london)
+    assert target.tags(untagged) is None, 'Tags given to another series should not change this one'
+    assert target.tags(london) == {'location': 'London', 'gateway': 12345}
@@ -0,0 +1,74 @@
+from datetime import datetime
+
+import pytest
+
+from Metric import Metric
+from Spool import Spool
+
+
+def _batch(minute: int, size: int = 2):
+    return datetime(2022, 1, 1, 12, minute), [Metric('evohome', f'zone{i}', 20.0 + i, 21.0) for i in range(size)]
+
+
+@pytest.fixture
+def target(tmp_path):
+    return Spool(str(tmp_path), 'Test', max_bytes=1024 * 1024, max_age_seconds=3600, segment_bytes=1024)
+
+
+@pytest.mark.unit
+def test_failed_batches_are_replayed_oldest_first(target):
+    target.append(*_batch(1))
+    target.append(*_batch(2))
+    written = []
+
+    assert target.replay(lambda t, m: written.append((t, m)), batch_size=100, merge=False)
+
+    assert [t.minute for t, _ in written] == [1, 2]
+    assert target.is_empty()
+    assert (target.spooled, target.replayed, target.dropped) == (4, 4, 0)
+
+
+@pytest.mark.unit
+def test_merged_replay_stamps_each_metric_with_its_batch_time(target):
+    target.append(*_batch(1))
+    target.append(*_batch(2))
+    written = []
+
+    target.replay(lambda t, m: written.append((t, m)), batch_size=100, merge=True)
+
+    assert len(written) == 1, 'Expected both batches to be merged into one write'
+    assert [m.timestamp.minute for m in written[0][1]] == [1, 1, 2, 2]
+
+
+@pytest.mark.unit
+def test_replay_stops_at_the_first_failure_and_keeps_the_rest(target):
+    for minute in range(3):
+        target.append(*_batch(minute))
+    written = []
+
+    def write(timestamp, metrics):
+        if timestamp.minute == 1:
+            raise IOError('Output unavailable')
+        written.append(timestamp)
+
+    assert not target.replay(write, batch_size=100, merge=False)
+    assert target.replay(lambda t, m: written.append(t), batch_size=100, merge=False)
+
+    assert [t.minute for t in written] == [0, 1, 2], 'Batches should not be replayed twice'
+
+
+@pytest.mark.unit
+def test_oldest_segments_are_dropped_when_the_spool_is_too_big(tmp_path):
+    target = Spool(str(tmp_path), 'Test', max_bytes=2048, max_age_seconds=3600, segment_bytes=512)
+
+    for minute in range(20):
+        target.append(*_batch(minute, size=5))
+
+    assert target.dropped > 0
+    assert target.spooled - target.dropped == sum(len(m) for _, m in _replay_all(target))
+
+
+def _replay_all(spool):
+    written = []
+    spool.replay(lambda t, m: written.append((t, m)), batch_size=100, merge=False)
+    return written
@@ -0,0 +1,111 @@
+import json
+import os
+import threading
+import time
+
+import pytest
+
+from TokenStore import TokenStore, get_token_store
+
+
+@pytest.mark.unit
+def test_tokens_are_written_and_read_back(tmp_path):
+    filename = str(tmp_path / 'tokens.json')
+
+    TokenStore(filename).write(['access', 'refresh', '2022-01-01 12:00:00.000000'])
+
+    assert TokenStore(filename).read() == ['access', 'refresh', '2022-01-01 12:00:00.000000']
+    assert sorted(os.listdir(tmp_path)) == ['tokens.json', 'tokens.json.lock'], 'No temporary files should be left'
+
+
+@pytest.mark.unit
+def test_there_are_no_tokens_without_a_file(tmp_path):
+    assert TokenStore(str(tmp_path / 'tokens.json')).read() is None
+
+
+@pytest.mark.unit
+def test_the_file_is_only_read_again_once_it_has_changed(tmp_path):
+    filename = str(tmp_path / 'tokens.json')
+    target = TokenStore(filename)
+    target.write(['first'])
+    stat = os.stat(filename)
+
+    with open(filename, 'w', encoding='UTF-8') as f:
+        json.dump(['other'], f)  # The same size as the first
+    os.utime(filename, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    assert target.read() == ['first']
+
+    os.utime(filename, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1000000))
+    assert target.read() == ['other']
+
+
+@pytest.mark.unit
+def test_unchanged_tokens_are_not_written(tmp_path):
+    filename = str(tmp_path / 'tokens.json')
+    target = TokenStore(filename)
+    target.write(['access'])
+    written = os.stat(filename).st_mtime_ns
+
+    time.sleep(0.01)
+    target.write(['access'])
+
+    assert os.stat(filename).st_mtime_ns == written
+
+
+@pytest.mark.unit
+def test_tokens_refreshed_by_someone_else_are_used_rather_than_getting_new_ones(tmp_path):
+    filename = str(tmp_path / 'tokens.json')
+    TokenStore(filename).write(['stale'])
+    TokenStore(filename).write(['fresh'])  # e.g. by another process
+
+    actual = TokenStore(filename).refresh(['stale'], lambda current: pytest.fail('Should not get new tokens'))
+
+    assert actual == ['fresh']
+
+
+@pytest.mark.unit
+def test_tokens_saved_by_someone_else_are_not_replaced(tmp_path):
+    filename = str(tmp_path / 'tokens.json')
+    target = TokenStore(filename)
+    target.write(['stale'])
+    TokenStore(filename).write(['fresh'])  # e.g. by another process
+
+    assert not target.replace(['stale'], ['mine'])
+    assert TokenStore(filename).read() == ['fresh']
+    assert target.replace(['fresh'], ['mine'])
+    assert TokenStore(filename).read() == ['mine']
+
+
+@pytest.mark.unit
+def test_a_failed_refresh_leaves_the_tokens_alone(tmp_path):
+    filename = str(tmp_path / 'tokens.json')
+    target = TokenStore(filename)
+    target.write(['stale'])
+
+    assert target.refresh(['stale'], lambda current: None) is None
+    assert TokenStore(filename).read() == ['stale']
+
+
+@pytest.mark.unit
+@pytest.mark.parametrize('shared', [True, False], ids=['threads', 'processes'])
+def test_concurrent_refreshes_only_get_new_tokens_once(tmp_path, shared):
+    filename = str(tmp_path / 'tokens.json')
+    TokenStore(filename).write(['stale'])
+    fetches = []
+
+    def fetch(current):
+        fetches.append(current)
+        time.sleep(0.05)
+        return ['fresh']
+
+    # Separate stores, each with a lock file handle of its own, stand in for separate processes
+    stores = [get_token_store(filename) if shared else TokenStore(filename) for _ in range(4)]
+    results = []
+    threads = [threading.Thread(target=lambda s=s: results.append(s.refresh(['stale'], fetch))) for s in stores]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert fetches == [['stale']]
+    assert results == [['fresh']] * 4